@@ -10,6 +10,10 @@ import fileinput
 from get_brand_info import get_brand_info
 from snowflake2utc import snowflake2utc
 import enrichment_functions as enrich
+from conversation_container import read_conversations, write_conversation
+from conversation_aggregates import ConversationAggregator
+import stream_io
+import stage_metrics
 
 
 def add_enrichments(conversation_payload, brands = []):
@@ -77,12 +81,25 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--log', default = 'add_enrichments.log', help='name of log file')
     parser.add_argument('--brand_info', default = None)
-    parser.add_argument('--input', default = '-', help='name of input Tweet data, default is stdin')
+    stream_io.add_input_arguments(parser, 'input conversation file name(s) or glob(s), default is stdin')
+    stream_io.add_output_arguments(parser)
+    parser.add_argument('--input_format', choices = ['json', 'binary'], default = 'json', help='format of the input conversation payloads')
+    parser.add_argument('--output_format', choices = ['json', 'binary'], default = 'json', help='format of the output conversation payloads')
+    parser.add_argument('--aggregate', action='store_true',
+        help='instead of enriched conversations, output one JSON summary of the enrichments by brand and time (see conversation_aggregates.py)')
+    parser.add_argument('--aggregate_bucket', choices = ['hour', 'day', 'none'], default = 'day',
+        help='time buckets of the --aggregate summary, by root Tweet time, default day')
+    parser.add_argument('--relative_accuracy', type = float, default = 0.01,
+        help='relative accuracy of the --aggregate quantiles, default 0.01')
+    parser.add_argument('--merge_aggregates', action='store_true',
+        help='the input is --aggregate summaries (one per line), output one merged summary')
+    stage_metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
 
     logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
     logging.debug('###################################################################### ' + 
         'adding enrichments to conversations from '.format(args.input))
+    stage_metrics.configure_from_args(args)
 
     # add brand enrichments
     if args.brand_info is not None:
@@ -91,21 +108,44 @@ if __name__ == '__main__':
     else:
         do_brand_enrichments = False
 
-    for line in fileinput.input(args.input):
-        # deserialize the JSON
-        try:
-            conversation_payload = ujson.loads(line)
-        except ValueError:
-            continue
-        if ("tweets" in conversation_payload) and ("depths" in conversation_payload):
+    output = stream_io.writer_from_args(args)
+    if args.merge_aggregates:
+        aggregator = None
+        for line in stream_io.read_lines(args.input, args.input_workers):
+            summary = ConversationAggregator.from_dict(ujson.loads(line))
+            if aggregator is None:
+                aggregator = summary
+            else:
+                try:
+                    aggregator.merge(summary)
+                except ValueError as e:
+                    parser.error("can't merge the --merge_aggregates inputs: {}".format(e))
+        if aggregator is not None:
+            output.write((ujson.dumps(aggregator.to_dict()) + "\n").encode("utf-8"))
+        output.close()
+        sys.exit(0)
+    if args.aggregate:
+        aggregator = ConversationAggregator(brands if do_brand_enrichments else None,
+            None if args.aggregate_bucket == "none" else args.aggregate_bucket, args.relative_accuracy)
+        metrics = stage_metrics.stage("aggregate_enrichments")
+    else:
+        metrics = stage_metrics.stage("add_enrichments")
+    for conversation_payload in read_conversations(args.input, args.input_format, input_workers = args.input_workers):
+        if args.aggregate and ("tweets" in conversation_payload) and ("depths" in conversation_payload):
+            aggregator.add(conversation_payload)
+            metrics.add_items()
+        elif ("tweets" in conversation_payload) and ("depths" in conversation_payload):
             # add enrichments
             conversation_payload = add_enrichments(conversation_payload)
             if do_brand_enrichments:
                 conversation_payload = add_brand_enrichments(conversation_payload, brands)
-            print(ujson.dumps(conversation_payload))
+            metrics.add_items()
+            write_conversation(conversation_payload, args.output_format, output)
         else:
-            logging.warn("WARNING: Found a conversation that is not a valid conversation payload on line {}".format(fileinput.lineno()))
-            logging.warn("WARNING: Skipping line {}".format(fileinput.lineno()))        
-
-
-
+            logging.warn("WARNING: Found a conversation that is not a valid conversation payload, skipping it")
+    if args.aggregate:
+        metrics.set_gauge("groups", len(aggregator.groups))
+    metrics.finish()
+    if args.aggregate:
+        output.write((ujson.dumps(aggregator.to_dict()) + "\n").encode("utf-8"))
+    output.close()
@@ -18,8 +18,12 @@ from get_brand_info import get_brand_info
 import add_enrichments
 from snowflake2utc import snowflake2utc
 from make_twitter_api_call import get_authentication, make_twitter_api_call
+from conversation_container import read_conversations, write_conversation
+from field_projection import add_projection_arguments, projection_from_args
+import stream_io
+import stage_metrics
 
-def collect_missing_tweets(filename = "-", max_convos_in_memory = 1000, tweets_per_call = 100):
+def collect_missing_tweets(filename = "-", max_convos_in_memory = 1000, tweets_per_call = 100, input_format = "json", input_workers = 1):
     '''
     Iterator to batch missing Tweets into sets of 100 to make efficient API calls.
 
@@ -30,19 +34,28 @@ def collect_missing_tweets(filename = "-", max_convos_in_memory = 1000, tweets_p
     These lists can then be used to call the Twitter API and insert the missing Tweets into the conversations.
 
     A conversation with no missing Tweets will be returned with an empty list of "Tweets to query"
+
+    input_format is "json" (one conversation payload per line) or "binary" (see conversation_container.py)
+    filename can also be a list of files or globs, compressed files are read in input_workers processes (see stream_io.py)
+    '''
+    # deserialize (bad JSON payloads are logged and skipped by the reader)
+    conversation_payloads = read_conversations(filename, input_format, input_workers = input_workers)
+    for batch in batch_missing_tweets(conversation_payloads, max_convos_in_memory, tweets_per_call):
+        yield(batch)
+
+def batch_missing_tweets(conversation_payloads, max_convos_in_memory = 1000, tweets_per_call = 100):
+    '''
+    collect_missing_tweets for an iterable of conversation payloads (Python dictionaries) instead of a file.
+    Yields (list of Tweet ids to query, list of conversations from which those Tweets are missing)
     '''
     # get the logger
     logging.getLogger("root")
     # read in the data
     tweets_to_query = []
     convos_in_memory = []
-    for line in fileinput.input(filename):
-        # deserialize
-        try:
-            conversation_payload = ujson.loads(line)
-        except ValueError:
-            logging.warn("Found a bad JSON payload on line {}".format(fileinput.lineno()))
-            continue
+    metrics = stage_metrics.stage("collect_missing_tweets")
+    for conversation_payload in conversation_payloads:
+        metrics.add_items()
         # get the missing Tweets
         missing_tweets = [x["missing_tweet_id"] for x in conversation_payload["tweets"] if "missing_tweet_id" in x]
         # If there are no missing Tweets, pass this conversation through and move on
@@ -56,6 +69,7 @@ def collect_missing_tweets(filename = "-", max_convos_in_memory = 1000, tweets_p
             convos_in_memory.append(conversation_payload)
         else:
             # query the Tweets, carry over the current convo for next time
+            metrics.set_gauge("conversations_in_memory", len(convos_in_memory))
             yield((tweets_to_query, convos_in_memory))
             logging.debug("Yielding {} Tweets to query missing Tweets".format(len(tweets_to_query)))
             tweets_to_query = missing_tweets
@@ -64,9 +78,10 @@ def collect_missing_tweets(filename = "-", max_convos_in_memory = 1000, tweets_p
     if len(convos_in_memory) > 0:
         logging.debug("Yielding {} Tweets to query missing Tweets at the end of the loop".format(len(tweets_to_query)))
         yield((tweets_to_query, convos_in_memory)) 
+    metrics.finish()
 
         
-def insert_missing_tweets(conversations_in_memory, recovered_tweets_dict):
+def insert_missing_tweets(conversations_in_memory, recovered_tweets_dict, projection = None):
     '''
     Take a list of conversations, and a dictionary (keyed by Tweet ID) of the Tweets that were missing from those conversations.
     Insert the recovered tweets into the conversation and return a conversation payload dictionary, with the fields: 
@@ -87,10 +102,15 @@ def insert_missing_tweets(conversations_in_memory, recovered_tweets_dict):
     is *not* recovered, and its depth is  = {depth of Tweet that replied to it} - 1
 
     If a conversation has no missing Tweets at all, add empty lists for all of these extra fields
+
+    If projection (a field_projection.FieldProjection) is given, recovered Tweets are trimmed to its fields
     '''
+    # the callers finish the stage once all of the batches are done
+    metrics = stage_metrics.stage("insert_missing_tweets")
     # hydrate the conversation
     # for each conversation that we currently have in memory (up to 100)
     for conversation_payload in conversations_in_memory:
+        metrics.add_items()
         # fields that may need updating
         tweets = []
         ids_to_depths_dict = dict(zip([fg.tweet_id(x) for x in conversation_payload["tweets"]], 
@@ -108,6 +128,8 @@ def insert_missing_tweets(conversations_in_memory, recovered_tweets_dict):
                 # see if it was returned by the request (if not, it may have been deleted)
                 try:
                     recovered_tweet = recovered_tweets_dict[tweet["missing_tweet_id"]]
+                    if projection is not None:
+                        recovered_tweet = projection.project(recovered_tweet)
                     tweets.append(recovered_tweet)
                     recovered_tweets_ids.append(fg.tweet_id(recovered_tweet))
                     # if it was a reply we have another "missing" Tweet
@@ -140,6 +162,30 @@ def insert_missing_tweets(conversations_in_memory, recovered_tweets_dict):
         # print the conversation payload
         yield(conversation_payload)
 
+def add_missing_tweets(conversation_payloads, auth, max_convos_in_memory = 10000, tweets_per_call = 100, projection = None):
+    '''
+    Iterator over conversation payloads with missing Tweets recovered from the Twitter Public API where possible
+    (see insert_missing_tweets for the fields that are added).
+    Takes an iterable of conversation payloads (Python dictionaries) and an OAuth1 object from get_authentication.
+    Recovered Tweets are trimmed to the fields of projection (a field_projection.FieldProjection), if it is given.
+    API calls are rate limited, with the limits hardcoded here: 15 minute window, 180 requests per window
+    '''
+    # Keep track of when queries have been made so that we don't go over the request limit
+    window = datetime.timedelta(minutes = 15)
+    possible_requests_per_window = 180
+    request_times = [datetime.datetime.now() - datetime.timedelta(days = 1)]
+    api_metrics = stage_metrics.stage("twitter_api")
+    insert_metrics = stage_metrics.stage("insert_missing_tweets")
+    for tweets_to_query,convos in batch_missing_tweets(conversation_payloads, max_convos_in_memory, tweets_per_call):
+        # get the Tweets
+        recovered_tweets_dict = make_twitter_api_call(tweets_to_query, request_times, 
+                window, possible_requests_per_window, auth)
+        # insert the Tweets into the conversations
+        for conversation_payload in insert_missing_tweets(convos, recovered_tweets_dict, projection):
+            yield(conversation_payload)
+    api_metrics.finish()
+    insert_metrics.finish()
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
@@ -148,19 +194,21 @@ if __name__ == '__main__':
     parser.add_argument('--credentials', default = '.twurlrc', help='credentials for hitting the Twitter Public API, path from your HOME directory')
     parser.add_argument('--add_enrichments', action='store_true', help='add (or update) enrichment fields to these conversations')
     parser.add_argument('--brand_info', default = None, help='csv of brand screen name and brand id (e.g.: "notFromShrek,5555555"), used if you are updating enrichements')
+    parser.add_argument('--input_format', choices = ['json', 'binary'], default = 'json', help='format of the input conversation payloads')
+    parser.add_argument('--output_format', choices = ['json', 'binary'], default = 'json', help='format of the output conversation payloads')
+    stream_io.add_input_arguments(parser, 'input conversation file name(s) or glob(s), default is stdin')
+    stream_io.add_output_arguments(parser)
+    add_projection_arguments(parser)
+    stage_metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
 
     logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
     logging.debug('###################################################################### ' + 
         'adding missing Tweets to a set of conversations')
+    stage_metrics.configure_from_args(args)
 
     # get your credentials 
     auth = get_authentication(args.credentials)
-    # Keep track of when queries have been made so that we don't go over the request limit
-    # Twitter API limits are hardcoded here: 15 minute window, 180 requests per window
-    window = datetime.timedelta(minutes = 15)
-    possible_requests_per_window = 180
-    request_times = [datetime.datetime.now() - datetime.timedelta(days = 1)]
 
     # add missing Tweets to conversation payloads
     # get brand info if you need it
@@ -171,17 +219,19 @@ if __name__ == '__main__':
         else:
             do_brand_enrichments = False
 
-    for tweets_to_query,convos in collect_missing_tweets(filename = "-", 
-                max_convos_in_memory = 10000, tweets_per_call = 100):
-        # get the Tweets
-        recovered_tweets_dict = make_twitter_api_call(tweets_to_query, request_times, 
-                window, possible_requests_per_window, auth)
-        # insert the Tweets into the conversations
-        for conversation_payload in insert_missing_tweets(convos, recovered_tweets_dict):
-            # optionally update enrichments in the conversation payload
-            if args.add_enrichments:
-                # add enrichments
-                conversation_payload = add_enrichments.add_enrichments(conversation_payload)
-                if do_brand_enrichments:
-                    conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
-            print(ujson.dumps(conversation_payload))
+    output = stream_io.writer_from_args(args)
+    enrich_metrics = stage_metrics.stage("add_enrichments") if args.add_enrichments else None
+    conversation_payloads = read_conversations(args.input, args.input_format, input_workers = args.input_workers)
+    for conversation_payload in add_missing_tweets(conversation_payloads, auth, 
+                max_convos_in_memory = 10000, tweets_per_call = 100, projection = projection_from_args(args)):
+        # optionally update enrichments in the conversation payload
+        if args.add_enrichments:
+            # add enrichments
+            conversation_payload = add_enrichments.add_enrichments(conversation_payload)
+            if do_brand_enrichments:
+                conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
+            enrich_metrics.add_items()
+        write_conversation(conversation_payload, args.output_format, output)
+    if enrich_metrics is not None:
+        enrich_metrics.finish()
+    output.close()
@@ -0,0 +1,200 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import random
+import datetime
+import argparse
+import ujson
+
+'''
+Synthetic Tweet data for benchmarking.
+
+Generates conversation trees of Tweets in the Gnip activity-streams format (postedTime, inReplyTo.link),
+the original Twitter API format (created_at, in_reply_to_status_id_str) or a mix of the two.
+The shape of the trees is configurable:
+    - branching_factor: mean number of replies to the root of a conversation
+    - depth_decay: the mean number of replies to a Tweet at depth d is branching_factor * depth_decay**d
+    - max_depth: no replies deeper than this
+    - missing_parent_rate: fraction of Tweets that are left out of the data (but still replied to)
+    - viral_rate, viral_size: fraction of conversations whose root gets viral_size direct replies
+'''
+
+# Twitter's snowflake epoch, in milliseconds
+TWEPOCH = 1288834974657
+
+def snowflake_id(timestamp, sequence):
+    '''Make a Tweet id (as a string) for a unix timestamp (seconds) and a sequence number'''
+    return str(((int(timestamp * 1000) - TWEPOCH) << 22) | (sequence % (1 << 22)))
+
+def make_users(num_users, num_brands):
+    '''Make a list of users {"screen_name": _, "user_id": _}, the first num_brands of them are "brands"'''
+    users = []
+    for i in range(num_users):
+        prefix = "brand" if i < num_brands else "user"
+        users.append({"screen_name": "{}{}".format(prefix, i), "user_id": str(1000000 + i)})
+    return users
+
+def activity_streams_tweet(tweet_id, timestamp, user, text, parent):
+    '''Tweet payload in the Gnip activity-streams format. parent is None or (parent id, parent user)'''
+    tweet = {
+        "id": "tag:search.twitter.com,2005:" + tweet_id,
+        "objectType": "activity",
+        "verb": "post",
+        "postedTime": datetime.datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "actor": {"objectType": "person", "id": "id:twitter.com:" + user["user_id"],
+                  "link": "http://www.twitter.com/" + user["screen_name"],
+                  "displayName": user["screen_name"].title(), "preferredUsername": user["screen_name"]},
+        "body": text,
+        "link": "http://twitter.com/{}/statuses/{}".format(user["screen_name"], tweet_id),
+        "twitter_entities": {"hashtags": [], "urls": [],
+                             "user_mentions": [] if parent is None else
+                                [{"screen_name": parent[1]["screen_name"], "id_str": parent[1]["user_id"]}]},
+    }
+    if parent is not None:
+        tweet["inReplyTo"] = {"link": "http://twitter.com/{}/statuses/{}".format(parent[1]["screen_name"], parent[0])}
+    return tweet
+
+def original_format_tweet(tweet_id, timestamp, user, text, parent):
+    '''Tweet payload in the original Twitter API format. parent is None or (parent id, parent user)'''
+    return {
+        "created_at": datetime.datetime.utcfromtimestamp(timestamp).strftime("%a %b %d %H:%M:%S +0000 %Y"),
+        "id": int(tweet_id),
+        "id_str": tweet_id,
+        "text": text,
+        "truncated": False,
+        "in_reply_to_status_id": None if parent is None else int(parent[0]),
+        "in_reply_to_status_id_str": None if parent is None else parent[0],
+        "in_reply_to_user_id": None if parent is None else int(parent[1]["user_id"]),
+        "in_reply_to_user_id_str": None if parent is None else parent[1]["user_id"],
+        "in_reply_to_screen_name": None if parent is None else parent[1]["screen_name"],
+        "user": {"id": int(user["user_id"]), "id_str": user["user_id"],
+                 "name": user["screen_name"].title(), "screen_name": user["screen_name"]},
+        "entities": {"hashtags": [], "urls": [],
+                     "user_mentions": [] if parent is None else
+                        [{"screen_name": parent[1]["screen_name"], "id_str": parent[1]["user_id"]}]},
+    }
+
+def add_metadata_fields(tweet, metadata_fields):
+    '''
+    Pad a Tweet with nested structure (user profile fields and a list of small objects), the way real payloads
+    have a lot more structure than just their text
+    '''
+    user = tweet["actor"] if "actor" in tweet else tweet["user"]
+    for i in range(metadata_fields):
+        user["profile_field_{}".format(i)] = [i, "value {}".format(i), None, True][i % 4]
+    tweet["metadata"] = [{"id": i, "id_str": str(i), "indices": [i, i + 1], "size": {"w": 100, "h": 100, "resize": "fit"}}
+                         for i in range(metadata_fields // 4)]
+    return tweet
+
+def _poisson(mean, rng):
+    # Knuth's algorithm, fine for the small means used here
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, int(round(rng.gauss(mean, mean ** 0.5))))
+    limit = 2.718281828459045 ** (-mean)
+    k = 0
+    p = rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+def generate_conversations(num_conversations = 1000, branching_factor = 1.5, depth_decay = 0.5, max_depth = 10,
+        missing_parent_rate = 0.05, viral_rate = 0.001, viral_size = 1000, tweet_format = "mixed",
+        num_users = 10000, num_brands = 10, brand_reply_rate = 0.1, payload_bytes = 1000,
+        start_time = 1467331200, time_window = 86400, seed = 0, metadata_fields = 0):
+    '''
+    Iterator over synthetic conversations. Yields (tweets, missing_tweets) for each conversation,
+    where tweets are the payloads that are in the data, and missing_tweets are the payloads that were left out
+    (they are still referenced by replies). tweet_format is "activity-streams", "original" or "mixed".
+    metadata_fields > 0 adds that much nested padding to each Tweet (see add_metadata_fields).
+    '''
+    rng = random.Random(seed)
+    users = make_users(num_users, num_brands)
+    brands = users[:num_brands]
+    filler = "lorem ipsum dolor sit amet " * (1 + payload_bytes // 27)
+    sequence = 0
+    for _ in range(num_conversations):
+        root_time = start_time + rng.random() * time_window
+        # (user, time, depth, parent)
+        queue = [(rng.choice(users[num_brands:]), root_time, 0, None)]
+        is_viral = rng.random() < viral_rate
+        tweets = []
+        missing_tweets = []
+        while len(queue) > 0:
+            user, timestamp, depth, parent = queue.pop()
+            sequence += 1
+            tweet_id = snowflake_id(timestamp, sequence)
+            text = "@{} {}".format(parent[1]["screen_name"], filler[:payload_bytes]) if parent is not None else filler[:payload_bytes]
+            if (tweet_format == "activity-streams") or ((tweet_format == "mixed") and (rng.random() < 0.5)):
+                tweet = activity_streams_tweet(tweet_id, timestamp, user, text, parent)
+            else:
+                tweet = original_format_tweet(tweet_id, timestamp, user, text, parent)
+            if metadata_fields > 0:
+                tweet = add_metadata_fields(tweet, metadata_fields)
+            if rng.random() < missing_parent_rate:
+                missing_tweets.append(tweet)
+            else:
+                tweets.append(tweet)
+            if depth >= max_depth:
+                continue
+            if is_viral and (depth == 0):
+                num_replies = viral_size
+            else:
+                num_replies = _poisson(branching_factor * (depth_decay ** depth), rng)
+            for _ in range(num_replies):
+                if rng.random() < brand_reply_rate:
+                    reply_user = rng.choice(brands)
+                else:
+                    reply_user = rng.choice(users)
+                reply_time = timestamp + rng.expovariate(1.0 / 600)
+                queue.append((reply_user, reply_time, depth + 1, (tweet_id, user)))
+        yield((tweets, missing_tweets))
+
+def generate_tweets(**kwargs):
+    '''
+    Iterator over the Tweets (that are in the data) of generate_conversations(**kwargs)
+    '''
+    for tweets, _ in generate_conversations(**kwargs):
+        for tweet in tweets:
+            yield(tweet)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_conversations', type = int, default = 1000)
+    parser.add_argument('--branching_factor', type = float, default = 1.5, help='mean number of replies to a root Tweet')
+    parser.add_argument('--depth_decay', type = float, default = 0.5, help='mean replies at depth d = branching_factor * depth_decay**d')
+    parser.add_argument('--max_depth', type = int, default = 10)
+    parser.add_argument('--missing_parent_rate', type = float, default = 0.05, help='fraction of Tweets left out of the data')
+    parser.add_argument('--viral_rate', type = float, default = 0.001, help='fraction of conversations that go viral')
+    parser.add_argument('--viral_size', type = int, default = 1000, help='number of direct replies to a viral root Tweet')
+    parser.add_argument('--format', default = 'mixed', choices = ['activity-streams', 'original', 'mixed'])
+    parser.add_argument('--num_users', type = int, default = 10000)
+    parser.add_argument('--num_brands', type = int, default = 10)
+    parser.add_argument('--payload_bytes', type = int, default = 1000, help='approximate size of the Tweet text padding')
+    parser.add_argument('--metadata_fields', type = int, default = 0, help='number of nested padding fields per Tweet (real Tweets have ~50)')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--brand_info', default = None, help='also write a --brand_info CSV of the brand users to this file')
+    parser.add_argument('--missing_tweets', default = None, help='also write the Tweets that were left out of the data to this file')
+    args = parser.parse_args()
+
+    missing_output = open(args.missing_tweets, "w") if args.missing_tweets is not None else None
+    for tweets, missing_tweets in generate_conversations(num_conversations = args.num_conversations,
+            branching_factor = args.branching_factor, depth_decay = args.depth_decay, max_depth = args.max_depth,
+            missing_parent_rate = args.missing_parent_rate, viral_rate = args.viral_rate, viral_size = args.viral_size,
+            tweet_format = args.format, num_users = args.num_users, num_brands = args.num_brands,
+            payload_bytes = args.payload_bytes, seed = args.seed, metadata_fields = args.metadata_fields):
+        for tweet in tweets:
+            print(ujson.dumps(tweet))
+        if missing_output is not None:
+            for tweet in missing_tweets:
+                missing_output.write(ujson.dumps(tweet) + "\n")
+    if missing_output is not None:
+        missing_output.close()
+    if args.brand_info is not None:
+        with open(args.brand_info, "w") as f:
+            for brand in make_users(args.num_users, args.num_brands)[:args.num_brands]:
+                f.write("{},{}\n".format(brand["screen_name"], brand["user_id"]))
@@ -0,0 +1,220 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import os
+import sys
+import time
+import tracemalloc
+import tempfile
+import argparse
+import logging
+import ujson
+# make the top-level modules importable when this is run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import field_getters as fg
+from snowflake2utc import snowflake2utc
+import build_conversations as bc
+from create_database import create_database
+from fast_extract import extract_fields, full_extract_fields
+from add_missing_tweets import insert_missing_tweets
+import add_enrichments
+from stage_metrics import peak_rss_bytes
+from benchmarks.generate_tweets import generate_conversations, make_users
+
+'''
+Per-stage benchmarks on synthetic data (see generate_tweets.py).
+
+Times each stage of the pipeline separately and reports items processed, seconds, items per second and memory:
+    - extract_fields / extract_fields_full: getting the create_database fields from raw lines, with the fast path
+      (fast_extract.py) and with a full JSON decode (items: input lines)
+    - create_database: loading Tweets into MongoDB (items: input lines)
+    - build_graph: the MongoDB $group aggregation (items: Tweets)
+    - find_conversation_graphs: building the conversation trees with find_children (items: Tweets)
+    - hydrate_conversations: fetching and decoding Tweet payloads from MongoDB (items: conversations)
+    - insert_missing_tweets: putting "recovered" Tweets back in the conversations (items: conversations)
+    - add_enrichments: add_enrichments and add_brand_enrichments (items: conversations)
+
+With --no_database, the MongoDB stages are skipped and the graph and conversations are built in memory instead.
+Results can be saved as a baseline and later runs compared against it.
+'''
+
+def time_stage(name, function, results, trace_memory = False):
+    '''
+    Run function() (which returns (result, number of items processed)), record timing and memory in results[name]
+    '''
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result, num_items = function()
+    seconds = time.perf_counter() - start
+    results[name] = {"items": num_items, "seconds": round(seconds, 4),
+                     "items_per_second": round(num_items / seconds, 1) if seconds > 0 else None,
+                     "peak_rss_mb": round(peak_rss_bytes() / (1024.0 * 1024.0), 1)}
+    if trace_memory:
+        results[name]["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0), 1)
+        tracemalloc.stop()
+    logging.debug('Benchmarked {}: {}'.format(name, results[name]))
+    return result
+
+def parent_to_children_from_tweets(tweets):
+    '''
+    The same dictionary that build_conversations.build_graph makes with MongoDB, built in memory
+    '''
+    parent_to_children = {"NOT_A_REPLY": {"children": [], "in_reply_to_user": "NOT_A_REPLY", "in_reply_to_user_id": "NOT_A_REPLY"}}
+    for tweet in tweets:
+        reply_info = fg.reply_info(tweet)
+        parent = parent_to_children.setdefault(reply_info["reply_id"],
+            {"children": [], "in_reply_to_user": reply_info["reply_user"], "in_reply_to_user_id": reply_info["reply_user_id"]})
+        parent["children"].append(fg.tweet_id(tweet))
+    return parent_to_children
+
+def hydrate_in_memory(multi_node_graphs, id_to_tweet):
+    '''
+    build_conversations.hydrate_conversations without MongoDB (Tweets come from the id_to_tweet dictionary)
+    '''
+    for graph in multi_node_graphs:
+        hydrated = []
+        for node in graph:
+            if node["tweet_id"] in id_to_tweet:
+                tweet = id_to_tweet[node["tweet_id"]]
+            else:
+                tweet = {"missing_tweet_id": node["tweet_id"],
+                         "screen_name": node["screen_name"],
+                         "user_id": node["user_id"]}
+            hydrated.append((node["depth"], tweet))
+        hydrated.sort(key = lambda x: snowflake2utc(fg.tweet_id(x[1])))
+        yield({"depths": [x[0] for x in hydrated], "tweets": [x[1] for x in hydrated]})
+
+def run_benchmarks(corpus_options, use_database = True, db_name = "benchmark_tweet_database",
+        max_in_memory_value = 10000, trace_memory = False):
+    '''
+    Generate a corpus with generate_conversations(**corpus_options) and benchmark each stage. Returns a dictionary
+    of results keyed by stage name.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    results = {}
+    tweets = []
+    missing_tweets = {}
+    for present, missing in generate_conversations(**corpus_options):
+        tweets.extend(present)
+        missing_tweets.update({fg.tweet_id(x): x for x in missing})
+    brands = make_users(corpus_options.get("num_users", 10000), corpus_options.get("num_brands", 10))[:corpus_options.get("num_brands", 10)]
+    logging.debug('Generated {} Tweets ({} left out as missing)'.format(len(tweets), len(missing_tweets)))
+
+    lines = [ujson.dumps(tweet) + "\n" for tweet in tweets]
+    time_stage("extract_fields", lambda: ([extract_fields(x) for x in lines], len(lines)), results, trace_memory)
+    time_stage("extract_fields_full", lambda: ([full_extract_fields(x) for x in lines], len(lines)), results, trace_memory)
+
+    if use_database:
+        corpus_file = tempfile.NamedTemporaryFile("w", suffix = ".json", delete = False)
+        corpus_file.writelines(lines)
+        corpus_file.close()
+        try:
+            client, db_name, tweet_collection = time_stage("create_database",
+                lambda: (create_database(corpus_file.name, db_name, True), len(tweets)), results, trace_memory)
+            parent_to_children = time_stage("build_graph",
+                lambda: (bc.build_graph(tweet_collection), len(tweets)), results, trace_memory)
+            multi_node_graphs = time_stage("find_conversation_graphs",
+                lambda: (bc.find_conversation_graphs(parent_to_children, max_in_memory_value), len(tweets)), results, trace_memory)
+            def hydrate():
+                conversations = list(bc.hydrate_conversations(tweet_collection, multi_node_graphs, max_in_memory_value))
+                return conversations, len(conversations)
+            conversations = time_stage("hydrate_conversations", hydrate, results, trace_memory)
+            multi_node_graphs.close()
+            tweet_collection.drop()
+            client.drop_database(db_name)
+            client.close()
+        finally:
+            os.remove(corpus_file.name)
+    else:
+        parent_to_children = parent_to_children_from_tweets(tweets)
+        multi_node_graphs = time_stage("find_conversation_graphs",
+            lambda: (bc.find_conversation_graphs(parent_to_children, max_in_memory_value), len(tweets)), results, trace_memory)
+        conversations = list(hydrate_in_memory(multi_node_graphs, {fg.tweet_id(x): x for x in tweets}))
+        multi_node_graphs.close()
+    del(parent_to_children)
+    del(tweets)
+    del(lines)
+
+    def insert():
+        recovered = list(insert_missing_tweets(conversations, missing_tweets))
+        return recovered, len(recovered)
+    conversations = time_stage("insert_missing_tweets", insert, results, trace_memory)
+
+    def enrich():
+        for conversation_payload in conversations:
+            add_enrichments.add_enrichments(conversation_payload)
+            add_enrichments.add_brand_enrichments(conversation_payload, brands)
+        return None, len(conversations)
+    time_stage("add_enrichments", enrich, results, trace_memory)
+
+    return results
+
+def compare_to_baseline(results, baseline, tolerance = 0.2):
+    '''
+    Add "vs_baseline" (ratio of items per second to the baseline's) to each stage in results.
+    Returns the list of stages that are more than tolerance slower than the baseline.
+    '''
+    regressions = []
+    for stage, stage_results in results.items():
+        if (stage not in baseline) or (not baseline[stage].get("items_per_second")) or (not stage_results["items_per_second"]):
+            continue
+        ratio = stage_results["items_per_second"] / baseline[stage]["items_per_second"]
+        stage_results["vs_baseline"] = round(ratio, 3)
+        if ratio < 1 - tolerance:
+            regressions.append(stage)
+    return regressions
+
+def format_results(results):
+    '''A plain text table of the results'''
+    lines = ["{:<26}{:>10}{:>11}{:>14}{:>13}{:>13}".format("stage", "items", "seconds", "items/sec", "peak RSS MB", "vs baseline")]
+    for stage, r in results.items():
+        lines.append("{:<26}{:>10}{:>11}{:>14}{:>13}{:>13}".format(stage, r["items"], r["seconds"],
+            str(r["items_per_second"]), r["peak_rss_mb"], str(r.get("vs_baseline", "-"))))
+    return "\n".join(lines)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', default = 'run_benchmarks.log', help='name of log file')
+    parser.add_argument('--num_conversations', type = int, default = 10000)
+    parser.add_argument('--branching_factor', type = float, default = 1.5)
+    parser.add_argument('--depth_decay', type = float, default = 0.5)
+    parser.add_argument('--max_depth', type = int, default = 10)
+    parser.add_argument('--missing_parent_rate', type = float, default = 0.05)
+    parser.add_argument('--viral_rate', type = float, default = 0.001)
+    parser.add_argument('--viral_size', type = int, default = 1000)
+    parser.add_argument('--format', default = 'mixed', choices = ['activity-streams', 'original', 'mixed'])
+    parser.add_argument('--payload_bytes', type = int, default = 1000)
+    parser.add_argument('--metadata_fields', type = int, default = 0, help='nested padding fields per Tweet, see generate_tweets.py')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--max_in_memory_value', type = int, default = 10000)
+    parser.add_argument('--no_database', action='store_true', help='skip the MongoDB stages (no mongod needed)')
+    parser.add_argument('--trace_memory', action='store_true', help='also report the peak Python memory of each stage (slower)')
+    parser.add_argument('--baseline', default = None, help='JSON file of results from a previous run to compare against')
+    parser.add_argument('--save_baseline', default = None, help='save the results of this run as a baseline JSON file')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help='fraction slower than the baseline that counts as a regression')
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
+
+    corpus_options = {"num_conversations": args.num_conversations, "branching_factor": args.branching_factor,
+        "depth_decay": args.depth_decay, "max_depth": args.max_depth, "missing_parent_rate": args.missing_parent_rate,
+        "viral_rate": args.viral_rate, "viral_size": args.viral_size, "tweet_format": args.format,
+        "payload_bytes": args.payload_bytes, "seed": args.seed, "metadata_fields": args.metadata_fields}
+    results = run_benchmarks(corpus_options, not args.no_database, max_in_memory_value = args.max_in_memory_value,
+        trace_memory = args.trace_memory)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, ujson.load(f)["results"], args.tolerance)
+    print(format_results(results))
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            f.write(ujson.dumps({"corpus": corpus_options, "results": results}, indent = 2))
+    if len(regressions) > 0:
+        print("Slower than the baseline: {}".format(", ".join(regressions)))
+        sys.exit(1)
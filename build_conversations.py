@@ -10,62 +10,74 @@ import argparse
 import logging
 import field_getters as fg
 from find_children import find_children
+from graph_store import ConversationGraphStore
 from create_database import create_database
 from snowflake2utc import snowflake2utc
 import add_enrichments
 from get_brand_info import get_brand_info
-
-def build_conversations(max_in_memory_value = 10000, database_filename = "-", db_name = "tweet_database", drop_if_nonempty = True):
+from conversation_container import write_conversation
+from conversation_index import ConversationIndexWriter
+from server_side_build import build_conversations_server_side
+from partitioned_output import add_partition_arguments, partitioned_writer_from_args
+from conversation_filters import add_filter_arguments, filter_from_args
+from field_projection import add_projection_arguments, projection_from_args
+import stream_io
+import stage_metrics
+
+def build_graph(tweet_collection, user_ids = False):
     '''
-    Function to organize Tweets into conversations 
-    (conversations = list of Tweets linked by inReplyTo fields)
-
-    The output from this script is a set of JSON payloads (1 per line) that contain:
-    {
-        "tweets": [  # time-sorted list of Tweets
-            { < Tweet payload > }, # if the first Tweet was missing, it has the format: {"missing_tweet_id": _, "screen_name": _, "user_id": _}
-            { < Tweet payload > }  
-          ],  
-        "depths": [0,1...] #List of depths, same order as the tweets list  
-    }
-
-    Tweets in a conversation are time-sorted.
-
-    The output is intended to provide a way to group Tweets so that the user can do 
-    a row-level conversation analysis without having to hold more than 1 conversation's Tweets in memory.
+    Get links from parent to child nodes from a collection made by create_database.
+    Returns a dictionary keyed by parent Tweet id (or "NOT_A_REPLY"):
+    {parent_id: {"children": [child ids], "in_reply_to_user": _, "in_reply_to_user_id": _}}
+    If user_ids is True, each parent also has "child_user_ids": {child id: id of the user who posted it}
     '''
-
     # get the logger
     logging.getLogger("root")
-    ##################################################################################### Database creation step
-
-    # store all of the Twets in a database with the following keys:
-    # _id, in_reply_to_id, in_reply_to_user, in_reply_To_user_id
-    client, db_name, tweet_collection = create_database(database_filename, db_name, drop_if_nonempty)
-
-    ##################################################################################### Graph creation step
-
-    # get links from parent to child nodes
+    metrics = stage_metrics.stage("build_graph")
+    group = { "_id": "$in_reply_to_id", 
+              "children": {"$push" : "$tweet_id"},
+              "in_reply_to_user": {"$first" : "$in_reply_to_user"},
+              "in_reply_to_user_id": {"$first" : "$in_reply_to_user_id"}
+            }
+    if user_ids:
+        # only pushed when asked for, this makes the graph about twice as big
+        group["children_user_ids"] = {"$push" : "$user_id"}
     # the .aggregate function is provided by pymongo, as are the syntax/functions of this group step
-    parent_to_children = {
-        x["_id"]: {"children": x["children"], 
-                   "in_reply_to_user": x["in_reply_to_user"], 
-                   "in_reply_to_user_id": x["in_reply_to_user_id"] } 
-          for x in tweet_collection.aggregate([
-                # define pymongo group step for aggregating the database
-                {"$group": { "_id": "$in_reply_to_id", 
-                             "children": {"$push" : "$tweet_id"},
-                             "in_reply_to_user": {"$first" : "$in_reply_to_user"},
-                             "in_reply_to_user_id": {"$first" : "$in_reply_to_user_id"}
-                           }}])
-        }
+    parent_to_children = {}
+    for x in tweet_collection.aggregate([{"$group": group}]):
+        parent_to_children[x["_id"]] = {"children": x["children"], 
+                                        "in_reply_to_user": x["in_reply_to_user"], 
+                                        "in_reply_to_user_id": x["in_reply_to_user_id"] }
+        if user_ids:
+            parent_to_children[x["_id"]]["child_user_ids"] = dict(zip(x["children"], x["children_user_ids"]))
 
     logging.debug('There were {} individual Tweets in the input.'.format(tweet_collection.count()))
 
     # make sure we have a "NOT_A_REPLY" key
     if "NOT_A_REPLY" not in parent_to_children:
-        parent_to_children["NOT_A_REPLY"] = {"children": [], "in_reply_to_user": "NOT_A_REPLY"}
+        parent_to_children["NOT_A_REPLY"] = {"children": [], "in_reply_to_user": "NOT_A_REPLY", "in_reply_to_user_id": "NOT_A_REPLY"}
+        if user_ids:
+            parent_to_children["NOT_A_REPLY"]["child_user_ids"] = {}
 
+    metrics.add_items(len(parent_to_children))
+    metrics.finish()
+    return parent_to_children
+
+def find_conversation_graphs(parent_to_children, max_in_memory_value = 10000, conversation_filter = None, spill_dir = None):
+    '''
+    Group Tweet ids into conversations using the output of build_graph.
+    Returns a ConversationGraphStore (see graph_store.py) of conversations, each a list of
+    {"tweet_id": _, "depth": _, "in_reply_to": _} sorted by depth. Nodes for Tweets that were replied to also have
+    the replied-to user's "screen_name" and "user_id" (in case the Tweet is missing from the input), and if the graph
+    was built with user_ids, nodes for Tweets in the input have the "author_id" of the user who posted them.
+    At most about max_in_memory_value nodes of the finished graphs are kept in memory, the rest are spilled to disk
+    (in spill_dir, default the system temp directory). This doesn't bound the memory of this step: parent_to_children
+    and the sets of children and root ids used to walk it are all held in memory while the graphs are built.
+    Conversations that don't pass conversation_filter.keep_graph (see conversation_filters.py) are left out.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("find_conversation_graphs")
     # get the root nodes so that we can build the graphs
     root_nodes = []
     all_children = []
@@ -84,83 +96,181 @@ def build_conversations(max_in_memory_value = 10000, database_filename = "-", db
     del(all_children)
 
     # all of the conversation graphs
-    multi_node_graphs = []
+    multi_node_graphs = ConversationGraphStore(max_in_memory_value, spill_dir)
     # group the tweets together in conversations
-    for root in root_nodes:
-        children = find_children(root, None, 0, parent_to_children)
-        multi_node_graphs.append(sorted(children, key=lambda k: k["depth"]))
-
-    # in case of missing tweets, we want some info about the originating user
-    tweet_to_screenname = {k: {"user_id": v["in_reply_to_user_id"], 
-                               "screen_name": v["in_reply_to_user"]} for k,v in parent_to_children.items()}
-
-    del(parent_to_children)
-    del(root_nodes)
+    num_rejected = 0
+    try:
+        for root in root_nodes:
+            children = find_children(root, None, 0, parent_to_children)
+            for node in children:
+                # in case of missing tweets, we want some info about the originating user
+                if (node["tweet_id"] in parent_to_children) and (node["tweet_id"] != "NOT_A_REPLY"):
+                    node["screen_name"] = parent_to_children[node["tweet_id"]]["in_reply_to_user"]
+                    node["user_id"] = parent_to_children[node["tweet_id"]]["in_reply_to_user_id"]
+                # the root's parent is None, or "NOT_A_REPLY" if the root is in the input
+                parent = parent_to_children.get(node["in_reply_to"] or "NOT_A_REPLY", {})
+                if node["tweet_id"] in parent.get("child_user_ids", {}):
+                    node["author_id"] = parent["child_user_ids"][node["tweet_id"]]
+            graph = sorted(children, key=lambda k: k["depth"])
+            if (conversation_filter is not None) and (not conversation_filter.keep_graph(graph)):
+                num_rejected += 1
+                continue
+            multi_node_graphs.append(graph)
+            metrics.add_items()
+    except BaseException:
+        # don't leave the spill file behind
+        multi_node_graphs.close()
+        raise
+
+    if conversation_filter is not None:
+        logging.debug('{} conversations were filtered out before hydration.'.format(num_rejected))
+        metrics.set_gauge("filtered_conversations", num_rejected)
 
     logging.debug('Finished buiding the tree graph structure.')
 
-    ##################################################################################### Graph hydration step
-    # add the actual payloads of the Tweets and information about the graph structure to 
-    # conversation objects
+    metrics.finish()
+    return multi_node_graphs
+
+def _hydrate_shard(tweet_collections, graphs, conversation_filter = None, projection = None):
+    # fetch the Tweets for a shard of conversation graphs from the database and make the conversation payloads
+    id_to_tweet = {}
+    tweet_ids = [x["tweet_id"] for graph in graphs for x in graph]
+    for collection in tweet_collections:
+        id_to_tweet.update({x["tweet_id"]: ujson.loads(x["tweet_payload"])
+                         for x in collection.find( { "tweet_id": {"$in": tweet_ids} } )})
+    if projection is not None:
+        id_to_tweet = {k: projection.project(v) for k,v in id_to_tweet.items()}
+    # grab the conversations that we care about
+    for conversation in graphs:
+        # the "hydration" step provides a list of Tweets and some data about them
+        # now "hydrate" each conversation (give it the actual tweet)
+        hydrated_conversation = []
+        for tweet in conversation:
+            try:
+                # if it is a Tweet in our dataset
+                tweet_dict = id_to_tweet[tweet["tweet_id"]]
+                hydrated_conversation.append(
+                    { 
+                      "depth": tweet["depth"], 
+                      "tweet": tweet_dict
+                    }
+                    )
+            except KeyError:
+                # if it's not a Tweet in our dataset
+                hydrated_conversation.append(
+                    {
+                      "depth": tweet["depth"],
+                      "tweet": {"missing_tweet_id": tweet["tweet_id"], 
+                                "screen_name": tweet["screen_name"],
+                                "user_id": tweet["user_id"]}
+                    }
+                    )
+        # time-sort the conversation. 
+        hydrated_conversation_sorted = sorted(hydrated_conversation, 
+            key = lambda x: snowflake2utc(fg.tweet_id(x["tweet"])))
+        conversation_payload = {"depths": [x["depth"] for x in hydrated_conversation_sorted], 
+                                "tweets": [x["tweet"] for x in hydrated_conversation_sorted]}
+        if (conversation_filter is not None) and (not conversation_filter.keep_conversation(conversation_payload)):
+            continue
+        yield(conversation_payload)
+
+def hydrate_conversations(tweet_collection, multi_node_graphs, max_in_memory_value = 10000, conversation_filter = None,
+        projection = None):
+    '''
+    Iterator over conversation payloads: add the actual payloads of the Tweets (from the database)
+    and information about the graph structure to the conversation graphs from find_conversation_graphs.
+    The graphs are read in shards of about max_in_memory_value Tweets, and only one shard is held in memory at a time.
+    tweet_collection can also be a list of collections (e.g. one per partition, see partitioned_build.py).
+    Conversations that don't pass conversation_filter.keep_conversation (see conversation_filters.py) are left out.
+    If projection (a field_projection.FieldProjection) is given, the Tweets are trimmed to its fields.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("hydrate_conversations")
+    if isinstance(tweet_collection, list):
+        tweet_collections = tweet_collection
+    else:
+        tweet_collections = [tweet_collection]
 
-    # break up the graphs into pieces so that we can query for each piece
-    shards = {0: {"tweets":[], "start": 0, "end": 1}}
+    logging.debug('Beginning to hydrate conversations.')
+    # break up the graphs into shards so that we can query for each shard
+    shard = []
+    shard_tweets = 0
     shard_number = 0
-    for i,graph in enumerate(multi_node_graphs):
-        if len(shards[shard_number]["tweets"]) + len(graph) > max_in_memory_value:
+    for graph in multi_node_graphs:
+        if (len(shard) > 0) and (shard_tweets + len(graph) > max_in_memory_value):
+            metrics.set_gauge("shard_tweets", shard_tweets)
+            for conversation_payload in _hydrate_shard(tweet_collections, shard, conversation_filter, projection):
+                metrics.add_items()
+                yield(conversation_payload)
             shard_number += 1
-            shards[shard_number] = {"tweets":[], "start": i, "end": i + 1}
-        shards[shard_number]["tweets"].extend([x["tweet_id"] for x in graph])
-        shards[shard_number]["end"] = i + 1
+            logging.debug('{} shards have been processed.'.format(shard_number))
+            shard = []
+            shard_tweets = 0
+        shard.append(graph)
+        shard_tweets += len(graph)
+    if len(shard) > 0:
+        metrics.set_gauge("shard_tweets", shard_tweets)
+        for conversation_payload in _hydrate_shard(tweet_collections, shard, conversation_filter, projection):
+            metrics.add_items()
+            yield(conversation_payload)
+        shard_number += 1
+    logging.debug('Hydrated the conversations in {} shards '.format(shard_number) + 
+        '(this is the number of calls that were made to the database)')
+    metrics.finish()
+
+def build_conversations(max_in_memory_value = 10000, database_filename = "-", db_name = "tweet_database", drop_if_nonempty = True, input_workers = 1,
+        dedup = "memory", conversation_filter = None, projection = None, project_store = False):
+    '''
+    Function to organize Tweets into conversations 
+    (conversations = list of Tweets linked by inReplyTo fields)
 
-    shard_number += 1
+    The output from this script is a set of JSON payloads (1 per line) that contain:
+    {
+        "tweets": [  # time-sorted list of Tweets
+            { < Tweet payload > }, # if the first Tweet was missing, it has the format: {"missing_tweet_id": _, "screen_name": _, "user_id": _}
+            { < Tweet payload > }  
+          ],  
+        "depths": [0,1...] #List of depths, same order as the tweets list  
+    }
 
-    logging.debug('Broke the data into shards. There are {} shards '.format(shard_number) + 
-        '(this is the number of calls that will be made to the database)')
+    Tweets in a conversation are time-sorted.
 
-    ##################################################################################### 
+    The output is intended to provide a way to group Tweets so that the user can do 
+    a row-level conversation analysis without having to hold more than 1 conversation's Tweets in memory.
 
-    logging.debug('Beginning to hydrate conversations.')
-    #hydrated_conversations = [] #debugging
-    for item,shard in list(shards.items()):
-        # load up a shard of conversations
-        id_to_tweet = {x["tweet_id"]: ujson.loads(x["tweet_payload"])
-                         for x in tweet_collection.find( { "tweet_id": {"$in": shard["tweets"]} } )}
-        # grab the conversations that we care about
-        for conversation in multi_node_graphs[shard["start"]:shard["end"]]:
-            # the "hydration" step provides a list of Tweets and some data about them
-            # now "hydrate" each conversation (give it the actual tweet)
-            hydrated_conversation = []
-            for tweet in conversation:
-                try:
-                    # if it is a Tweet in our dataset
-                    tweet_dict = id_to_tweet[tweet["tweet_id"]]
-                    hydrated_conversation.append(
-                        { 
-                          "depth": tweet["depth"], 
-                          "tweet": tweet_dict
-                        }
-                        )
-                except KeyError:
-                    # if it's not a Tweet in our dataset
-                    hydrated_conversation.append(
-                        {
-                          "depth": tweet["depth"],
-                          "tweet": {"missing_tweet_id": tweet["tweet_id"], 
-                                    "screen_name": tweet_to_screenname[tweet["tweet_id"]]["screen_name"],
-                                    "user_id": tweet_to_screenname[tweet["tweet_id"]]["user_id"]}
-                        }
-                        )
-            # time-sort the conversation. 
-            hydrated_conversation_sorted = sorted(hydrated_conversation, 
-                key = lambda x: snowflake2utc(fg.tweet_id(x["tweet"])))
-            conversation_payload = {"depths": [x["depth"] for x in hydrated_conversation_sorted], 
-                                    "tweets": [x["tweet"] for x in hydrated_conversation_sorted]}
-            # print the conversation payload
-            #print(ujson.dumps(conversation_payload))
+    Only conversations that pass conversation_filter (a conversation_filters.ConversationFilter) are built.
+    The Tweets are trimmed to the fields of projection (a field_projection.FieldProjection), if it is given.
+    With project_store, they are trimmed before they go into the database, rather than when they come out of it.
+    '''
+
+    # get the logger
+    logging.getLogger("root")
+    ##################################################################################### Database creation step
+
+    # store all of the Twets in a database with the following keys:
+    # _id, in_reply_to_id, in_reply_to_user, in_reply_To_user_id
+    client, db_name, tweet_collection = create_database(database_filename, db_name, drop_if_nonempty, input_workers, dedup,
+        projection if project_store else None)
+
+    ##################################################################################### Graph creation step
+
+    user_ids = (conversation_filter is not None) and conversation_filter.needs_user_ids
+    parent_to_children = build_graph(tweet_collection, user_ids)
+    multi_node_graphs = find_conversation_graphs(parent_to_children, max_in_memory_value, conversation_filter)
+    del(parent_to_children)
+
+    ##################################################################################### Graph hydration step
+    # add the actual payloads of the Tweets and information about the graph structure to 
+    # conversation objects
+
+    # close the graph store (removing its spill file) even if the consumer stops early or there is an error
+    try:
+        for conversation_payload in hydrate_conversations(tweet_collection, multi_node_graphs, max_in_memory_value, conversation_filter,
+                None if project_store else projection):
             yield(conversation_payload)
-            #hydrated_conversations.append(hydrated_conversation) #debugging
-        logging.debug('{} shards have been processed. There are {} shards remaining.'.format(item + 1, shard_number - item - 1))
+    finally:
+        multi_node_graphs.close()
 
     ##################################################################################### Cleanup
 
@@ -175,16 +285,34 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--max_in_memory_value', type = int, default = 10000, 
-        help='maximum number of Tweets to hold in memory at a single time, default 10k')
+        help='maximum number of Tweets (and conversation graph nodes, the rest are kept on disk) to hold in memory at a single time while hydrating the conversations, default 10k. The reply graph itself is always held in memory')
     parser.add_argument('--log', default = 'build_conversations.log', help='name of log file')
-    parser.add_argument('--input', default = '-', help='name of input Tweet data, default is stdin')
+    stream_io.add_input_arguments(parser)
+    stream_io.add_output_arguments(parser)
     parser.add_argument('--brand_info', default = None)
     parser.add_argument('--add_enrichments', action='store_true', help='add (or update) enrichment fields to these conversations')
+    parser.add_argument('--output_format', choices = ['json', 'binary'], default = 'json',
+        help='"json" (one conversation payload per line, default) or "binary" (see conversation_container.py)')
+    parser.add_argument('--partitions', type = int, default = 1,
+        help='build with this many worker processes, splitting the --input files between them (see partitioned_build.py), default 1')
+    parser.add_argument('--dedup', choices = ['memory', 'database'], default = 'memory',
+        help='drop duplicate Tweets with a compact in-memory set of ids ("memory", default) or with the database index only ("database")')
+    parser.add_argument('--server_side', action='store_true',
+        help='find the conversation trees inside MongoDB with $graphLookup (MongoDB 3.4+, see server_side_build.py)')
+    parser.add_argument('--index', default = None,
+        help='also write a Tweet id -> conversation index to this file (see conversation_index.py), needs an uncompressed --output file')
+    add_partition_arguments(parser)
+    add_filter_arguments(parser)
+    add_projection_arguments(parser)
+    parser.add_argument('--project_store', action='store_true',
+        help='trim the Tweets to --fields as they are loaded into the database (smaller database, but every Tweet is decoded)')
+    stage_metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
 
     logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
     logging.debug('###################################################################### ' + 
         'building a new set of conversations')
+    stage_metrics.configure_from_args(args)
 
     # you should never have to change these, put I'm putting them here for visibility, 
     # and making them accessible in case you do have to change them
@@ -197,14 +325,72 @@ if __name__ == "__main__":
         brands = get_brand_info(args.brand_info) 
     else:
         do_brand_enrichments = False
-
-    for conversation_payload in build_conversations(args.max_in_memory_value, args.input, db_name, drop_if_nonempty):
-        # optionally update enrichments in the conversation payload
-        if args.add_enrichments:
-            # add enrichments
-            conversation_payload = add_enrichments.add_enrichments(conversation_payload)
-            if do_brand_enrichments:
-                conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
-        print(ujson.dumps(conversation_payload))
+        brands = None
+
+    if args.brands_only and (brands is None):
+        parser.error("--brands_only needs --brand_info")
+    conversation_filter = filter_from_args(args, brands)
+    projection = projection_from_args(args)
+    if args.project_store and (projection is None):
+        parser.error("--project_store needs --fields")
+
+    if args.server_side and (args.partitions > 1):
+        parser.error("--server_side can't be used with --partitions")
+    if (args.partitions > 1) and ("-" in stream_io.expand_inputs(args.input)):
+        parser.error("--partitions splits the input by file, it can't read from stdin, provide --input file names")
+    partitioned_output = partitioned_writer_from_args(args)
+    if (partitioned_output is not None) and ((args.output != "-") or (args.index is not None)):
+        parser.error("--partition_by writes to --partition_dir, it can't be used with --output or --index")
+    output = stream_io.writer_from_args(args) if partitioned_output is None else None
+    index = None
+    if args.index is not None:
+        # the index stores byte offsets, so the output has to be one uncompressed file
+        if (args.output == "-") or (output.compression is not None) or (args.output_max_bytes is not None):
+            parser.error("--index needs a single uncompressed --output file (no compression or --output_max_bytes)")
+        index = ConversationIndexWriter(args.index)
+    if args.partitions > 1:
+        # imported here, partitioned_build uses the functions in this module
+        from partitioned_build import build_conversations_partitioned
+        for serialized, tweet_ids, header in build_conversations_partitioned(args.input, args.partitions, args.max_in_memory_value,
+                db_name, args.output_format, args.add_enrichments, brands, dedup = args.dedup,
+                conversation_filter = conversation_filter, projection = projection, project_store = args.project_store):
+            if partitioned_output is not None:
+                partitioned_output.write_serialized(serialized, header)
+                continue
+            offset = output.bytes_written
+            output.write(serialized)
+            if index is not None:
+                index.add_ids(tweet_ids, offset)
+    else:
+        if args.server_side:
+            conversations = build_conversations_server_side(args.input, db_name, drop_if_nonempty, args.input_workers, args.dedup,
+                conversation_filter, projection, args.project_store)
+        else:
+            conversations = build_conversations(args.max_in_memory_value, args.input, db_name, drop_if_nonempty, args.input_workers, args.dedup,
+                conversation_filter, projection, args.project_store)
+        enrich_metrics = stage_metrics.stage("add_enrichments") if args.add_enrichments else None
+        for conversation_payload in conversations:
+            # optionally update enrichments in the conversation payload
+            if args.add_enrichments:
+                # add enrichments
+                conversation_payload = add_enrichments.add_enrichments(conversation_payload)
+                if do_brand_enrichments:
+                    conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
+                enrich_metrics.add_items()
+            if partitioned_output is not None:
+                partitioned_output.write(conversation_payload)
+                continue
+            offset = output.bytes_written
+            write_conversation(conversation_payload, args.output_format, output)
+            if index is not None:
+                index.add(conversation_payload, offset)
+        if enrich_metrics is not None:
+            enrich_metrics.finish()
+    if partitioned_output is not None:
+        partitioned_output.close()
+    else:
+        output.close()
+    if index is not None:
+        index.close()
 
 
@@ -0,0 +1,223 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import math
+import time
+import field_getters as fg
+import enrichment_functions as enrich
+from snowflake2utc import snowflake2utc
+from partitioned_output import BUCKET_FORMATS
+
+'''
+Summary statistics of conversation enrichments, computed in one streaming pass.
+
+For each time bucket (hour or day of the root Tweet) and each brand that Tweeted in a conversation (and "ALL",
+every conversation), the numeric versions of the enrichments are added to histograms:
+
+    size_of_conversation, approx_depth                       number of Tweets, depth
+    duration_of_conversation, time_to_first_response         seconds (conversations with a response only)
+    time_to_first_brand_response                             seconds until that brand (or, for "ALL", any brand)
+                                                             first Tweeted, if the root Tweet isn't a brand's
+
+The histograms are log-bucketed: a value v goes in bucket ceil(log(v) / log(gamma)) with
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy), so every quantile is within relative_accuracy of the
+true value. The number of buckets only depends on the range of the values (and is capped at max_buckets), not on
+the number of conversations, and two histograms are merged by adding their bucket counts, so summaries from
+separate runs (e.g. of different days of data) can be merged exactly.
+'''
+
+# the group of all conversations (all brands, or all times if there are no time buckets)
+ALL = "ALL"
+QUANTILES = [0.5, 0.9, 0.99]
+
+class LogHistogram(object):
+    '''
+    Mergeable histogram of non-negative values, with quantiles accurate to relative_accuracy
+    (see the module docstring)
+    '''
+    def __init__(self, relative_accuracy = 0.01, max_buckets = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count = 1):
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self.zero_count += count
+            return
+        index = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        # merge the lowest buckets together, so only the accuracy of the smallest values suffers
+        indexes = sorted(self.buckets)
+        keep = indexes[len(indexes) - self.max_buckets:]
+        self.buckets[keep[0]] += sum([self.buckets.pop(x) for x in indexes[:len(indexes) - self.max_buckets]])
+
+    def merge(self, other):
+        '''Add the values of another LogHistogram (with the same relative_accuracy) to this one'''
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge histograms with different relative accuracies")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        for value in [other.min, other.max]:
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        '''Estimate of the q-quantile (0 <= q <= 1), None if the histogram is empty'''
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        '''Summary (count, mean, min, max, quantiles) and the buckets, as a JSON-able dictionary'''
+        summary = {"count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+                   "mean": (self.sum / float(self.count)) if self.count > 0 else None}
+        for q in QUANTILES:
+            summary["p{}".format(int(round(q * 100)))] = self.quantile(q)
+        summary.update({"relative_accuracy": self.relative_accuracy, "zero_count": self.zero_count,
+                        "buckets": {str(k): v for k,v in sorted(self.buckets.items())}})
+        return summary
+
+    @classmethod
+    def from_dict(cls, summary, max_buckets = 2048):
+        '''A LogHistogram from the output of to_dict'''
+        histogram = cls(summary["relative_accuracy"], max_buckets)
+        histogram.buckets = {int(k): v for k,v in summary["buckets"].items()}
+        histogram.zero_count = summary["zero_count"]
+        histogram.count = summary["count"]
+        histogram.sum = summary["sum"]
+        histogram.min = summary["min"]
+        histogram.max = summary["max"]
+        return histogram
+
+class ConversationAggregator(object):
+    '''
+    Histograms of conversation enrichments by time bucket and brand (see the module docstring).
+    brands is the output of get_brand_info (or None), bucket is "hour", "day" or None (no time buckets).
+    '''
+    def __init__(self, brands = None, bucket = "day", relative_accuracy = 0.01):
+        if (bucket is not None) and (bucket not in BUCKET_FORMATS):
+            raise ValueError('bucket must be one of: {}'.format(", ".join(sorted(BUCKET_FORMATS))))
+        self.brands = brands
+        self.bucket = bucket
+        self.relative_accuracy = relative_accuracy
+        if brands is not None:
+            self.brand_ids = {b["user_id"]: b for b in brands}
+            self.brand_names = {b["screen_name"]: b for b in brands}
+        # (time bucket, brand) -> {"conversations": _, "brand_root": _, "no_brand_response": _, "metrics": {name: LogHistogram}}
+        self.groups = {}
+
+    def _group(self, time_bucket, brand):
+        key = (time_bucket, brand)
+        if key not in self.groups:
+            self.groups[key] = {"conversations": 0, "brand_root": 0, "no_brand_response": 0, "metrics": {}}
+        return self.groups[key]
+
+    def _add_value(self, group, name, value):
+        if value is None:
+            return
+        if name not in group["metrics"]:
+            group["metrics"][name] = LogHistogram(self.relative_accuracy)
+        group["metrics"][name].add(value)
+
+    def _tweeting_brands(self, conversation_payload):
+        # the brands that Tweeted in the conversation, in the order of their first Tweets
+        tweeting = {}
+        for tweet in conversation_payload["tweets"]:
+            brand = self.brand_ids.get(fg.user_id(tweet)) or self.brand_names.get(fg.screen_name(tweet))
+            if brand is not None:
+                tweeting[brand["screen_name"]] = brand
+        return list(tweeting.values())
+
+    def add(self, conversation_payload):
+        '''Add a conversation payload (without enrichments, they are computed here)'''
+        if self.bucket is not None:
+            root = conversation_payload["tweets"][conversation_payload["depths"].index(0)]
+            time_bucket = time.strftime(BUCKET_FORMATS[self.bucket], time.gmtime(snowflake2utc(fg.tweet_id(root))))
+        else:
+            time_bucket = ALL
+        size = enrich.size_of_conversation(conversation_payload)
+        values = {"size_of_conversation": size,
+                  "approx_depth": enrich.approx_depth(conversation_payload),
+                  "duration_of_conversation": enrich.duration_seconds(conversation_payload) if size > 1 else None,
+                  "time_to_first_response": enrich.seconds_to_first_response(conversation_payload)}
+        groups = [(ALL, self.brands)]
+        if self.brands is not None:
+            groups.extend([(b["screen_name"], [b]) for b in self._tweeting_brands(conversation_payload)])
+        for brand, group_brands in groups:
+            group = self._group(time_bucket, brand)
+            group["conversations"] += 1
+            for name, value in values.items():
+                self._add_value(group, name, value)
+            if group_brands is not None:
+                seconds = enrich.seconds_to_first_brand_response(conversation_payload, group_brands)
+                root_user = enrich.root_user(conversation_payload)
+                if seconds is not None:
+                    self._add_value(group, "time_to_first_brand_response", seconds)
+                elif any([(root_user["user_id"] == b["user_id"]) or (root_user["screen_name"] == b["screen_name"]) for b in group_brands]):
+                    group["brand_root"] += 1
+                else:
+                    group["no_brand_response"] += 1
+
+    def merge(self, other):
+        '''Add the groups of another ConversationAggregator (with the same bucket) to this one'''
+        if other.bucket != self.bucket:
+            raise ValueError("Can't merge summaries bucketed by {} and by {}".format(self.bucket, other.bucket))
+        for key, other_group in other.groups.items():
+            group = self._group(*key)
+            for name in ["conversations", "brand_root", "no_brand_response"]:
+                group[name] += other_group[name]
+            for name, histogram in other_group["metrics"].items():
+                if name not in group["metrics"]:
+                    group["metrics"][name] = LogHistogram(histogram.relative_accuracy)
+                group["metrics"][name].merge(histogram)
+
+    def to_dict(self):
+        '''The summary, as a JSON-able dictionary'''
+        groups = []
+        for (time_bucket, brand), group in sorted(self.groups.items()):
+            groups.append({"time_bucket": time_bucket, "brand": brand, "conversations": group["conversations"],
+                           "brand_root": group["brand_root"], "no_brand_response": group["no_brand_response"],
+                           "metrics": {name: x.to_dict() for name, x in sorted(group["metrics"].items())}})
+        return {"bucket": self.bucket, "relative_accuracy": self.relative_accuracy, "groups": groups}
+
+    @classmethod
+    def from_dict(cls, summary):
+        '''A ConversationAggregator from the output of to_dict (it can be merged, but not added to)'''
+        aggregator = cls(None, summary["bucket"], summary["relative_accuracy"])
+        for entry in summary["groups"]:
+            group = aggregator._group(entry["time_bucket"], entry["brand"])
+            for name in ["conversations", "brand_root", "no_brand_response"]:
+                group[name] = entry[name]
+            group["metrics"] = {name: LogHistogram.from_dict(x) for name, x in entry["metrics"].items()}
+        return aggregator
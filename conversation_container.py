@@ -0,0 +1,197 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import sys
+import struct
+import argparse
+import logging
+import ujson
+import field_getters as fg
+from snowflake2utc import snowflake2utc
+import stream_io
+from stream_io import read_lines, expand_inputs, open_file
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+'''
+Compact binary container for conversation payloads.
+
+A container file is a stream of length-prefixed records, one per conversation, with no file-level header
+(so container files can be concatenated with "cat", just like the JSON-lines files).
+Each record is a fixed-width header followed by the msgpack-encoded conversation payload:
+
+    [ body_length (uint32) | size_of_conversation (uint32) | root_id (uint64) | start_time (int64) | end_time (int64) ]
+    [ body_length bytes of msgpack ]
+
+All header values are big-endian. start_time and end_time are the (unix, seconds) times of the first and last
+Tweets in the conversation, root_id is the id of the depth-0 Tweet (which might be a "missing" Tweet).
+Readers can look at the header and skip a record without decoding its body.
+'''
+
+# body length, size of conversation, root id, start time, end time
+HEADER = struct.Struct(">IIQqq")
+
+def _check_msgpack():
+    if msgpack is None:
+        raise ImportError("The binary conversation format requires msgpack (pip install msgpack)")
+
+def conversation_header(conversation_payload):
+    '''
+    Compute the header fields for a conversation payload (at least "tweets" and "depths").
+    Returns a dictionary: {"size": _, "root_id": _, "start_time": _, "end_time": _}
+    '''
+    tweets = conversation_payload["tweets"]
+    depths = conversation_payload["depths"]
+    if len(tweets) == 0:
+        return {"size": 0, "root_id": 0, "start_time": 0, "end_time": 0}
+    # the root is the shallowest Tweet (after add_missing_tweets, depths can be negative)
+    root_id = fg.tweet_id(tweets[depths.index(min(depths))])
+    times = [snowflake2utc(fg.tweet_id(x)) for x in tweets]
+    return {"size": len(tweets), "root_id": int(root_id), "start_time": min(times), "end_time": max(times)}
+
+def encode_conversation(conversation_payload):
+    '''
+    Encode a conversation payload as one container record (header + msgpack body), returns bytes
+    '''
+    _check_msgpack()
+    body = msgpack.packb(conversation_payload, use_bin_type = True)
+    header = conversation_header(conversation_payload)
+    return HEADER.pack(len(body), header["size"], header["root_id"], header["start_time"], header["end_time"]) + body
+
+def decode_conversation(body):
+    '''
+    Decode the msgpack body of a container record into a conversation payload
+    '''
+    _check_msgpack()
+    return msgpack.unpackb(body, raw = False)
+
+def _skip(stream, num_bytes):
+    # seek past the body if we can, otherwise read it and throw it away
+    try:
+        stream.seek(num_bytes, 1)
+    except (AttributeError, OSError, ValueError):
+        stream.read(num_bytes)
+
+def read_records(stream, header_filter = None):
+    '''
+    Iterator over (header, body) pairs in a binary stream of container records.
+    header is a dictionary {"size": _, "root_id": _, "start_time": _, "end_time": _}, body is the raw msgpack bytes.
+    If header_filter (a function of the header dictionary) is provided, records for which it returns False
+    are skipped without reading their bodies into memory (when the stream is seekable).
+    '''
+    while True:
+        raw_header = stream.read(HEADER.size)
+        if len(raw_header) == 0:
+            break
+        if len(raw_header) < HEADER.size:
+            logging.warn("WARNING: Found a truncated record header at the end of a conversation container")
+            break
+        body_length, size, root_id, start_time, end_time = HEADER.unpack(raw_header)
+        header = {"size": size, "root_id": root_id, "start_time": start_time, "end_time": end_time}
+        if (header_filter is not None) and (not header_filter(header)):
+            _skip(stream, body_length)
+            continue
+        body = stream.read(body_length)
+        if len(body) < body_length:
+            logging.warn("WARNING: Found a truncated record body at the end of a conversation container")
+            break
+        yield((header, body))
+
+def read_conversations(filename = "-", input_format = "binary", header_filter = None, input_workers = 1):
+    '''
+    Iterator over conversation payloads in a file (or stdin, the default).
+    filename can also be a glob or a list of file names/globs, and compressed files are decompressed (see stream_io).
+    input_format is "binary" (container records) or "json" (one JSON conversation payload per line).
+    header_filter is only applied to binary input (see read_records), input_workers only to JSON input.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    if input_format == "json":
+        for line in read_lines(filename, input_workers):
+            try:
+                yield(ujson.loads(line))
+            except ValueError:
+                logging.warn("Found a bad JSON payload")
+        return
+    for input_filename in expand_inputs(filename):
+        if input_filename == "-":
+            stream = sys.stdin.buffer
+        else:
+            stream = open_file(input_filename, "rb")
+        try:
+            for header, body in read_records(stream, header_filter):
+                yield(decode_conversation(body))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+def serialize_conversation(conversation_payload, output_format = "json"):
+    '''
+    Serialize a conversation payload as bytes, either a JSON line or a container record
+    '''
+    if output_format == "binary":
+        return encode_conversation(conversation_payload)
+    return (ujson.dumps(conversation_payload) + "\n").encode("utf-8")
+
+def write_conversation(conversation_payload, output_format = "json", stream = None):
+    '''
+    Write a conversation payload to a binary stream (stdout by default) in the given output format
+    '''
+    if stream is None:
+        stream = sys.stdout.buffer
+    stream.write(serialize_conversation(conversation_payload, output_format))
+
+def json_to_container(input_filename = "-", output_stream = None):
+    '''
+    Convert a file of JSON-lines conversation payloads to container records. Returns the number converted.
+    '''
+    num_converted = 0
+    for conversation_payload in read_conversations(input_filename, "json"):
+        write_conversation(conversation_payload, "binary", output_stream)
+        num_converted += 1
+    return num_converted
+
+def container_to_json(input_filename = "-", output_stream = None, header_filter = None):
+    '''
+    Convert a container file to JSON-lines conversation payloads. Returns the number converted.
+    '''
+    num_converted = 0
+    for conversation_payload in read_conversations(input_filename, "binary", header_filter):
+        write_conversation(conversation_payload, "json", output_stream)
+        num_converted += 1
+    return num_converted
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', default = 'conversation_container.log', help='name of log file')
+    stream_io.add_input_arguments(parser, 'input conversation file name(s) or glob(s), default is stdin')
+    stream_io.add_output_arguments(parser)
+    parser.add_argument('--to', choices = ['binary', 'json'], default = 'json',
+        help='convert JSON-lines conversations to the binary container format ("binary") or back ("json", default)')
+    parser.add_argument('--min_size', type = int, default = None, help='(binary input only) skip conversations with fewer Tweets')
+    parser.add_argument('--start_time', type = int, default = None, help='(binary input only) skip conversations that end before this unix time')
+    parser.add_argument('--end_time', type = int, default = None, help='(binary input only) skip conversations that start after this unix time')
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
+
+    def header_filter(header):
+        if (args.min_size is not None) and (header["size"] < args.min_size):
+            return False
+        if (args.start_time is not None) and (header["end_time"] < args.start_time):
+            return False
+        if (args.end_time is not None) and (header["start_time"] > args.end_time):
+            return False
+        return True
+
+    output = stream_io.writer_from_args(args)
+    if args.to == "binary":
+        num_converted = json_to_container(args.input, output)
+    else:
+        num_converted = container_to_json(args.input, output, header_filter)
+    output.close()
+    logging.debug('Converted {} conversations to the {} format'.format(num_converted, args.to))
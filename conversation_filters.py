@@ -0,0 +1,137 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import field_getters as fg
+from snowflake2utc import snowflake2utc
+
+'''
+Filters for conversations, applied while they are built instead of after they are written.
+
+Most of the filters only need the conversation graph (the {"tweet_id", "depth", "in_reply_to"} nodes from
+build_conversations.find_conversation_graphs): size, depth, the time of the root Tweet (from its snowflake id,
+which is known even if the root is missing) and the users in it. Conversations that fail them are dropped before
+their Tweets are fetched from the database. The users are only in the graph if it was built with
+build_graph(..., user_ids = True), so check needs_user_ids first.
+
+Filters on the Tweet content (text_contains) are checked once the Tweets have been fetched and decoded,
+before the conversation is enriched or serialized.
+'''
+
+def _root_time(tweet_id):
+    # time of a Tweet from its id, or None if the id isn't a snowflake
+    try:
+        return snowflake2utc(tweet_id)
+    except (ValueError, TypeError):
+        return None
+
+class ConversationFilter(object):
+    '''
+    Keep conversations with min_size <= number of Tweets (including missing ones) <= max_size,
+    maximum depth <= max_depth, start_time <= root Tweet time (unix seconds) <= end_time,
+    at least one Tweet from (or reply to) one of the brands (from get_brand_info) and at least one Tweet with
+    text containing one of the strings in text_contains (case insensitive). Options that are None aren't checked.
+    '''
+    def __init__(self, min_size = None, max_size = None, max_depth = None, start_time = None, end_time = None,
+            brands = None, text_contains = None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.start_time = start_time
+        self.end_time = end_time
+        if brands is not None:
+            self.brand_ids = set([b["user_id"] for b in brands])
+            self.brand_names = set([b["screen_name"] for b in brands])
+        else:
+            self.brand_ids = None
+            self.brand_names = None
+        self.text_contains = [x.lower() for x in text_contains] if text_contains is not None else None
+
+    @property
+    def needs_user_ids(self):
+        '''True if the graph nodes need an "author_id" (see build_conversations.build_graph)'''
+        return self.brand_ids is not None
+
+    def _keep_shape(self, size, max_depth, root_id):
+        if (self.min_size is not None) and (size < self.min_size):
+            return False
+        if (self.max_size is not None) and (size > self.max_size):
+            return False
+        if (self.max_depth is not None) and (max_depth > self.max_depth):
+            return False
+        if (self.start_time is not None) or (self.end_time is not None):
+            root_time = _root_time(root_id)
+            if root_time is None:
+                return False
+            if (self.start_time is not None) and (root_time < self.start_time):
+                return False
+            if (self.end_time is not None) and (root_time > self.end_time):
+                return False
+        return True
+
+    def _is_brand(self, user_id, screen_name):
+        return (user_id in self.brand_ids) or (screen_name in self.brand_names)
+
+    def keep_graph(self, graph):
+        '''
+        Check the filters that only need the conversation graph (a list of nodes, sorted by depth)
+        '''
+        if not self._keep_shape(len(graph), graph[-1]["depth"], graph[0]["tweet_id"]):
+            return False
+        if self.brand_ids is not None:
+            # "author_id" is the user who posted a Tweet, and replied-to Tweets (which may be missing)
+            # have the replied-to user's "user_id" and "screen_name"
+            if not any([(node.get("author_id") in self.brand_ids) or
+                        self._is_brand(node.get("user_id"), node.get("screen_name")) for node in graph]):
+                return False
+        return True
+
+    def keep_conversation(self, conversation_payload):
+        '''
+        Check the filters that need the Tweets of a hydrated conversation payload
+        '''
+        if self.text_contains is not None:
+            texts = [fg.text(x).lower() for x in conversation_payload["tweets"]]
+            if not any([(string in text) for text in texts for string in self.text_contains]):
+                return False
+        return True
+
+    def keep_payload(self, conversation_payload):
+        '''
+        Check all of the filters against a hydrated conversation payload, for builds that don't have the graph
+        '''
+        depths = conversation_payload["depths"]
+        root = conversation_payload["tweets"][depths.index(0)]
+        if not self._keep_shape(len(depths), max(depths), fg.tweet_id(root)):
+            return False
+        if self.brand_ids is not None:
+            if not any([self._is_brand(fg.user_id(x), fg.screen_name(x)) for x in conversation_payload["tweets"]]):
+                return False
+        return self.keep_conversation(conversation_payload)
+
+def add_filter_arguments(parser):
+    '''
+    Add the conversation filter command line arguments to an argparse parser
+    '''
+    parser.add_argument('--min_size', type = int, default = None, help='only build conversations with at least this many Tweets')
+    parser.add_argument('--max_size', type = int, default = None, help='only build conversations with at most this many Tweets')
+    parser.add_argument('--max_depth', type = int, default = None, help='only build conversations at most this deep (the root is depth 0)')
+    parser.add_argument('--root_start_time', type = int, default = None,
+        help='only build conversations whose root Tweet was posted at or after this unix time')
+    parser.add_argument('--root_end_time', type = int, default = None,
+        help='only build conversations whose root Tweet was posted at or before this unix time')
+    parser.add_argument('--brands_only', action = 'store_true',
+        help='only build conversations that a brand from --brand_info Tweeted in (or was replied to in)')
+    parser.add_argument('--text_contains', nargs = '+', default = None,
+        help='only build conversations with a Tweet whose text contains one of these strings (case insensitive)')
+
+def filter_from_args(args, brands = None):
+    '''
+    Make a ConversationFilter from the arguments added by add_filter_arguments, or None if no filters were given.
+    brands (from get_brand_info) are only used with --brands_only.
+    '''
+    options = [args.min_size, args.max_size, args.max_depth, args.root_start_time, args.root_end_time, args.text_contains]
+    if all([x is None for x in options]) and (not args.brands_only):
+        return None
+    return ConversationFilter(args.min_size, args.max_size, args.max_depth, args.root_start_time, args.root_end_time,
+        brands if args.brands_only else None, args.text_contains)
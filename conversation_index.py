@@ -0,0 +1,172 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import os
+import sys
+import mmap
+import heapq
+import struct
+import tempfile
+import argparse
+import logging
+import ujson
+import field_getters as fg
+import stream_io
+from conversation_container import HEADER, decode_conversation, write_conversation
+
+'''
+Tweet id -> conversation index for conversation output files.
+
+The index is a "sidecar" file of fixed-width records, one per Tweet (including missing Tweets), sorted by Tweet id:
+
+    [ tweet_id (uint64) | byte offset of the conversation in the output file (uint64) ]
+
+(big-endian). Looking up a Tweet is a binary search over the memory-mapped index, then a seek into the output file,
+so the output file never has to be read (or held in memory) as a whole.
+The output file has to be a single uncompressed file, in either the JSON-lines or the binary container format.
+'''
+
+RECORD = struct.Struct(">QQ")
+
+class ConversationIndexWriter(object):
+    '''
+    Collects (Tweet id, conversation offset) pairs and writes them to a sorted index file when close() is called.
+    At most max_in_memory_entries pairs are held in memory, sorted runs beyond that are spilled to temporary files
+    and merged at the end.
+    '''
+    def __init__(self, index_filename, max_in_memory_entries = 1000000):
+        self.index_filename = index_filename
+        self.max_in_memory_entries = max_in_memory_entries
+        self.entries = []
+        self.runs = []
+        self.num_entries = 0
+
+    def add(self, conversation_payload, offset):
+        '''Index every Tweet in the conversation payload as being in the conversation that starts at offset'''
+        self.add_ids([fg.tweet_id(x) for x in conversation_payload["tweets"]], offset)
+
+    def add_ids(self, tweet_ids, offset):
+        '''Index a list of Tweet ids as being in the conversation that starts at offset'''
+        for tweet_id in tweet_ids:
+            try:
+                self.entries.append((int(tweet_id), offset))
+            except ValueError:
+                logging.warn("WARNING: Could not index a Tweet without a numeric Tweet id")
+        if len(self.entries) >= self.max_in_memory_entries:
+            self._spill()
+
+    def _spill(self):
+        # write a sorted run to a temporary file
+        self.entries.sort()
+        run = tempfile.TemporaryFile()
+        run.write(b"".join([RECORD.pack(*x) for x in self.entries]))
+        run.seek(0)
+        self.runs.append(run)
+        self.entries = []
+
+    def _read_run(self, run):
+        while True:
+            record = run.read(RECORD.size)
+            if len(record) < RECORD.size:
+                break
+            yield(RECORD.unpack(record))
+
+    def close(self):
+        '''Merge everything into the sorted index file'''
+        self.entries.sort()
+        sources = [self._read_run(run) for run in self.runs] + [iter(self.entries)]
+        with open(self.index_filename, "wb") as f:
+            for entry in heapq.merge(*sources):
+                f.write(RECORD.pack(*entry))
+                self.num_entries += 1
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.entries = []
+        logging.debug('Wrote {} Tweet ids to the conversation index {}'.format(self.num_entries, self.index_filename))
+
+def _binary_search(index, num_records, tweet_id):
+    # returns the offset for tweet_id, or None
+    low = 0
+    high = num_records
+    while low < high:
+        middle = (low + high) // 2
+        middle_id, offset = RECORD.unpack_from(index, middle * RECORD.size)
+        if middle_id < tweet_id:
+            low = middle + 1
+        elif middle_id > tweet_id:
+            high = middle
+        else:
+            return offset
+    return None
+
+def lookup_offsets(index_filename, tweet_ids):
+    '''
+    Look up the conversation offsets for a list of Tweet ids. Returns a dictionary {tweet id: offset},
+    Tweet ids that are not in the index are left out.
+    '''
+    offsets = {}
+    if os.path.getsize(index_filename) == 0:
+        return offsets
+    with open(index_filename, "rb") as f:
+        index = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            num_records = len(index) // RECORD.size
+            for tweet_id in tweet_ids:
+                try:
+                    offset = _binary_search(index, num_records, int(tweet_id))
+                except ValueError:
+                    offset = None
+                if offset is not None:
+                    offsets[tweet_id] = offset
+        finally:
+            index.close()
+    return offsets
+
+def read_conversation_at(stream, offset, input_format = "json"):
+    '''
+    Read the conversation payload that starts at offset in an open (binary mode) conversation output file
+    '''
+    stream.seek(offset)
+    if input_format == "binary":
+        body_length = HEADER.unpack(stream.read(HEADER.size))[0]
+        return decode_conversation(stream.read(body_length))
+    return ujson.loads(stream.readline())
+
+def lookup_conversations(index_filename, conversations_filename, tweet_ids, input_format = "json"):
+    '''
+    Iterator over (list of the requested Tweet ids in the conversation, conversation payload) for the conversations
+    containing any of tweet_ids. Each conversation is read once, however many of the Tweet ids it contains.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    offsets = lookup_offsets(index_filename, tweet_ids)
+    not_found = [x for x in tweet_ids if x not in offsets]
+    if len(not_found) > 0:
+        logging.debug('{} Tweet ids were not in the index: {}'.format(len(not_found), not_found[:100]))
+    offset_to_ids = {}
+    for tweet_id, offset in offsets.items():
+        offset_to_ids.setdefault(offset, []).append(tweet_id)
+    with open(conversations_filename, "rb") as stream:
+        # read in file order
+        for offset in sorted(offset_to_ids):
+            yield((offset_to_ids[offset], read_conversation_at(stream, offset, input_format)))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', default = 'conversation_index.log', help='name of log file')
+    parser.add_argument('--index', required = True, help='index file written by build_conversations.py --index')
+    parser.add_argument('--conversations', required = True, help='the (uncompressed) conversation output file that was indexed')
+    parser.add_argument('--format', choices = ['json', 'binary'], default = 'json', help='format of the conversation output file')
+    parser.add_argument('--tweet_ids', nargs = '+', default = ['-'], help='file(s) of Tweet IDs, one per line, default is stdin')
+    parser.add_argument('--output_format', choices = ['json', 'binary'], default = 'json', help='format of the output conversation payloads')
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
+
+    tweet_ids = [x.strip() for x in stream_io.read_lines(args.tweet_ids) if x.strip() != ""]
+    for _, conversation_payload in lookup_conversations(args.index, args.conversations, tweet_ids, args.format):
+        write_conversation(conversation_payload, args.output_format)
+    sys.stdout.buffer.flush()
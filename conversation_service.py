@@ -0,0 +1,461 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import array
+import bisect
+import heapq
+import argparse
+import asyncio
+import logging
+import urllib.parse
+import ujson
+import pymongo
+import field_getters as fg
+import add_enrichments
+from snowflake2utc import snowflake2utc
+from get_brand_info import get_brand_info
+from create_database import create_database, _count_duplicates
+from fast_extract import extract_fields
+from tweet_id_set import _as_int64
+import stage_metrics
+
+'''
+A long-running service that returns the conversation of a Tweet in milliseconds.
+
+The Tweet store is a persistent MongoDB collection made by create_database (as for targeted_build.py). On start,
+the reply edges are read from it once and kept in memory in int64 arrays, sorted both by reply and by parent (see
+ReplyGraph). That is 32 bytes per reply (measured with tracemalloc: 32.9 bytes per edge for 1M edges, against 204
+for dictionaries of ints, peaking at 78 while the arrays are sorted). Tweets that aren't replies and have no replies
+are not in the graph at all, so the graph is much smaller than the store. A request walks the in-memory graph to
+find the conversation (by bisection, ~80 microseconds for a conversation of 20 Tweets in a graph of 1M edges),
+then fetches its Tweets from the store with one query on the tweet_id index.
+
+Replies POSTed to /tweets go in a small dictionary overlay. Once the overlay holds 100k edges (or 1/8 of the
+graph, if that's more), it is merged into the arrays in the thread pool and the new arrays are swapped in on the
+event loop.
+
+HTTP endpoints (served over TCP, or over a Unix socket with --socket):
+
+    GET  /conversation?tweet_id=<id>[&enrich=1]   the conversation payload (in the build_conversations.py format)
+                                                  of the conversation containing the Tweet, 404 if it isn't known.
+                                                  enrich=1 adds enrichments (and brand enrichments with --brand_info)
+    POST /tweets                                  Tweets (one JSON payload per line) to add to the store and the
+                                                  graph, returns {"received", "added", "duplicates", "errors"}
+    GET  /stats                                   size of the graph (edges and bytes) and store
+
+Database calls run in a thread pool, so a slow query doesn't hold up other requests. The graph is only changed
+on the event loop, so requests always see a consistent graph.
+'''
+
+MAX_BODY_BYTES = 100 * 1024 * 1024
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+def _key(tweet_id):
+    # Tweet ids are kept as ints in the graph (much smaller than strings), anything else is kept as it is
+    number = _as_int64(tweet_id)
+    return tweet_id if number is None else number
+
+def _merge_pairs(runs):
+    # merge (keys, values) int64 array pairs that are each sorted by key into one pair
+    keys = array.array("q")
+    values = array.array("q")
+    for key, value in heapq.merge(*[zip(k, v) for k, v in runs]):
+        keys.append(key)
+        values.append(value)
+    return keys, values
+
+def _sorted_pairs(keys, values, chunk_size = 100000):
+    # (keys, values) int64 arrays sorted by key, sorting a chunk at a time so that the sort's Python objects stay few
+    runs = []
+    for i in range(0, len(keys), chunk_size):
+        run = sorted(zip(keys[i:i + chunk_size], values[i:i + chunk_size]))
+        runs.append((array.array("q", [x[0] for x in run]), array.array("q", [x[1] for x in run])))
+    return _merge_pairs(runs)
+
+class ReplyGraph(object):
+    '''
+    In-memory reply graph: add_edge(tweet_id, in_reply_to_id), conversation(tweet_id) returns
+    a list of {"tweet_id", "depth"} for the conversation containing tweet_id (root first).
+
+    The edges are kept twice in int64 arrays: sorted by reply (child_ids, with parent_of_child alongside) and sorted
+    by parent (parent_ids, with child_of_parent alongside), and looked up by bisection. Edges added later go in
+    small dictionaries (the overlay) until fold() merges them into the arrays. Ids that aren't numbers stay in
+    the overlay.
+    '''
+    def __init__(self, child_ids = None, parent_ids = None, fold_size = 100000):
+        child_ids = child_ids if child_ids is not None else array.array("q")
+        parent_ids = parent_ids if parent_ids is not None else array.array("q")
+        self.child_ids, self.parent_of_child = _sorted_pairs(child_ids, parent_ids)
+        self.parent_ids, self.child_of_parent = _sorted_pairs(parent_ids, child_ids)
+        # the overlay
+        self.parents = {}
+        self.children = {}
+        # number of overlay edges that can be folded into the arrays
+        self.num_foldable = 0
+        self.fold_size = fold_size
+
+    def _parent(self, node):
+        # the parent of node, or None if it isn't a reply in the graph
+        if node in self.parents:
+            return self.parents[node]
+        if isinstance(node, int):
+            i = bisect.bisect_left(self.child_ids, node)
+            if (i < len(self.child_ids)) and (self.child_ids[i] == node):
+                return self.parent_of_child[i]
+        return None
+
+    def _children(self, node):
+        children = self.children.get(node, [])
+        if isinstance(node, int):
+            start = bisect.bisect_left(self.parent_ids, node)
+            end = bisect.bisect_right(self.parent_ids, node, start)
+            if end > start:
+                children = list(self.child_of_parent[start:end]) + children
+        return children
+
+    def add_edge(self, tweet_id, in_reply_to_id):
+        child = _key(tweet_id)
+        if self._parent(child) is not None:
+            return
+        parent = _key(in_reply_to_id)
+        self.parents[child] = parent
+        self.children.setdefault(parent, []).append(child)
+        if isinstance(child, int) and isinstance(parent, int):
+            self.num_foldable += 1
+
+    def needs_fold(self):
+        '''True once the overlay is big enough to be worth merging into the arrays'''
+        return self.num_foldable >= max(self.fold_size, len(self.child_ids) // 8)
+
+    def overlay_edges(self):
+        '''The (child, parent) edges in the overlay that can be folded into the arrays'''
+        return [(c, p) for c, p in self.parents.items() if isinstance(c, int) and isinstance(p, int)]
+
+    def merged_arrays(self, edges):
+        '''
+        New arrays with edges (from overlay_edges) merged in. This doesn't change the graph, so it can run in another
+        thread while the graph is read, as long as only one fold runs at a time.
+        '''
+        children = array.array("q", [x[0] for x in edges])
+        parents = array.array("q", [x[1] for x in edges])
+        by_child = _merge_pairs([(self.child_ids, self.parent_of_child), _sorted_pairs(children, parents)])
+        by_parent = _merge_pairs([(self.parent_ids, self.child_of_parent), _sorted_pairs(parents, children)])
+        return by_child + by_parent
+
+    def replace_arrays(self, arrays, edges):
+        '''Swap in the arrays from merged_arrays(edges), and remove edges from the overlay'''
+        self.child_ids, self.parent_of_child, self.parent_ids, self.child_of_parent = arrays
+        for child, parent in edges:
+            del(self.parents[child])
+        for parent in set([x[1] for x in edges]):
+            remaining = [x for x in self.children[parent] if x in self.parents]
+            if len(remaining) > 0:
+                self.children[parent] = remaining
+            else:
+                del(self.children[parent])
+        self.num_foldable -= len(edges)
+
+    def fold(self):
+        '''Merge the overlay into the arrays'''
+        edges = self.overlay_edges()
+        self.replace_arrays(self.merged_arrays(edges), edges)
+
+    def root(self, tweet_id):
+        '''The root of the conversation containing tweet_id'''
+        node = _key(tweet_id)
+        seen = set([node])
+        parent = self._parent(node)
+        while parent is not None:
+            node = parent
+            if node in seen:
+                # a reply loop (bad data)
+                break
+            seen.add(node)
+            parent = self._parent(node)
+        return node
+
+    def conversation(self, tweet_id):
+        root = self.root(tweet_id)
+        nodes = [{"tweet_id": str(root), "depth": 0}]
+        seen = set([root])
+        frontier = [root]
+        depth = 0
+        while len(frontier) > 0:
+            next_frontier = []
+            for parent in frontier:
+                for child in self._children(parent):
+                    if child not in seen:
+                        seen.add(child)
+                        nodes.append({"tweet_id": str(child), "depth": depth + 1})
+                        next_frontier.append(child)
+            frontier = next_frontier
+            depth += 1
+        return nodes
+
+    def memory_bytes(self):
+        '''Approximate memory used by the graph (the overlay at ~200 bytes per edge)'''
+        arrays = [self.child_ids, self.parent_of_child, self.parent_ids, self.child_of_parent]
+        return sum([x.itemsize * x.buffer_info()[1] for x in arrays]) + 200 * len(self.parents)
+
+    def __len__(self):
+        return len(self.child_ids) + len(self.parents)
+
+def load_reply_graph(tweet_collection):
+    '''
+    Read the reply edges of a collection made by create_database into a ReplyGraph
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("load_reply_graph")
+    child_ids = array.array("q")
+    parent_ids = array.array("q")
+    other_edges = []
+    for document in tweet_collection.find({"in_reply_to_id": {"$ne": "NOT_A_REPLY"}},
+            {"_id": 0, "tweet_id": 1, "in_reply_to_id": 1}):
+        child, parent = _key(document["tweet_id"]), _key(document["in_reply_to_id"])
+        if isinstance(child, int) and isinstance(parent, int):
+            child_ids.append(child)
+            parent_ids.append(parent)
+        else:
+            other_edges.append((child, parent))
+        metrics.add_items()
+    graph = ReplyGraph(child_ids, parent_ids)
+    del(child_ids, parent_ids)
+    for child, parent in other_edges:
+        graph.add_edge(child, parent)
+    metrics.finish()
+    logging.debug('Loaded {} reply edges ({} bytes)'.format(len(graph), graph.memory_bytes()))
+    return graph
+
+def fetch_conversation(tweet_collection, nodes):
+    '''
+    Conversation payload for the nodes from ReplyGraph.conversation, with the Tweets fetched from the store.
+    Returns None if none of the Tweets are in the store.
+    '''
+    documents = {x["tweet_id"]: x for x in tweet_collection.find({"tweet_id": {"$in": [n["tweet_id"] for n in nodes]}})}
+    if len(documents) == 0:
+        return None
+    # in case of missing tweets, we want some info about the originating user
+    replied_to_users = {}
+    for document in documents.values():
+        replied_to_users.setdefault(document["in_reply_to_id"],
+            {"screen_name": document["in_reply_to_user"], "user_id": document["in_reply_to_user_id"]})
+    hydrated_conversation = []
+    for node in nodes:
+        if node["tweet_id"] in documents:
+            tweet = ujson.loads(documents[node["tweet_id"]]["tweet_payload"])
+        else:
+            user = replied_to_users.get(node["tweet_id"], {"screen_name": "UNAVAILABLE", "user_id": "UNAVAILABLE"})
+            tweet = {"missing_tweet_id": node["tweet_id"], "screen_name": user["screen_name"], "user_id": user["user_id"]}
+        hydrated_conversation.append({"depth": node["depth"], "tweet": tweet})
+    # time-sort the conversation, same as build_conversations
+    hydrated_conversation_sorted = sorted(hydrated_conversation, key = lambda x: snowflake2utc(fg.tweet_id(x["tweet"])))
+    return {"depths": [x["depth"] for x in hydrated_conversation_sorted],
+            "tweets": [x["tweet"] for x in hydrated_conversation_sorted]}
+
+def insert_tweets(tweet_collection, lines):
+    '''
+    Add raw Tweet JSON lines to the store. Returns the create_database fields of the Tweets that were added
+    (not duplicates) and the numbers of duplicates and lines that weren't Tweets.
+    '''
+    documents = []
+    num_errors = 0
+    for line in lines:
+        try:
+            fields = extract_fields(line)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            num_errors += 1
+            continue
+        fields["tweet_payload"] = line
+        documents.append(fields)
+    if len(documents) == 0:
+        return [], 0, num_errors
+    num_duplicates = 0
+    failed = set()
+    try:
+        tweet_collection.insert_many(documents, ordered = False)
+    except pymongo.errors.BulkWriteError as bwe:
+        num_duplicates = _count_duplicates(bwe)
+        num_errors += len(bwe.details["writeErrors"]) - num_duplicates
+        failed = set([x["index"] for x in bwe.details["writeErrors"]])
+    added = [{k: v for k,v in x.items() if k not in ("_id", "tweet_payload")}
+             for i,x in enumerate(documents) if i not in failed]
+    return added, num_duplicates, num_errors
+
+class ConversationService(object):
+    '''
+    The service's state (the store, the graph and the brands) and request handlers
+    '''
+    def __init__(self, tweet_collection, graph, brands = None):
+        self.tweet_collection = tweet_collection
+        self.graph = graph
+        self.brands = brands
+        self.lookup_metrics = stage_metrics.stage("lookup_conversation")
+        self.ingest_metrics = stage_metrics.stage("ingest_tweets")
+        self.fold_task = None
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _fold_graph(self):
+        # merge the ingested edges into the graph's arrays in the thread pool, then swap them in on the event loop
+        edges = self.graph.overlay_edges()
+        try:
+            arrays = await self._run(self.graph.merged_arrays, edges)
+        except Exception:
+            logging.exception('Error folding {} edges into the reply graph'.format(len(edges)))
+            return
+        self.graph.replace_arrays(arrays, edges)
+        logging.debug('Folded {} edges into the reply graph'.format(len(edges)))
+
+    async def conversation(self, query):
+        tweet_ids = query.get("tweet_id", [])
+        if len(tweet_ids) != 1:
+            return 400, {"error": "provide one tweet_id"}
+        nodes = self.graph.conversation(tweet_ids[0])
+        conversation_payload = await self._run(fetch_conversation, self.tweet_collection, nodes)
+        if conversation_payload is None:
+            return 404, {"error": "Tweet {} is not in the store".format(tweet_ids[0])}
+        if query.get("enrich", ["0"])[0] not in ("0", "false", ""):
+            conversation_payload = add_enrichments.add_enrichments(conversation_payload)
+            if self.brands is not None:
+                conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, self.brands)
+        self.lookup_metrics.add_items()
+        return 200, conversation_payload
+
+    async def ingest(self, body):
+        try:
+            lines = [x for x in body.decode("utf-8").split("\n") if x.strip() != ""]
+        except UnicodeDecodeError:
+            return 400, {"error": "the body isn't UTF-8"}
+        added, num_duplicates, num_errors = await self._run(insert_tweets, self.tweet_collection, lines)
+        # back on the event loop, so no request sees a half-updated graph
+        for fields in added:
+            if fields["in_reply_to_id"] != "NOT_A_REPLY":
+                self.graph.add_edge(fields["tweet_id"], fields["in_reply_to_id"])
+        if self.graph.needs_fold() and ((self.fold_task is None) or self.fold_task.done()):
+            self.fold_task = asyncio.ensure_future(self._fold_graph())
+        self.ingest_metrics.add_items(len(added))
+        self.ingest_metrics.set_gauge("reply_edges", len(self.graph))
+        return 200, {"received": len(lines), "added": len(added), "duplicates": num_duplicates, "errors": num_errors}
+
+    async def stats(self):
+        tweets_in_store = await self._run(self.tweet_collection.count)
+        return 200, {"reply_edges": len(self.graph), "reply_graph_bytes": self.graph.memory_bytes(), "tweets_in_store": tweets_in_store,
+                     "peak_rss_bytes": stage_metrics.peak_rss_bytes()}
+
+    async def route(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/conversation":
+            return (await self.conversation(query)) if method == "GET" else (405, {"error": "use GET"})
+        if url.path == "/tweets":
+            return (await self.ingest(body)) if method == "POST" else (405, {"error": "use POST"})
+        if url.path == "/stats":
+            return (await self.stats()) if method == "GET" else (405, {"error": "use GET"})
+        return 404, {"error": "unknown path {}".format(url.path)}
+
+    async def handle_connection(self, reader, writer):
+        '''
+        Serve HTTP/1.1 requests on one connection (kept open between requests unless the client closes it)
+        '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if len(request_line) == 0:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad request line"}, False)
+                    break
+                headers = {}
+                while True:
+                    header_line = await reader.readline()
+                    if header_line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header_line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    content_length = int(headers.get("content-length", 0))
+                except ValueError:
+                    content_length = -1
+                if content_length < 0:
+                    await self._respond(writer, 400, {"error": "bad Content-Length"}, False)
+                    break
+                keep_alive = (headers.get("connection", "").lower() != "close") and (version != "HTTP/1.0")
+                if content_length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "body is too large"}, False)
+                    break
+                body = await reader.readexactly(content_length) if content_length > 0 else b""
+                try:
+                    status, response = await self.route(method, target, body)
+                except Exception as e:
+                    logging.exception('Error handling {} {}'.format(method, target))
+                    status, response = 500, {"error": str(e)}
+                await self._respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, response, keep_alive):
+        body = (ujson.dumps(response) + "\n").encode("utf-8")
+        head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+            status, STATUS_TEXT.get(status, ""), len(body), "keep-alive" if keep_alive else "close")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+async def serve(service, host = "127.0.0.1", port = 8080, socket_path = None):
+    '''
+    Serve the ConversationService on host:port, or on a Unix socket if socket_path is given, until cancelled
+    '''
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(service.handle_connection, socket_path)
+        logging.debug('Serving conversations on {}'.format(socket_path))
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        logging.debug('Serving conversations on {}:{}'.format(host, port))
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', default = 'conversation_service.log', help='name of log file')
+    parser.add_argument('--db_name', default = 'tweet_database', help='MongoDB database of the Tweet store, default tweet_database')
+    parser.add_argument('--load', nargs = '+', default = None,
+        help='add these Tweet files (or globs) to the store before starting (Tweets already in the store are skipped)')
+    parser.add_argument('--host', default = '127.0.0.1', help='address to listen on, default 127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080, help='port to listen on, default 8080')
+    parser.add_argument('--socket', default = None, help='listen on this Unix socket instead of --host/--port')
+    parser.add_argument('--brand_info', default = None, help='brands for the brand enrichments of enrich=1 requests')
+    stage_metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
+    logging.debug('###################################################################### ' +
+        'starting the conversation service')
+    stage_metrics.configure_from_args(args)
+
+    if args.load is not None:
+        client, db_name, tweet_collection = create_database(args.load, args.db_name, drop_if_nonempty = False)
+    else:
+        client = pymongo.MongoClient()
+        tweet_collection = client[args.db_name]["tweet_collection"]
+        # make sure lookups are indexed (this does nothing if the indexes are already there)
+        tweet_collection.create_index([('tweet_id', pymongo.ASCENDING)], unique = True)
+        tweet_collection.create_index([('in_reply_to_id', pymongo.ASCENDING)], unique = False)
+    brands = get_brand_info(args.brand_info) if args.brand_info is not None else None
+
+    service = ConversationService(tweet_collection, load_reply_graph(tweet_collection), brands)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+    client.close()
@@ -8,11 +8,34 @@ import ujson
 import sys
 import argparse
 import logging
-import field_getters as fg
+from fast_extract import fast_extract_fields, full_extract_fields
+from stream_io import read_lines
+from tweet_id_set import TweetIdSet
+import stage_metrics
 
 ##################################################################################### Database creation step
 
-def create_database(filename = "-", db_name = "tweet_database", drop_if_nonempty = True):
+# MongoDB's error code for a duplicate key
+DUPLICATE_KEY_ERROR = 11000
+
+def _count_duplicates(bulk_write_error):
+    # number of the failed writes in a BulkWriteError that were duplicate Tweet ids
+    return len([x for x in bulk_write_error.details["writeErrors"] if x["code"] == DUPLICATE_KEY_ERROR])
+
+def create_database(filename = "-", db_name = "tweet_database", drop_if_nonempty = True, input_workers = 1, dedup = "memory",
+        projection = None):
+    '''
+    Load Tweets into a MongoDB collection, keyed by Tweet id, with their reply information.
+    filename can be "-" (stdin), a file name, a glob or a list of those (compressed files are decompressed,
+    in input_workers parallel processes, see stream_io.read_lines)
+    Only the Tweet id, user id and reply fields are pulled out of each line (see fast_extract.py),
+    the line itself is stored unchanged.
+    Duplicate Tweets are dropped. With dedup = "memory" they are found with a compact in-memory set of Tweet ids
+    (see tweet_id_set.py, 11 to 22 bytes per Tweet), with dedup = "database" they are all sent to the database
+    and rejected by the unique index on tweet_id (no memory, but more data written).
+    If projection (a field_projection.FieldProjection) is given, only the projected Tweet is stored
+    (each line has to be decoded for this).
+    '''
 
     # get the logger
     logging.getLogger("root")
@@ -28,7 +51,7 @@ def create_database(filename = "-", db_name = "tweet_database", drop_if_nonempty
     tweet_collection = tweet_db["tweet_collection"]
     #tweet_collection.drop()
     _ = tweet_collection.create_index([('tweet_id', pymongo.ASCENDING)],unique=True)
-    _ = tweet_collection.create_index([('reply_id', pymongo.ASCENDING)],unique=False)
+    _ = tweet_collection.create_index([('in_reply_to_id', pymongo.ASCENDING)],unique=False)
     if tweet_collection.count() == 0:
         logging.debug('Created a database and collection in MongoDB. No Tweets have been added yet.')
     else:
@@ -40,57 +63,68 @@ def create_database(filename = "-", db_name = "tweet_database", drop_if_nonempty
                 " if this was not the expected behaviour, try again with 'drop_if_nonempty = False")
             tweet_collection.drop()
             _ = tweet_collection.create_index([('tweet_id', pymongo.ASCENDING)],unique=True)
-            _ = tweet_collection.create_index([('reply_id', pymongo.ASCENDING)],unique=False)
+            _ = tweet_collection.create_index([('in_reply_to_id', pymongo.ASCENDING)],unique=False)
             logging.warn("The size of the database is: {}".format(tweet_collection.count()))
 
     # store the records that we will insert
     records = tweet_collection.initialize_unordered_bulk_op()
-    # count all of the tweet ids and the duplicate ids
-    duplicate_tweet_ids = []
-    tweet_ids = set()
+    if dedup not in ("memory", "database"):
+        raise ValueError('dedup must be "memory" or "database"')
+    # the tweet ids we have seen, and a count of the duplicates
+    tweet_ids = TweetIdSet() if dedup == "memory" else None
+    num_duplicates = 0
     wrote_something = False
     num_records = 0
+    # count what we have written here, rather than asking the database in the loop
+    num_written = 0
     log_at = 0
     log_val = 10
-    for line in fileinput.input(filename):
-        # get a valid tweet
-        try:
-            tweet = ujson.loads(line)
-            tweet_id = fg.tweet_id(tweet) 
-        except (ValueError, KeyError):
-            continue
+    # lines that couldn't be read without decoding the whole Tweet
+    num_full_decodes = 0
+    metrics = stage_metrics.stage("create_database")
+    for line in read_lines(filename, input_workers):
+        metrics.add_items()
+        # get the fields we need from a valid tweet
+        fields = fast_extract_fields(line)
+        if fields is None:
+            num_full_decodes += 1
+            try:
+                fields = full_extract_fields(line)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+        tweet_id = fields["tweet_id"]
         # if this tweet id is in the set of tweet ids we already have, ignore it. 
         # tweet ids should be unique
-        if tweet_id in tweet_ids:
+        if (tweet_ids is not None) and (not tweet_ids.add(tweet_id)):
+            num_duplicates += 1
             continue
-        else:
-            tweet_ids |= {tweet_id}
-        # now try getting the reply field
-        reply_info = fg.reply_info(tweet)
         # now add the tweet to the current list of records
         # we can't hold all of the Tweets in memory at a time, so we'll do 10k at a time for now
-        records.insert({"tweet_id": tweet_id,
-                        "user_id": fg.user_id(tweet), 
-                        "in_reply_to_id": reply_info["reply_id"],
-                        "in_reply_to_user": reply_info["reply_user"],
-                        "in_reply_to_user_id": reply_info["reply_user_id"],
-                        "tweet_payload": line})
+        if projection is not None:
+            try:
+                line = projection.project_line(line)
+            except ValueError:
+                continue
+        fields["tweet_payload"] = line
+        records.insert(fields)
         num_records += 1
         # once we have x records, insert the Tweets into the MongoDb database
         if num_records >= max_write_value:
             try:
-                records.execute()
+                num_written += records.execute()["nInserted"]
                 wrote_something = True
+                metrics.set_gauge("tweets_written", num_written)
                 if log_at >= log_val:
-                    logging.debug('Collection contains {} Tweets. Still writing.'.format(tweet_collection.count()))
+                    logging.debug('Wrote {} Tweets to the collection. Still writing.'.format(num_written))
                     log_at = 0
                 else:
                     log_at += 1
             # if we still have a duplicate tweet id running around catch it
             except pymongo.errors.BulkWriteError as bwe:
-                logging.debug(bwe.details["writeErrors"])
-                pass
-                #duplicate_tweet_ids.append(bwe.details["writeErrors"][0]["op"]["tweet_id"]) # debugging
+                num_written += bwe.details["nInserted"]
+                num_duplicates += _count_duplicates(bwe)
+                if len(bwe.details["writeErrors"]) > _count_duplicates(bwe):
+                    logging.debug(bwe.details["writeErrors"])
             # reset the records that we are going to insert    
             records = tweet_collection.initialize_unordered_bulk_op()
             num_records = 0
@@ -98,12 +132,13 @@ def create_database(filename = "-", db_name = "tweet_database", drop_if_nonempty
 
     # at the end of the loop, insert the remainder of the records
     try:
-        records.execute()
+        num_written += records.execute()["nInserted"]
         wrote_something = True
         logging.debug('Collection contains {} Tweets. Still writing.'.format(tweet_collection.count()))
     # if we still have a duplicate tweet id running around catch it
     except pymongo.errors.BulkWriteError as bwe:
-        #duplicate_tweet_ids.append(bwe.details["writeErrors"][0]["op"]["tweet_id"]) # debugging
+        num_written += bwe.details["nInserted"]
+        num_duplicates += _count_duplicates(bwe)
         logging.debug('Collection contains {} Tweets. Still writing.'.format(tweet_collection.count()))
     except pymongo.errors.InvalidOperation:
         if not wrote_something:
@@ -113,7 +148,13 @@ def create_database(filename = "-", db_name = "tweet_database", drop_if_nonempty
         pass
 
     logging.debug('Collection contains {} Tweets. Done writing'.format(tweet_collection.count()))
+    logging.debug('{} input lines had to be fully decoded'.format(num_full_decodes))
+    logging.debug('{} duplicate Tweets were dropped'.format(num_duplicates))
+    metrics.set_gauge("full_decodes", num_full_decodes)
+    metrics.set_gauge("duplicate_tweets", num_duplicates)
+    metrics.set_gauge("tweets_written", num_written)
 
     del(records)
+    metrics.finish()
 
-    return client, "tweet_database", tweet_collection
+    return client, db_name, tweet_collection
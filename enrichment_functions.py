@@ -38,6 +38,51 @@ def root_user(conversation_payload):
         "user_id": fg.user_id(conversation_payload["tweets"][0])
         }
 
+def _hms(seconds):
+    # seconds as <zero-padded hours>:<zero-padded minutes>:<zero-padded seconds>
+    m, s = divmod(seconds, 60)
+    h, m = divmod(m, 60)
+    return "{}:{}:{}".format(str(h).zfill(2),str(m).zfill(2),str(s).zfill(2))
+
+def _is_brand(tweet, brands_ids, brands_names):
+    return (fg.user_id(tweet) in brands_ids) or (fg.screen_name(tweet) in brands_names)
+
+def seconds_to_first_response(conversation_payload):
+    '''
+    Seconds between the first Tweet in the thread and the next Tweet by a different user.
+    None if there is no Tweet by a different user
+    '''
+    root_user_id = fg.user_id(conversation_payload["tweets"][0])
+    root_screen_name = fg.screen_name(conversation_payload["tweets"][0])
+    root_tweet_time = snowflake2utc(fg.tweet_id(conversation_payload["tweets"][0]))
+    for t in conversation_payload["tweets"]:
+        if (fg.user_id(t) != root_user_id) and (fg.screen_name(t) != root_screen_name):
+            return snowflake2utc(fg.tweet_id(t)) - root_tweet_time
+    return None
+
+def seconds_to_first_brand_response(conversation_payload, brands):
+    '''
+    Seconds between the first Tweet in the thread and the next Tweet by a brand user.
+    None if no brand responds, or if the first Tweet is by a brand
+    '''
+    brands_ids = [b["user_id"] for b in brands]
+    brands_names = [b["screen_name"] for b in brands]
+    root_tweet = conversation_payload["tweets"][0]
+    if _is_brand(root_tweet, brands_ids, brands_names):
+        return None
+    root_tweet_time = snowflake2utc(fg.tweet_id(root_tweet))
+    for t in conversation_payload["tweets"]:
+        if _is_brand(t, brands_ids, brands_names):
+            return snowflake2utc(fg.tweet_id(t)) - root_tweet_time
+    return None
+
+def duration_seconds(conversation_payload):
+    '''
+    Seconds between the first Tweet in the thread and the last Tweet in the thread
+    '''
+    return (snowflake2utc(fg.tweet_id(conversation_payload["tweets"][-1])) - 
+        snowflake2utc(fg.tweet_id(conversation_payload["tweets"][0])))
+
 def time_to_first_response(conversation_payload):
     '''
     Time (in the format <zero-padded hours>:<zero-padded minutes:<zero-padded seconds>, H:M:S)
@@ -45,15 +90,9 @@ def time_to_first_response(conversation_payload):
     "NO_RESPONSE" if there is only one user in the thread
     '''
     if len(conversation_payload) > 1:
-        root_user_id = fg.user_id(conversation_payload["tweets"][0])
-        root_screen_name = fg.screen_name(conversation_payload["tweets"][0])
-        root_tweet_time = snowflake2utc(fg.tweet_id(conversation_payload["tweets"][0]))
-        for t in conversation_payload["tweets"]:
-            if (fg.user_id(t) != root_user_id) and (fg.screen_name(t) != root_screen_name):
-                seconds = (snowflake2utc(fg.tweet_id(t)) - root_tweet_time)
-                m, s = divmod(seconds, 60)
-                h, m = divmod(m, 60)
-                return "{}:{}:{}".format(str(h).zfill(2),str(m).zfill(2),str(s).zfill(2))
+        seconds = seconds_to_first_response(conversation_payload)
+        if seconds is not None:
+            return _hms(seconds)
     else:
         return "NO_RESPONSE"
 
@@ -66,17 +105,11 @@ def time_to_first_brand_response(conversation_payload, brands):
     if len(conversation_payload["tweets"]) > 1:
         brands_ids = [b["user_id"] for b in brands]
         brands_names = [b["screen_name"] for b in brands]
-        root_user_id = fg.user_id(conversation_payload["tweets"][0])
-        root_screen_name = fg.screen_name(conversation_payload["tweets"][0])
-        root_tweet_time = snowflake2utc(fg.tweet_id(conversation_payload["tweets"][0]))
-        if (root_user_id in brands_ids) or (root_screen_name in brands_names):
+        if _is_brand(conversation_payload["tweets"][0], brands_ids, brands_names):
             return "UNDEFINED"
-        for t in conversation_payload["tweets"]:
-            if (fg.user_id(t) in brands_ids) or (fg.screen_name(t) in brands_names):
-                seconds = (snowflake2utc(fg.tweet_id(t)) - root_tweet_time)
-                m, s = divmod(seconds, 60)
-                h, m = divmod(m, 60)
-                return "{}:{}:{}".format(str(h).zfill(2),str(m).zfill(2),str(s).zfill(2))
+        seconds = seconds_to_first_brand_response(conversation_payload, brands)
+        if seconds is not None:
+            return _hms(seconds)
         return "NO_RESPONSE"
     else:
         return "NO_RESPONSE"
@@ -88,12 +121,7 @@ def duration_of_conversation(conversation_payload):
     "NO_RESPONSE" if there is only one Tweet in the thread
     '''
     if len(conversation_payload["tweets"]) > 1:
-        root_tweet_time = snowflake2utc(fg.tweet_id(conversation_payload["tweets"][0]))
-        last_tweet_time = snowflake2utc(fg.tweet_id(conversation_payload["tweets"][-1]))
-        seconds = last_tweet_time - root_tweet_time
-        m, s = divmod(seconds, 60)
-        h, m = divmod(m, 60)
-        return "{}:{}:{}".format(str(h).zfill(2),str(m).zfill(2),str(s).zfill(2))
+        return _hms(duration_seconds(conversation_payload))
     else:
         return "NO_RESPONSE"
 
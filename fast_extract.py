@@ -0,0 +1,110 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import re
+import ujson
+import field_getters as fg
+
+'''
+Get the fields that create_database needs (Tweet id, user id and reply information) from a raw line of Tweet JSON,
+without decoding the whole Tweet.
+
+Both Tweet formats start with the Tweet id, in a fixed order:
+    activity-streams: {"id":"tag:search.twitter.com,2005:<id>","objectType":"activity",...
+    original:         {"created_at":"...","id":<id>,"id_str":"<id>",...
+and the user and reply fields are found by searching for their keys. A JSON key can't appear inside a JSON string
+(the quotes would be escaped), but it can appear in a nested Tweet (Retweets and quoted Tweets), so the fast path
+is only taken when each key appears exactly once. Anything unexpected falls back to decoding the whole line with
+ujson and using field_getters, so extract_fields always returns the same thing as the full decode.
+'''
+
+AS_ID = re.compile(r'\{"id":"tag:search\.twitter\.com,2005:(\d+)"')
+AS_ACTOR = re.compile(r'"actor":\{"objectType":"person","id":"id:twitter\.com:(\d+)"')
+AS_REPLY = re.compile(r'"inReplyTo":\{"link":"((?:[^"\\]|\\.)*)"')
+
+ORIGINAL_ID = re.compile(r'\{"created_at":"[^"]*","id":\d+,"id_str":"(\d+)"')
+ORIGINAL_USER = re.compile(r'"user":\{"id":\d+,"id_str":"(\d+)"')
+ORIGINAL_REPLY = re.compile(r'"in_reply_to_status_id_str":(?:null|"(\d+)"),"in_reply_to_user_id":(?:null|\d+),' +
+    r'"in_reply_to_user_id_str":(?:null|"(\d+)"),"in_reply_to_screen_name":(null|"\w+")')
+
+LINE_ENDINGS = ("}", "}\n", "}\r\n")
+
+def _fields(tweet_id, user_id, reply_id, reply_user, reply_user_id):
+    return {"tweet_id": tweet_id,
+            "user_id": user_id,
+            "in_reply_to_id": reply_id,
+            "in_reply_to_user": reply_user,
+            "in_reply_to_user_id": reply_user_id}
+
+def _find_once(line, key):
+    # position of key in line, or -1 if it isn't there or is there more than once
+    position = line.find(key)
+    if (position >= 0) and (line.find(key, position + len(key)) >= 0):
+        return -1
+    return position
+
+def _fast_activity_streams(line):
+    tweet_id = AS_ID.match(line)
+    if (tweet_id is None) or ('"postedTime":' not in line):
+        return None
+    actor = AS_ACTOR.match(line, max(_find_once(line, '"actor":{'), 0))
+    if actor is None:
+        return None
+    reply_position = line.find('"inReplyTo":')
+    if reply_position < 0:
+        return _fields(tweet_id.group(1), actor.group(1), "NOT_A_REPLY", "NOT_A_REPLY", "NOT_A_REPLY")
+    reply = AS_REPLY.match(line, reply_position)
+    if (reply is None) or (line.find('"inReplyTo":', reply.end()) >= 0):
+        return None
+    # the link is short, so decoding it (for escaped slashes) is cheap
+    link = ujson.loads('"' + reply.group(1) + '"')
+    return _fields(tweet_id.group(1), actor.group(1),
+        link.split("/")[-1], link.split("/")[-3].strip("\\").lower(), "UNAVAILABLE")
+
+def _fast_original(line):
+    tweet_id = ORIGINAL_ID.match(line)
+    if tweet_id is None:
+        return None
+    reply = ORIGINAL_REPLY.match(line, max(_find_once(line, '"in_reply_to_status_id_str":'), 0))
+    user = ORIGINAL_USER.match(line, max(_find_once(line, '"user":{'), 0))
+    if (reply is None) or (user is None) or ('"postedTime":' in line):
+        return None
+    if reply.group(1) is None:
+        return _fields(tweet_id.group(1), user.group(1), "NOT_A_REPLY", "NOT_A_REPLY", "NOT_A_REPLY")
+    if (reply.group(2) is None) or (reply.group(3) == "null"):
+        # a reply without the replied-to user, let field_getters decide what to do with it
+        return None
+    return _fields(tweet_id.group(1), user.group(1), reply.group(1), reply.group(3).strip('"').lower(), reply.group(2))
+
+def fast_extract_fields(line):
+    '''
+    The create_database fields of a raw Tweet JSON line, or None if the fast path can't be sure of them
+    '''
+    if not line.endswith(LINE_ENDINGS):
+        return None
+    if line.startswith('{"id":"tag:'):
+        return _fast_activity_streams(line)
+    if line.startswith('{"created_at":'):
+        return _fast_original(line)
+    return None
+
+def full_extract_fields(line):
+    '''
+    The create_database fields of a raw Tweet JSON line, decoding the whole Tweet.
+    Raises ValueError or KeyError if the line isn't a Tweet.
+    '''
+    tweet = ujson.loads(line)
+    reply_info = fg.reply_info(tweet)
+    return _fields(fg.tweet_id(tweet), fg.user_id(tweet),
+        reply_info["reply_id"], reply_info["reply_user"], reply_info["reply_user_id"])
+
+def extract_fields(line):
+    '''
+    {"tweet_id", "user_id", "in_reply_to_id", "in_reply_to_user", "in_reply_to_user_id"} for a raw Tweet JSON line,
+    using the fast path when possible. Raises ValueError or KeyError if the line isn't a Tweet.
+    '''
+    fields = fast_extract_fields(line)
+    if fields is None:
+        return full_extract_fields(line)
+    return fields
@@ -85,3 +85,15 @@ def user_mentions(tweet):
         return tweet["entities"]["user_mentions"]
     else:
         return []
+
+def text(tweet):
+    '''
+    Get the text of a Tweet (the full text of an extended Tweet), or "" for a missing Tweet.
+    Works for activity-streams (when format = True) or original format (when format = False)
+    '''
+    if ("postedTime" in tweet):
+        return tweet.get("long_object", {}).get("body", tweet["body"])
+    elif ("created_at" in tweet):
+        return tweet.get("extended_tweet", {}).get("full_text", tweet.get("full_text", tweet["text"]))
+    else:
+        return ""
@@ -0,0 +1,104 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import ujson
+
+'''
+Trim Tweet payloads to the fields that are needed downstream.
+
+Fields are given as logical names, which are translated to the right paths for activity-streams and
+original format Tweets, or as dotted paths (e.g. "entities.hashtags.text" or "gnip.matching_rules"),
+which are kept in whichever format they appear. A path through a list is applied to each element of the list.
+
+The fields that field_getters, the enrichments and create_database use to read a Tweet (id, time, user, reply,
+text and mentions) are always kept, so a projected Tweet works everywhere a full one does.
+Missing Tweet placeholders are never changed.
+'''
+
+LOGICAL_FIELDS = {
+    "id": {"activity-streams": ["id"], "original": ["id", "id_str"]},
+    "time": {"activity-streams": ["postedTime"], "original": ["created_at"]},
+    "user": {"activity-streams": ["actor.objectType", "actor.id", "actor.preferredUsername"],
+             "original": ["user.id", "user.id_str", "user.screen_name"]},
+    "reply": {"activity-streams": ["inReplyTo"],
+              "original": ["in_reply_to_status_id", "in_reply_to_status_id_str", "in_reply_to_user_id",
+                           "in_reply_to_user_id_str", "in_reply_to_screen_name"]},
+    "text": {"activity-streams": ["body", "long_object.body"], "original": ["text", "full_text", "extended_tweet.full_text"]},
+    "mentions": {"activity-streams": ["twitter_entities.user_mentions"], "original": ["entities.user_mentions"]},
+    "user_profile": {"activity-streams": ["actor"], "original": ["user"]},
+    "entities": {"activity-streams": ["twitter_entities"], "original": ["entities", "extended_tweet.entities"]},
+    }
+
+REQUIRED_FIELDS = ["id", "time", "user", "reply", "text", "mentions"]
+
+def _copy_path(source, destination, path):
+    # copy source[path[0]][path[1]]... into destination, creating the intermediate dictionaries
+    key = path[0]
+    if (not isinstance(source, dict)) or (key not in source):
+        return
+    value = source[key]
+    if len(path) == 1:
+        destination[key] = value
+    elif isinstance(value, dict):
+        _copy_path(value, destination.setdefault(key, {}), path[1:])
+    elif isinstance(value, list):
+        # apply the rest of the path to each element, keeping the list the same length
+        existing = destination.get(key)
+        projected = existing if isinstance(existing, list) and (len(existing) == len(value)) else [{} for _ in value]
+        for element, projected_element in zip(value, projected):
+            _copy_path(element, projected_element, path[1:])
+        destination[key] = projected
+    else:
+        destination[key] = value
+
+class FieldProjection(object):
+    '''
+    Projection of Tweet payloads onto fields (logical names from LOGICAL_FIELDS or dotted paths), plus the
+    REQUIRED_FIELDS. project(tweet) returns the trimmed Tweet.
+    '''
+    def __init__(self, fields):
+        self.fields = list(dict.fromkeys(REQUIRED_FIELDS + list(fields)))
+        self.paths = {"activity-streams": [], "original": []}
+        for field in self.fields:
+            for tweet_format in self.paths:
+                if field in LOGICAL_FIELDS:
+                    self.paths[tweet_format].extend([x.split(".") for x in LOGICAL_FIELDS[field][tweet_format]])
+                else:
+                    self.paths[tweet_format].append(field.split("."))
+        # keep the key order of the original format (created_at, id, id_str, ...) so that fast_extract
+        # can still read projected Tweets without decoding them
+        self.paths["original"].sort(key = lambda x: x != ["created_at"])
+
+    def project(self, tweet):
+        '''The Tweet with only the projected fields (missing Tweet placeholders are returned unchanged)'''
+        if "postedTime" in tweet:
+            paths = self.paths["activity-streams"]
+        elif "created_at" in tweet:
+            paths = self.paths["original"]
+        else:
+            return tweet
+        projected = {}
+        for path in paths:
+            _copy_path(tweet, projected, path)
+        return projected
+
+    def project_line(self, line):
+        '''Project a raw Tweet JSON line, returns a JSON string'''
+        return ujson.dumps(self.project(ujson.loads(line)))
+
+def add_projection_arguments(parser):
+    '''
+    Add the --fields command line argument to an argparse parser
+    '''
+    parser.add_argument('--fields', nargs = '+', default = None,
+        help='only keep these Tweet fields: any of {} or dotted paths '.format(", ".join(sorted(LOGICAL_FIELDS))) +
+             '(id, time, user, reply, text and mentions are always kept), default is the whole Tweet')
+
+def projection_from_args(args):
+    '''
+    A FieldProjection from the --fields argument, or None if it wasn't given
+    '''
+    if args.fields is None:
+        return None
+    return FieldProjection(args.fields)
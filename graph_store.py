@@ -0,0 +1,79 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import os
+import tempfile
+import logging
+import ujson
+
+'''
+Disk-backed list of conversation graphs (the output of build_conversations.find_conversation_graphs).
+
+Between building the graph and hydrating the conversations, every Tweet id in the input is part of some
+conversation graph. Rather than holding all of them in memory on top of the reply graph they were built from,
+at most max_in_memory_tweets graph nodes are kept in memory and the rest are spilled, one graph per line, to a
+temporary file. Iterating over the store reads the graphs back in the order they were added.
+This bounds the graphs waiting to be hydrated, not the reply graph (which find_conversation_graphs still
+holds in memory while it fills the store).
+'''
+
+class ConversationGraphStore(object):
+    '''
+    Append-only store of conversation graphs (lists of node dictionaries). Call close() to remove the spill file.
+    The spill file goes in spill_dir (default: the system temp directory).
+    '''
+    def __init__(self, max_in_memory_tweets = 10000, spill_dir = None):
+        self.max_in_memory_tweets = max_in_memory_tweets
+        self.spill_dir = spill_dir
+        self.graphs = []
+        self.in_memory_tweets = 0
+        self.spill_filename = None
+        self.num_graphs = 0
+        self.num_tweets = 0
+
+    def append(self, graph):
+        self.graphs.append(graph)
+        self.in_memory_tweets += len(graph)
+        self.num_graphs += 1
+        self.num_tweets += len(graph)
+        if self.in_memory_tweets > self.max_in_memory_tweets:
+            self._spill()
+
+    def _spill(self):
+        # append the in-memory graphs to the spill file
+        if self.spill_filename is None:
+            spill_file = tempfile.NamedTemporaryFile("w", suffix = ".graphs", dir = self.spill_dir, delete = False)
+            self.spill_filename = spill_file.name
+            logging.debug('Spilling conversation graphs to {}'.format(self.spill_filename))
+        else:
+            spill_file = open(self.spill_filename, "a")
+        with spill_file:
+            for graph in self.graphs:
+                spill_file.write(ujson.dumps(graph) + "\n")
+        self.graphs = []
+        self.in_memory_tweets = 0
+
+    def __iter__(self):
+        if self.spill_filename is not None:
+            with open(self.spill_filename) as spill_file:
+                for line in spill_file:
+                    yield(ujson.loads(line))
+        for graph in list(self.graphs):
+            yield(graph)
+
+    def __len__(self):
+        return self.num_graphs
+
+    def __getstate__(self):
+        # when the store is passed to another process, send the file name rather than the graphs
+        if len(self.graphs) > 0:
+            self._spill()
+        return self.__dict__.copy()
+
+    def close(self):
+        if self.spill_filename is not None:
+            os.remove(self.spill_filename)
+            self.spill_filename = None
+        self.graphs = []
+        self.in_memory_tweets = 0
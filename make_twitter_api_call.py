@@ -13,6 +13,8 @@ import time
 import yaml
 from requests_oauthlib import OAuth1
 import requests
+import stream_io
+import stage_metrics
 
 
 def get_authentication(credentials_file):
@@ -62,6 +64,9 @@ def make_twitter_api_call(tweets_to_query, request_times, window, possible_reque
     # If "tweets_to_query" is an empty list, don't do anything
     if len(tweets_to_query) == 0:
         return {}
+    # the callers finish the stage once they are done making calls
+    metrics = stage_metrics.stage("twitter_api")
+    metrics.add_items(len(tweets_to_query))
     # Get the current time (for the rate limit)
     current_time = datetime.datetime.now()
     # get the number of requests in the current window
@@ -72,6 +77,7 @@ def make_twitter_api_call(tweets_to_query, request_times, window, possible_reque
         seconds_to_sleep = (window - (current_time - request_times[-(possible_requests_per_window-1)])).seconds + 5
         logging.debug("To avoid hitting the rate limit, sleeping for {} seconds".format(seconds_to_sleep))
         time.sleep(seconds_to_sleep)
+        metrics.add_api_wait(seconds_to_sleep)
     # get the current time and make a request
     # Update the request times
     current_time = datetime.datetime.now()
@@ -79,10 +85,12 @@ def make_twitter_api_call(tweets_to_query, request_times, window, possible_reque
     num_requests_in_window = sum([1 for x in request_times if (current_time - x) < window])
     # make the request
     logging.debug("Sending a request to the Twitter Public API for {} Tweets".format(len(tweets_to_query)))
+    request_start = time.time()
     recovered_tweets_request = requests.post('https://api.twitter.com/1.1/statuses/lookup.json?id=' +
         ",".join(tweets_to_query), 
         auth = auth, headers = {'Content-Type': 'application/json'})
     recovered_tweets = recovered_tweets_request.json()
+    metrics.add_api_wait(time.time() - request_start)
     # check to be sure we didn't get any errors
     # log errors if we did hit them, wait around if we hit a rate limit
     # debugging: print(ujson.dumps(recovered_tweets))
@@ -95,12 +103,14 @@ def make_twitter_api_call(tweets_to_query, request_times, window, possible_reque
                     "potentially you had already called the API within the last 15 minutes)"+
                     " but we'll try to get through it.")
                 logging.warn("Pausing for {} seconds.".format(window.seconds))
+                request_start = time.time()
                 time.sleep(window.seconds + 5)
                 recovered_tweets_request = requests.post('https://api.twitter.com/1.1/statuses/lookup.json?id=' +
                     ",".join(tweets_to_query), 
                     auth = auth, headers = {'Content-Type': 'application/json'})
                 current_time = datetime.datetime.now()
                 request_times.append(current_time)
+                metrics.add_api_wait(time.time() - request_start)
         recovered_tweets = recovered_tweets_request.json()
     logging.debug("Completed a call to the Twitter Public API, {} Tweets were returned".format(len(recovered_tweets)))
     # Return the Tweets in a dictionary keyed by Tweet ID
@@ -117,12 +127,18 @@ if __name__ == '__main__':
 
     parser.add_argument('--log', default = 'call_twitter_api.log', help='name of log file')
     parser.add_argument('--credentials', default = '.twurlrc', help='credentials for hitting the Twitter Public API, path from your HOME directory')
-    parser.add_argument('--tweet_ids', default = '-', help='file of Tweet IDs, not specified goes to stdin, unquoted Tweet IDs one per line')
+    parser.add_argument('--tweet_ids', nargs = '+', default = ['-'], 
+        help='file(s) or glob(s) of Tweet IDs (can be compressed), not specified goes to stdin, unquoted Tweet IDs one per line')
+    parser.add_argument('--input_workers', type = int, default = 1,
+        help='number of processes to use to read (decompress) Tweet ID files, default 1')
+    stream_io.add_output_arguments(parser)
+    stage_metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
 
     logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
     logging.debug('###################################################################### ' + 
         'adding missing Tweets to a set of conversations')
+    stage_metrics.configure_from_args(args)
 
     # get your credentials 
     auth = get_authentication(args.credentials)
@@ -134,17 +150,21 @@ if __name__ == '__main__':
 
     # get raw data
     tweets_to_query = []
-    for line in fileinput.input(args.tweet_ids):
+    output = stream_io.writer_from_args(args)
+    api_metrics = stage_metrics.stage("twitter_api")
+    for line in stream_io.read_lines(args.tweet_ids, args.input_workers):
         tweets_to_query.append(line.strip())
         if len(tweets_to_query) == 100:
             recovered_tweets_dict = make_twitter_api_call(tweets_to_query, request_times, 
                 window, possible_requests_per_window, auth)
             tweets_to_query = []
             for tweet in recovered_tweets_dict.values():
-                print(ujson.dumps(tweet))
+                output.write_line(ujson.dumps(tweet))
     if len(tweets_to_query) > 0:
         recovered_tweets_dict = make_twitter_api_call(tweets_to_query, request_times, 
             window, possible_requests_per_window, auth)
         tweets_to_query = []
         for tweet in recovered_tweets_dict.values():
-            print(ujson.dumps(tweet))
+            output.write_line(ujson.dumps(tweet))
+    api_metrics.finish()
+    output.close()
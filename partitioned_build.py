@@ -0,0 +1,305 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import os
+import queue
+import shutil
+import logging
+import tempfile
+import multiprocessing
+import pymongo
+import field_getters as fg
+from create_database import create_database
+from graph_store import ConversationGraphStore
+from build_conversations import build_graph, find_conversation_graphs, hydrate_conversations
+from conversation_container import serialize_conversation, conversation_header
+import add_enrichments
+import stream_io
+import stage_metrics
+
+'''
+Partitioned build_conversations, using several local worker processes.
+
+    1. Load: the input files are split across N worker processes. Each one loads its files into its own
+       MongoDB collection (create_database), builds its local reply graph (build_graph) and finds the conversation
+       trees in it (find_conversation_graphs). It returns the trees (as a spill file, see graph_store.py) and the
+       ids of the roots that aren't in its input (the "dangling" roots: missing Tweets, or Tweets in another partition).
+    2. Split: a conversation can span partitions, e.g. a reply in one file and the Tweet it replies to in another.
+       Each worker gets the dangling roots of the other partitions and marks the trees that cross partitions: a
+       tree that contains one of those ids, or whose root is in another partition's collection (checked with
+       indexed $in queries). Trees that don't cross are complete, and stay with their worker. For the trees that
+       do, only the ids they share with other partitions (the "boundary" ids) go back to the main process.
+    3. Merge: in the main process, the crossing trees that share a boundary id are joined with a union-find, and
+       each group is merged into one tree with the depths recomputed.
+    4. Hydrate: each worker fetches, optionally enriches and serializes its own complete conversations (from its
+       own collection) and a share of the merged ones (from all of the partition collections).
+
+The conversations (Tweets and depths) are the same as the serial build's. Only the trees that cross partitions
+are held in the main process, and only plain data is passed between the phases; each worker connects to MongoDB
+itself.
+'''
+
+def _load_partition(partition):
+    # worker: load some input files into this partition's collection and find the conversation trees in it.
+    # Returns the trees and the ids of their roots that aren't in this partition's input.
+    logging.getLogger("root")
+    client, db_name, tweet_collection = create_database(partition["filenames"], partition["db_name"], True, dedup = partition["dedup"],
+        projection = partition["projection"])
+    parent_to_children = build_graph(tweet_collection, partition["user_ids"])
+    client.close()
+    present_roots = set(parent_to_children["NOT_A_REPLY"]["children"])
+    local_graphs = find_conversation_graphs(parent_to_children, partition["max_in_memory_value"], spill_dir = partition["spill_dir"])
+    del(parent_to_children)
+    dangling_roots = [graph[0]["tweet_id"] for graph in local_graphs if graph[0]["tweet_id"] not in present_roots]
+    return {"graphs": local_graphs, "dangling_roots": dangling_roots}
+
+def _split_partition(partition):
+    # worker: split this partition's trees into the complete ones (filtered with keep_graph), and the ones that
+    # cross partitions, with the boundary ids of each
+    logging.getLogger("root")
+    other_dangling_roots = set(partition["other_dangling_roots"])
+    client = pymongo.MongoClient()
+    other_collections = [client[db_name]["tweet_collection"] for db_name in partition["other_db_names"]]
+    # roots that are also Tweets in another partition's input
+    roots_elsewhere = set()
+    roots = [graph[0]["tweet_id"] for graph in partition["graphs"]]
+    for i in range(0, len(roots), partition["batch_size"]):
+        batch = roots[i:i + partition["batch_size"]]
+        for collection in other_collections:
+            roots_elsewhere.update([x["tweet_id"] for x in collection.find({"tweet_id": {"$in": batch}}, {"tweet_id": 1})])
+    client.close()
+    del(roots)
+    complete_graphs = ConversationGraphStore(partition["max_in_memory_value"], partition["spill_dir"])
+    crossing_graphs = ConversationGraphStore(partition["max_in_memory_value"], partition["spill_dir"])
+    boundary_ids = []
+    num_rejected = 0
+    conversation_filter = partition["conversation_filter"]
+    for graph in partition["graphs"]:
+        shared_ids = [x["tweet_id"] for x in graph if x["tweet_id"] in other_dangling_roots]
+        if (graph[0]["tweet_id"] in roots_elsewhere) and (graph[0]["tweet_id"] not in shared_ids):
+            shared_ids.append(graph[0]["tweet_id"])
+        if len(shared_ids) > 0:
+            crossing_graphs.append(graph)
+            boundary_ids.append(shared_ids)
+        elif (conversation_filter is None) or conversation_filter.keep_graph(graph):
+            complete_graphs.append(graph)
+        else:
+            num_rejected += 1
+    if conversation_filter is not None:
+        logging.debug('{} conversations were filtered out before hydration.'.format(num_rejected))
+    return {"complete_graphs": complete_graphs, "crossing_graphs": crossing_graphs, "boundary_ids": boundary_ids}
+
+def _find(parents, i):
+    # union-find root of crossing tree i, with path halving
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+def merge_trees(graphs):
+    '''
+    Merge conversation trees (in the find_conversation_graphs format) from different partitions that share Tweets
+    into one tree, recomputing the depths. A Tweet that is in more than one tree is only kept once.
+    '''
+    nodes = {}
+    for graph in graphs:
+        for node in graph:
+            merged_node = nodes.setdefault(node["tweet_id"], dict(node))
+            # a Tweet that is the (missing) root of one tree can be a reply in another
+            if merged_node["in_reply_to"] is None:
+                merged_node["in_reply_to"] = node["in_reply_to"]
+            for field in ["screen_name", "user_id", "author_id"]:
+                if field in node:
+                    merged_node.setdefault(field, node[field])
+    children = {}
+    frontier = []
+    for tweet_id, node in nodes.items():
+        if node["in_reply_to"] in nodes:
+            children.setdefault(node["in_reply_to"], []).append(tweet_id)
+        else:
+            node["in_reply_to"] = None
+            frontier.append(tweet_id)
+    # breadth first from the root, so the nodes come out sorted by depth
+    merged_graph = []
+    depth = 0
+    while len(frontier) > 0:
+        next_frontier = []
+        for tweet_id in frontier:
+            nodes[tweet_id]["depth"] = depth
+            merged_graph.append(nodes[tweet_id])
+            next_frontier.extend(children.get(tweet_id, []))
+        frontier = next_frontier
+        depth += 1
+    return merged_graph
+
+def merge_crossing_graphs(split_partitions, max_in_memory_value = 10000, conversation_filter = None, spill_dir = None):
+    '''
+    Join the trees that cross partitions (from the split phase) that share a boundary id, and merge each group into
+    one tree. Returns a ConversationGraphStore of the merged trees that pass conversation_filter.keep_graph.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("merge_crossing_graphs")
+    boundary_ids = [ids for split_partition in split_partitions for ids in split_partition["boundary_ids"]]
+    parents = list(range(len(boundary_ids)))
+    # boundary id -> the first crossing tree it was seen in
+    owners = {}
+    for i, ids in enumerate(boundary_ids):
+        for tweet_id in ids:
+            if tweet_id not in owners:
+                owners[tweet_id] = i
+                continue
+            root, other_root = _find(parents, i), _find(parents, owners[tweet_id])
+            if root != other_root:
+                parents[max(root, other_root)] = min(root, other_root)
+    del(owners, boundary_ids)
+    groups = {}
+    i = 0
+    for split_partition in split_partitions:
+        for graph in split_partition["crossing_graphs"]:
+            groups.setdefault(_find(parents, i), []).append(graph)
+            i += 1
+    logging.debug('Merging {} conversation trees that cross partitions into {}'.format(len(parents), len(groups)))
+    metrics.set_gauge("crossing_graphs", len(parents))
+    merged_graphs = ConversationGraphStore(max_in_memory_value, spill_dir)
+    while len(groups) > 0:
+        graph = merge_trees(groups.popitem()[1])
+        if (conversation_filter is None) or conversation_filter.keep_graph(graph):
+            merged_graphs.append(graph)
+            metrics.add_items()
+    metrics.finish()
+    return merged_graphs
+
+def _hydrate_partition(shards, max_in_memory_value,
+        output_format, enrich, brands, output_queue, chunk_size, conversation_filter, projection):
+    # worker: hydrate, enrich and serialize some of the conversations, put (bytes, tweet ids, header) on the queue.
+    # shards is a list of (names of the databases that hold the Tweets, graph store)
+    logging.getLogger("root")
+    client = pymongo.MongoClient()
+    chunk = []
+    for db_names, graphs in shards:
+        tweet_collections = [client[db_name]["tweet_collection"] for db_name in db_names]
+        for conversation_payload in hydrate_conversations(tweet_collections, graphs, max_in_memory_value, conversation_filter,
+                projection):
+            if enrich:
+                conversation_payload = add_enrichments.add_enrichments(conversation_payload)
+                if brands is not None:
+                    conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
+            chunk.append((serialize_conversation(conversation_payload, output_format),
+                          [fg.tweet_id(x) for x in conversation_payload["tweets"]],
+                          conversation_header(conversation_payload)))
+            if len(chunk) >= chunk_size:
+                output_queue.put(chunk)
+                chunk = []
+    if len(chunk) > 0:
+        output_queue.put(chunk)
+    client.close()
+    output_queue.put(None)
+
+def build_conversations_partitioned(database_filename, partitions = 4, max_in_memory_value = 10000,
+        db_name = "tweet_database", output_format = "json", enrich = False, brands = None, chunk_size = 100, dedup = "memory",
+        conversation_filter = None, projection = None, project_store = False, batch_size = 1000):
+    '''
+    Iterator over (serialized conversation payload, list of its Tweet ids, its conversation_container header),
+    building conversations with "partitions" worker processes. database_filename is a file name, glob or list of those (see stream_io),
+    and is split across the partitions by file, so it can't be stdin.
+    output_format is "json" or "binary" (see conversation_container.py). If enrich is True, add_enrichments
+    (and add_brand_enrichments, if brands are given) are run in the workers. dedup is passed to create_database.
+    Only conversations that pass conversation_filter (see conversation_filters.py) are built. The Tweets are trimmed
+    to the fields of projection (see field_projection.py) when they're loaded (project_store) or hydrated.
+    batch_size is the number of Tweet ids per query when looking for roots that are in other partitions.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    filenames = stream_io.expand_inputs(database_filename)
+    if "-" in filenames:
+        raise ValueError("A partitioned build can't read from stdin, provide input file names")
+    partitions = max(1, min(partitions, len(filenames)))
+    db_names = ["{}_part{}".format(db_name, i) for i in range(partitions)]
+    # spread the files across the partitions, largest first, so that the partitions are about the same size
+    sizes = [0] * partitions
+    partition_files = [[] for _ in range(partitions)]
+    for filename in sorted(filenames, key = lambda x: -os.path.getsize(x)):
+        smallest = sizes.index(min(sizes))
+        partition_files[smallest].append(filename)
+        sizes[smallest] += os.path.getsize(filename)
+    # each worker gets its share of the memory (at least one Tweet, so graphs aren't all spilled to disk)
+    worker_max_in_memory_value = max(1, max_in_memory_value // partitions)
+    # every graph store of the build spills here, so that one rmtree cleans up after the workers too
+    spill_dir = tempfile.mkdtemp(suffix = ".partitioned")
+
+    # drop the partition databases (each holds a copy of its input) however the build ends: an error in a worker,
+    # or the consumer stopping early
+    processes = []
+    try:
+        ##################################################################################### Load and split
+        logging.debug('Loading {} input files into {} partitions'.format(len(filenames), partitions))
+        pool = multiprocessing.Pool(partitions)
+        try:
+            loaded_partitions = pool.map(_load_partition,
+                [{"filenames": f, "db_name": d, "dedup": dedup, "projection": projection if project_store else None,
+                  "user_ids": (conversation_filter is not None) and conversation_filter.needs_user_ids,
+                  "max_in_memory_value": worker_max_in_memory_value, "spill_dir": spill_dir}
+                 for f,d in zip(partition_files, db_names)])
+            logging.debug('Dangling roots by partition: {}'.format([len(x["dangling_roots"]) for x in loaded_partitions]))
+            split_partitions = pool.map(_split_partition,
+                [{"graphs": loaded_partitions[i]["graphs"], "other_db_names": db_names[:i] + db_names[i + 1:],
+                  "other_dangling_roots": [x for j in range(partitions) if j != i for x in loaded_partitions[j]["dangling_roots"]],
+                  "conversation_filter": conversation_filter, "batch_size": batch_size,
+                  "max_in_memory_value": worker_max_in_memory_value, "spill_dir": spill_dir}
+                 for i in range(partitions)])
+            del(loaded_partitions)
+        finally:
+            pool.close()
+            pool.join()
+
+        ##################################################################################### Merge
+        merged_graphs = merge_crossing_graphs(split_partitions, worker_max_in_memory_value, conversation_filter, spill_dir)
+
+        ##################################################################################### Hydrate
+        # each worker hydrates its own complete conversations, the merged ones go to the workers with the fewest Tweets
+        worker_graphs = [ConversationGraphStore(worker_max_in_memory_value, spill_dir) for _ in range(partitions)]
+        worker_sizes = [x["complete_graphs"].num_tweets for x in split_partitions]
+        for graph in merged_graphs:
+            smallest = worker_sizes.index(min(worker_sizes))
+            worker_graphs[smallest].append(graph)
+            worker_sizes[smallest] += len(graph)
+        logging.debug('Hydrating conversations in {} partitions of {} Tweets'.format(partitions, worker_sizes))
+
+        output_queue = multiprocessing.Queue(partitions * 10)
+        for i in range(partitions):
+            shards = [([db_names[i]], split_partitions[i]["complete_graphs"]), (db_names, worker_graphs[i])]
+            process = multiprocessing.Process(target = _hydrate_partition, args = (shards,
+                worker_max_in_memory_value, output_format, enrich, brands, output_queue, chunk_size, conversation_filter,
+                None if project_store else projection))
+            process.daemon = True
+            process.start()
+            processes.append(process)
+        finished_workers = 0
+        while finished_workers < len(processes):
+            try:
+                chunk = output_queue.get(timeout = 10)
+            except queue.Empty:
+                # make sure that none of the workers died without finishing
+                if any([(p.exitcode is not None) and (p.exitcode != 0) for p in processes]):
+                    raise RuntimeError("A hydration worker exited with an error, see the log")
+                continue
+            if chunk is None:
+                finished_workers += 1
+                continue
+            for serialized in chunk:
+                yield(serialized)
+    finally:
+        ##################################################################################### Cleanup
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        # the spill files of all of the graph stores
+        shutil.rmtree(spill_dir, ignore_errors = True)
+        client = pymongo.MongoClient()
+        for partition_db_name in db_names:
+            client.drop_database(partition_db_name)
+        client.close()
+        logging.debug('Cleaned up the partition databases')
@@ -0,0 +1,161 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import os
+import time
+import logging
+import collections
+import ujson
+from snowflake2utc import snowflake2utc
+from conversation_container import conversation_header, serialize_conversation
+import stream_io
+from stream_io import COMPRESSION_SUFFIXES
+import stage_metrics
+
+'''
+Conversation output partitioned by time.
+
+Conversations are written to one file per hour or day, bucketed by the time of their root Tweet
+(from its snowflake id), e.g. conversations_2016-07-01.json.gz, so that a downstream job that only cares about
+some dates can read just those files, and several jobs can read different partitions in parallel.
+
+At most max_open_files partition files are open at a time (the least recently used one is closed when another
+has to be opened, and re-opened for appending if it's needed again), and each one buffers up to buffer_bytes
+before writing. When the writer is closed, a manifest.json is written to the output directory, listing each
+partition's file, number of conversations and Tweets, and time ranges.
+'''
+
+BUCKET_FORMATS = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d"}
+FORMAT_EXTENSIONS = {"json": ".json", "binary": ".cbc"}
+
+class TimePartitionedWriter(object):
+    '''
+    Writes conversation payloads to time-partitioned files in directory (see the module docstring).
+    bucket is "hour" or "day", output_format is "json" or "binary", compression is None, "gzip", "bz2" or "xz".
+    '''
+    def __init__(self, directory, bucket = "day", output_format = "json", compression = None,
+            max_open_files = 64, buffer_bytes = 1048576, prefix = "conversations"):
+        if bucket not in BUCKET_FORMATS:
+            raise ValueError('bucket must be one of: {}'.format(", ".join(sorted(BUCKET_FORMATS))))
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.bucket = bucket
+        self.output_format = output_format
+        self.compression = compression
+        self.max_open_files = max_open_files
+        self.buffer_bytes = buffer_bytes
+        self.prefix = prefix
+        # partition name -> {"stream": _, "buffer": [bytes], "buffered_bytes": _}, least recently used first
+        self.open_files = collections.OrderedDict()
+        # partition name -> manifest entry
+        self.partitions = {}
+        self.metrics = stage_metrics.stage("write_partitions")
+
+    def partition_name(self, root_time):
+        '''The name of the partition for a root Tweet time (unix seconds)'''
+        return time.strftime(BUCKET_FORMATS[self.bucket], time.gmtime(root_time))
+
+    def _filename(self, partition):
+        return "{}_{}{}{}".format(self.prefix, partition, FORMAT_EXTENSIONS[self.output_format],
+            COMPRESSION_SUFFIXES.get(self.compression, ""))
+
+    def _open(self, partition):
+        if partition in self.open_files:
+            self.open_files.move_to_end(partition)
+            return self.open_files[partition]
+        if len(self.open_files) >= self.max_open_files:
+            _, least_recent = self.open_files.popitem(last = False)
+            self._close_file(least_recent)
+        # files are created fresh the first time they're opened by this writer, and appended to after that
+        # (compressed files get a new compressed stream appended, which all of the decompressors read through)
+        mode = "ab" if partition in self.partitions else "wb"
+        open_file = {"stream": stream_io.open_file(os.path.join(self.directory, self._filename(partition)), mode),
+                     "buffer": [], "buffered_bytes": 0}
+        self.open_files[partition] = open_file
+        self.metrics.set_gauge("open_partition_files", len(self.open_files))
+        return open_file
+
+    def _flush_file(self, open_file):
+        if open_file["buffered_bytes"] > 0:
+            open_file["stream"].write(b"".join(open_file["buffer"]))
+            open_file["buffer"] = []
+            open_file["buffered_bytes"] = 0
+
+    def _close_file(self, open_file):
+        self._flush_file(open_file)
+        open_file["stream"].close()
+
+    def write_serialized(self, serialized, header):
+        '''
+        Write an already serialized conversation, with its conversation_container.conversation_header
+        '''
+        partition = self.partition_name(snowflake2utc(header["root_id"]))
+        open_file = self._open(partition)
+        open_file["buffer"].append(serialized)
+        open_file["buffered_bytes"] += len(serialized)
+        if open_file["buffered_bytes"] >= self.buffer_bytes:
+            self._flush_file(open_file)
+        if partition not in self.partitions:
+            self.partitions[partition] = {"partition": partition, "filename": self._filename(partition),
+                "conversations": 0, "tweets": 0, "start_time": header["start_time"], "end_time": header["end_time"]}
+        entry = self.partitions[partition]
+        entry["conversations"] += 1
+        entry["tweets"] += header["size"]
+        entry["start_time"] = min(entry["start_time"], header["start_time"])
+        entry["end_time"] = max(entry["end_time"], header["end_time"])
+        self.metrics.add_items()
+
+    def write(self, conversation_payload):
+        '''Serialize a conversation payload and write it to its partition'''
+        self.write_serialized(serialize_conversation(conversation_payload, self.output_format),
+            conversation_header(conversation_payload))
+
+    def manifest(self):
+        '''The manifest, as a dictionary'''
+        return {"bucket": self.bucket, "format": self.output_format, "compression": self.compression,
+                "partitions": [self.partitions[x] for x in sorted(self.partitions)]}
+
+    def close(self):
+        '''Close all of the partition files and write the manifest'''
+        for open_file in self.open_files.values():
+            self._close_file(open_file)
+        self.open_files = collections.OrderedDict()
+        manifest_filename = os.path.join(self.directory, "manifest.json")
+        with open(manifest_filename + ".tmp", "w") as f:
+            f.write(ujson.dumps(self.manifest(), indent = 2) + "\n")
+        os.replace(manifest_filename + ".tmp", manifest_filename)
+        self.metrics.finish()
+        logging.debug('Wrote {} conversations to {} partitions in {}'.format(
+            sum([x["conversations"] for x in self.partitions.values()]), len(self.partitions), self.directory))
+
+def read_manifest(directory):
+    '''
+    The manifest of a partitioned output directory, with the partition file names made into full paths
+    '''
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = ujson.load(f)
+    for partition in manifest["partitions"]:
+        partition["filename"] = os.path.join(directory, partition["filename"])
+    return manifest
+
+def add_partition_arguments(parser):
+    '''
+    Add the partitioned output command line arguments (--partition_by, --partition_dir, --max_open_partitions)
+    to an argparse parser
+    '''
+    parser.add_argument('--partition_by', choices = sorted(BUCKET_FORMATS), default = None,
+        help='write conversations to one file per hour or day of their root Tweet, in --partition_dir (see partitioned_output.py)')
+    parser.add_argument('--partition_dir', default = 'conversation_partitions', help='directory for --partition_by output')
+    parser.add_argument('--max_open_partitions', type = int, default = 64,
+        help='maximum number of partition files to keep open at a time, default 64')
+
+def partitioned_writer_from_args(args):
+    '''
+    Make a TimePartitionedWriter from the arguments added by add_partition_arguments (and stream_io.add_output_arguments,
+    for the compression), or None if --partition_by wasn't given
+    '''
+    if args.partition_by is None:
+        return None
+    return TimePartitionedWriter(args.partition_dir, args.partition_by, args.output_format,
+        args.output_compression, args.max_open_partitions)
@@ -0,0 +1,277 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import os
+import array
+import bisect
+import argparse
+import logging
+import tempfile
+import ujson
+import field_getters as fg
+import add_enrichments
+from snowflake2utc import snowflake2utc
+from get_brand_info import get_brand_info
+from tweet_id_set import TweetIdSet, _as_int64
+from conversation_container import read_conversations, read_records, decode_conversation, serialize_conversation, write_conversation
+from conversation_index import read_conversation_at
+import stream_io
+import stage_metrics
+
+'''
+Merge conversations that share a Tweet, after missing Tweets have been recovered (add_missing_tweets.py).
+
+A recovered Tweet can be a reply to a Tweet in a different conversation, e.g. build_conversations.py outputs
+A (root missing) and B separately, the missing root of A is recovered and turns out to reply to a Tweet in B.
+After recovery, A and B share a Tweet (a placeholder for it in A, the Tweet itself in B) and should be
+one conversation.
+
+Conversations only come to share a Tweet through a missing Tweet placeholder or a recovered Tweet, so only those
+Tweet ids (the "boundary" ids) are tracked, which is a small part of the input:
+
+    1. Read the conversations (spooling them to a temporary file if the input isn't a single uncompressed file),
+       collecting the boundary ids in a compact TweetIdSet, which is then turned into a sorted int64 array.
+    2. Read the conversations again. The first conversation each boundary id is seen in is kept in an int64 array
+       parallel to the sorted ids (found by bisection). Each conversation whose Tweets include a boundary id seen in
+       an earlier conversation is joined to that conversation in a union-find over conversation numbers (an int64
+       array), and the byte offset of each conversation is kept (another int64 array).
+    3. Read the conversations a third time. Conversations that weren't joined to anything are written unchanged.
+       At the first member of a group, all of the members are read from their offsets and merged: Tweets are
+       de-duplicated (a Tweet beats a placeholder for it), depths are recomputed from the reply links,
+       the Tweets are time-sorted, and the recovery fields from insert_missing_tweets are combined.
+
+Memory is about 16 bytes per conversation plus 16 bytes per boundary id (measured with tracemalloc for 1M boundary
+ids: 16.2 bytes per id, peaking at 34 while the TweetIdSet is turned into the sorted array, against ~160 for a dict
+of id strings), plus the merged groups. Enrichments of merged
+conversations are out of date, so they are dropped (use --add_enrichments to recompute them).
+'''
+
+RECOVERY_FIELDS = ["recovered_tweets", "new_missing_tweets", "unrecoverable_tweets"]
+
+def _find(parents, i):
+    # union-find root of conversation i, with path halving
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+def _read_with_offsets(stream, input_format):
+    # (offset, conversation payload) for each conversation in an open (binary mode) conversation file
+    if input_format == "binary":
+        offset = stream.tell()
+        for header, body in read_records(stream):
+            yield((offset, decode_conversation(body)))
+            offset = stream.tell()
+        return
+    while True:
+        offset = stream.tell()
+        line = stream.readline()
+        if len(line) == 0:
+            break
+        try:
+            yield((offset, ujson.loads(line)))
+        except ValueError:
+            logging.warn("Found a bad JSON payload")
+
+def _boundary_ids(conversation_payload):
+    # Tweet ids through which this conversation could be joined to another one
+    ids = [x["missing_tweet_id"] for x in conversation_payload["tweets"] if "missing_tweet_id" in x]
+    return ids + conversation_payload.get("recovered_tweets", [])
+
+def _boundary_position(boundary_array, tweet_id):
+    # index of tweet_id in the sorted int64 array of boundary ids, or -1 if it isn't there
+    number = _as_int64(tweet_id)
+    if number is None:
+        return -1
+    i = bisect.bisect_left(boundary_array, number)
+    if (i < len(boundary_array)) and (boundary_array[i] == number):
+        return i
+    return -1
+
+def merge_conversations(conversation_payloads):
+    '''
+    Merge several conversation payloads that share Tweets into one, recomputing the depths from the reply links
+    '''
+    tweets = {}
+    old_depths = {}
+    for conversation_payload in conversation_payloads:
+        for tweet, depth in zip(conversation_payload["tweets"], conversation_payload["depths"]):
+            tweet_id = fg.tweet_id(tweet)
+            # a Tweet replaces a placeholder for the same Tweet
+            if (tweet_id not in tweets) or ("missing_tweet_id" in tweets[tweet_id]):
+                tweets[tweet_id] = tweet
+            old_depths.setdefault(tweet_id, depth)
+    children = {}
+    roots = []
+    for tweet_id, tweet in tweets.items():
+        parent = fg.reply_info(tweet)["reply_id"]
+        if parent in tweets:
+            children.setdefault(parent, []).append(tweet_id)
+        else:
+            roots.append(tweet_id)
+    depths = {}
+    frontier = roots
+    depth = 0
+    while len(frontier) > 0:
+        next_frontier = []
+        for tweet_id in frontier:
+            if tweet_id not in depths:
+                depths[tweet_id] = depth
+                next_frontier.extend(children.get(tweet_id, []))
+        frontier = next_frontier
+        depth += 1
+    sorted_ids = sorted(tweets, key = lambda x: snowflake2utc(x))
+    merged_payload = {"tweets": [tweets[x] for x in sorted_ids],
+                      # Tweets that aren't reachable from a root (a reply loop) keep their old depth
+                      "depths": [depths.get(x, old_depths[x]) for x in sorted_ids]}
+    if any([("recovered_tweets" in x) for x in conversation_payloads]):
+        for field in RECOVERY_FIELDS:
+            ids = []
+            for conversation_payload in conversation_payloads:
+                ids.extend(conversation_payload.get(field, []))
+            merged_payload[field] = list(dict.fromkeys(ids))
+        still_missing = set([x for x in tweets if "missing_tweet_id" in tweets[x]])
+        merged_payload["new_missing_tweets"] = [x for x in merged_payload["new_missing_tweets"] if x in still_missing]
+        merged_payload["unrecoverable_tweets"] = [x for x in merged_payload["unrecoverable_tweets"] if x in still_missing]
+        merged_payload["ids_of_missing_tweets"] = list(still_missing)
+    return merged_payload
+
+def _spool(filename, input_format, input_workers, spool_dir):
+    # copy the input to an uncompressed temporary file, so that it can be read several times and seeked in
+    spool = tempfile.NamedTemporaryFile(mode = "w+b", suffix = ".reconcile", dir = spool_dir)
+    for conversation_payload in read_conversations(filename, input_format, input_workers = input_workers):
+        spool.write(serialize_conversation(conversation_payload, input_format))
+    spool.flush()
+    return spool
+
+def reconcile_conversations(filename = "-", input_format = "json", input_workers = 1, spool_dir = None, report_stream = None):
+    '''
+    Iterator over conversation payloads, with conversations that share a Tweet merged into one (see the module
+    docstring). filename is a file name, glob or list of those, or "-" (stdin). Merged conversations get a
+    "merged_conversations" field (the number of conversations merged), and if report_stream is given a JSON line
+    {"root_ids", "conversations", "tweets", "shared_tweet_ids"} is written to it for each merge.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("reconcile_conversations")
+    filenames = stream_io.expand_inputs(filename)
+    spool = None
+    if (len(filenames) == 1) and (filenames[0] != "-") and (os.path.splitext(filenames[0])[1] not in stream_io.COMPRESSED_OPENERS):
+        input_filename = filenames[0]
+    else:
+        spool = _spool(filenames, input_format, input_workers, spool_dir)
+        input_filename = spool.name
+
+    ##################################################################################### Pass 1: boundary ids
+    boundary_ids = TweetIdSet()
+    num_conversations = 0
+    with open(input_filename, "rb") as stream:
+        for offset, conversation_payload in _read_with_offsets(stream, input_format):
+            num_conversations += 1
+            for tweet_id in _boundary_ids(conversation_payload):
+                boundary_ids.add(tweet_id)
+    logging.debug('Read {} conversations with {} missing or recovered Tweet ids'.format(num_conversations, len(boundary_ids)))
+    # the boundary ids as a sorted int64 array, and the (few, if any) ids that aren't numbers
+    boundary_array = boundary_ids.sorted_array()
+    other_boundary_ids = boundary_ids.other_ids
+    del(boundary_ids)
+
+    ##################################################################################### Pass 2: union-find
+    parents = array.array("q", range(num_conversations))
+    offsets = array.array("q", [0]) * num_conversations
+    # the first conversation each boundary id was seen in (-1 for not seen yet), parallel to boundary_array
+    owners = array.array("q", [-1]) * len(boundary_array)
+    other_owners = {}
+    # shared Tweet ids, by conversation (only for conversations that were joined)
+    shared_ids = {}
+    with open(input_filename, "rb") as stream:
+        for i, (offset, conversation_payload) in enumerate(_read_with_offsets(stream, input_format)):
+            offsets[i] = offset
+            for tweet in conversation_payload["tweets"]:
+                tweet_id = fg.tweet_id(tweet)
+                position = _boundary_position(boundary_array, tweet_id)
+                if position >= 0:
+                    owner = owners[position]
+                    if owner < 0:
+                        owners[position] = i
+                        continue
+                elif tweet_id in other_boundary_ids:
+                    if tweet_id not in other_owners:
+                        other_owners[tweet_id] = i
+                        continue
+                    owner = other_owners[tweet_id]
+                else:
+                    continue
+                root, other_root = _find(parents, i), _find(parents, owner)
+                if root != other_root:
+                    # always keep the earlier conversation as the root, so a group is output at its first member
+                    root, other_root = min(root, other_root), max(root, other_root)
+                    parents[other_root] = root
+                    shared_ids.setdefault(root, []).extend(shared_ids.pop(other_root, []))
+                shared_ids.setdefault(root, []).append(tweet_id)
+    del(boundary_array, owners, other_owners)
+    groups = {}
+    for i in range(num_conversations):
+        root = _find(parents, i)
+        if root != i:
+            groups.setdefault(root, [root]).append(i)
+    logging.debug('Merging {} conversations into {}'.format(sum([len(x) for x in groups.values()]), len(groups)))
+    metrics.set_gauge("merged_groups", len(groups))
+
+    ##################################################################################### Pass 3: output
+    with open(input_filename, "rb") as stream, open(input_filename, "rb") as members_stream:
+        for i, (offset, conversation_payload) in enumerate(_read_with_offsets(stream, input_format)):
+            metrics.add_items()
+            if i in groups:
+                members = [conversation_payload] + [read_conversation_at(members_stream, offsets[x], input_format) for x in groups[i][1:]]
+                merged_payload = merge_conversations(members)
+                merged_payload["merged_conversations"] = len(members)
+                if report_stream is not None:
+                    report_stream.write(ujson.dumps({"root_ids": [fg.tweet_id(x["tweets"][x["depths"].index(0)]) for x in members],
+                        "conversations": len(members), "tweets": len(merged_payload["tweets"]),
+                        "shared_tweet_ids": list(dict.fromkeys(shared_ids.get(i, [])))}) + "\n")
+                yield(merged_payload)
+            elif parents[i] == i:
+                yield(conversation_payload)
+    if spool is not None:
+        spool.close()
+    metrics.finish()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', default = 'reconcile_conversations.log', help='name of log file')
+    parser.add_argument('--input_format', choices = ['json', 'binary'], default = 'json', help='format of the input conversation payloads')
+    parser.add_argument('--output_format', choices = ['json', 'binary'], default = 'json', help='format of the output conversation payloads')
+    stream_io.add_input_arguments(parser, 'input conversation file name(s) or glob(s), default is stdin')
+    stream_io.add_output_arguments(parser)
+    parser.add_argument('--spool_dir', default = None,
+        help='directory for the temporary copy of the input (made unless the input is one uncompressed file), default is the system temp directory')
+    parser.add_argument('--report', default = None, help='write a JSON line describing each merge to this file')
+    parser.add_argument('--add_enrichments', action='store_true', help='add enrichment fields to the merged conversations')
+    parser.add_argument('--brand_info', default = None, help='csv of brand screen name and brand id, used with --add_enrichments')
+    stage_metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
+    logging.debug('###################################################################### ' +
+        'reconciling conversations')
+    stage_metrics.configure_from_args(args)
+
+    brands = get_brand_info(args.brand_info) if args.brand_info is not None else None
+    report_stream = open(args.report, "w") if args.report is not None else None
+    output = stream_io.writer_from_args(args)
+    enrich_metrics = stage_metrics.stage("add_enrichments") if args.add_enrichments else None
+    for conversation_payload in reconcile_conversations(args.input, args.input_format, args.input_workers, args.spool_dir, report_stream):
+        if args.add_enrichments and ("merged_conversations" in conversation_payload):
+            conversation_payload = add_enrichments.add_enrichments(conversation_payload)
+            if brands is not None:
+                conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
+            enrich_metrics.add_items()
+        write_conversation(conversation_payload, args.output_format, output)
+    if enrich_metrics is not None:
+        enrich_metrics.finish()
+    output.close()
+    if report_stream is not None:
+        report_stream.close()
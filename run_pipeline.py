@@ -0,0 +1,99 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import argparse
+import logging
+import add_enrichments
+from build_conversations import build_conversations
+from add_missing_tweets import add_missing_tweets
+from make_twitter_api_call import get_authentication
+from get_brand_info import get_brand_info
+from conversation_container import read_conversations, write_conversation
+from field_projection import add_projection_arguments, projection_from_args
+import stream_io
+import stage_metrics
+
+'''
+Run the whole pipeline (build conversations, add missing Tweets, add enrichments) in one process.
+
+This does the same thing as
+    cat tweets.json | python build_conversations.py | python add_missing_tweets.py --add_enrichments
+but the conversation payloads are passed between the steps as Python dictionaries,
+so they are only serialized once (at the end), and enrichments are only computed once.
+'''
+
+STEPS = ["build", "add_missing", "enrich"]
+
+def run_pipeline(steps = STEPS, input_filename = "-", input_format = "json", input_workers = 1,
+        max_in_memory_value = 10000, auth = None, max_convos_in_memory = 10000, brands = None, projection = None):
+    '''
+    Iterator over conversation payloads, after running the given steps in order:
+        - "build": group the input Tweets into conversations (build_conversations.build_conversations)
+        - "add_missing": recover missing Tweets from the Twitter Public API (add_missing_tweets.add_missing_tweets),
+           auth is the OAuth1 object from make_twitter_api_call.get_authentication
+        - "enrich": add_enrichments, and add_brand_enrichments if brands (from get_brand_info) are provided
+    If "build" is not one of the steps, the input is conversation payloads in input_format ("json" or "binary")
+    rather than Tweets.
+    Built and recovered Tweets are trimmed to the fields of projection (a field_projection.FieldProjection), if it is given.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    unknown_steps = set(steps) - set(STEPS)
+    if len(unknown_steps) > 0:
+        raise ValueError("Unknown pipeline steps: {}".format(", ".join(sorted(unknown_steps))))
+    if ("add_missing" in steps) and (auth is None):
+        raise ValueError('The "add_missing" step needs Twitter API credentials')
+    logging.debug('Running the pipeline steps: {}'.format(", ".join([x for x in STEPS if x in steps])))
+
+    if "build" in steps:
+        conversations = build_conversations(max_in_memory_value, input_filename, input_workers = input_workers, projection = projection)
+    else:
+        conversations = read_conversations(input_filename, input_format, input_workers = input_workers)
+    if "add_missing" in steps:
+        conversations = add_missing_tweets(conversations, auth, max_convos_in_memory = max_convos_in_memory, projection = projection)
+    enrich_metrics = stage_metrics.stage("add_enrichments") if "enrich" in steps else None
+    for conversation_payload in conversations:
+        if "enrich" in steps:
+            conversation_payload = add_enrichments.add_enrichments(conversation_payload)
+            if brands is not None:
+                conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
+            enrich_metrics.add_items()
+        yield(conversation_payload)
+    if enrich_metrics is not None:
+        enrich_metrics.finish()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', default = 'run_pipeline.log', help='name of log file')
+    parser.add_argument('--steps', nargs = '+', default = STEPS, choices = STEPS,
+        help='pipeline steps to run, in this order: build (Tweets -> conversations), add_missing, enrich. Default is all of them')
+    parser.add_argument('--max_in_memory_value', type = int, default = 10000,
+        help='maximum number of Tweets to hold in memory at a single time while building conversations, default 10k')
+    parser.add_argument('--max_convos_in_memory', type = int, default = 10000,
+        help='maximum number of conversations to hold while waiting for missing Tweets, default 10k')
+    parser.add_argument('--credentials', default = '.twurlrc', help='credentials for hitting the Twitter Public API, path from your HOME directory')
+    parser.add_argument('--brand_info', default = None, help='csv of brand screen name and brand id, used by the enrich step')
+    parser.add_argument('--input_format', choices = ['json', 'binary'], default = 'json',
+        help='format of the input conversation payloads, if the build step is not run')
+    parser.add_argument('--output_format', choices = ['json', 'binary'], default = 'json', help='format of the output conversation payloads')
+    stream_io.add_input_arguments(parser, 'input Tweet (or conversation, without the build step) file name(s) or glob(s), default is stdin')
+    stream_io.add_output_arguments(parser)
+    add_projection_arguments(parser)
+    stage_metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
+    logging.debug('###################################################################### ' +
+        'running the conversation pipeline')
+    stage_metrics.configure_from_args(args)
+
+    auth = get_authentication(args.credentials) if "add_missing" in args.steps else None
+    brands = get_brand_info(args.brand_info) if args.brand_info is not None else None
+
+    output = stream_io.writer_from_args(args)
+    for conversation_payload in run_pipeline(args.steps, args.input, args.input_format, args.input_workers,
+            args.max_in_memory_value, auth, args.max_convos_in_memory, brands, projection_from_args(args)):
+        write_conversation(conversation_payload, args.output_format, output)
+    output.close()
@@ -0,0 +1,227 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import logging
+import pymongo
+import ujson
+import field_getters as fg
+from snowflake2utc import snowflake2utc
+from create_database import create_database
+import stage_metrics
+
+'''
+Build conversations inside MongoDB, without pulling the reply graph into Python.
+
+build_conversations.build_graph copies every reply edge into a Python dictionary and finds the conversation trees
+client-side. This does the graph work in the database instead:
+
+    1. Tweets that reply to a Tweet that isn't in the collection get a placeholder document for the missing
+       parent (in_reply_to_id = MISSING_PARENT), found by looking up each in_reply_to_id in the tweet_id index.
+    2. The reply edges ({"_id": tweet_id, "in_reply_to_id"}, no payloads) are copied to their own collection with
+       $out. From each root (Tweets that aren't replies, and the missing-parent placeholders) a $graphLookup follows
+       that collection's in_reply_to_id index down the reply tree, and every Tweet in the tree gets its
+       conversation_id (the root's Tweet id) and depth written back to its document.
+    3. The conversations are read back with a single cursor sorted by conversation_id (which is indexed),
+       so only one conversation at a time is held in memory.
+
+$graphLookup needs MongoDB 3.4 or higher. With MongoDB 4.4 or higher, the results of steps 1 and 2 are written
+back with $merge and never leave the server, with older versions they are written back with bulk updates.
+$graphLookup holds each tree in memory on the server, which is limited to 100MB. The trees are of edges
+(~70 bytes per Tweet), so that is a conversation of about a million Tweets. If a bigger one makes the aggregation
+fail, the conversations that weren't assigned yet are walked down client-side instead
+(targeted_build.walk_down, a batch of roots at a time) and their conversation_id and depth written with bulk updates.
+'''
+
+MISSING_PARENT = "MISSING_PARENT"
+ROOT_IDS = ["NOT_A_REPLY", MISSING_PARENT]
+
+def _supports_merge(client):
+    # $merge was added in MongoDB 4.2, but can only write to the collection being aggregated from 4.4
+    return tuple(client.server_info()["versionArray"][:2]) >= (4, 4)
+
+def add_missing_parents(tweet_collection, use_merge = True):
+    '''
+    Add a placeholder document {"tweet_id", "in_reply_to_id": MISSING_PARENT, "screen_name", "user_id"} for every
+    Tweet that is replied to but isn't in the collection. Returns the number of placeholders added.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    pipeline = [
+        {"$match": {"in_reply_to_id": {"$nin": ROOT_IDS}}},
+        {"$group": {"_id": "$in_reply_to_id",
+                    "screen_name": {"$first": "$in_reply_to_user"},
+                    "user_id": {"$first": "$in_reply_to_user_id"}}},
+        # uses the tweet_id index
+        {"$lookup": {"from": tweet_collection.name, "localField": "_id", "foreignField": "tweet_id", "as": "parent"}},
+        {"$match": {"parent": {"$size": 0}}},
+        {"$project": {"_id": 0, "tweet_id": "$_id", "in_reply_to_id": {"$literal": MISSING_PARENT},
+                      "screen_name": 1, "user_id": 1}}
+        ]
+    before = tweet_collection.count()
+    if use_merge:
+        tweet_collection.aggregate(pipeline + [{"$merge": {"into": tweet_collection.name, "on": "tweet_id",
+            "whenMatched": "keepExisting", "whenNotMatched": "insert"}}], allowDiskUse = True)
+    else:
+        placeholders = []
+        for placeholder in tweet_collection.aggregate(pipeline, allowDiskUse = True):
+            placeholders.append(placeholder)
+            if len(placeholders) >= 1000:
+                tweet_collection.insert_many(placeholders, ordered = False)
+                placeholders = []
+        if len(placeholders) > 0:
+            tweet_collection.insert_many(placeholders, ordered = False)
+    num_missing = tweet_collection.count() - before
+    logging.debug('Added {} placeholders for missing Tweets'.format(num_missing))
+    return num_missing
+
+def _copy_edges(tweet_collection):
+    # copy just the reply edges {"_id": tweet_id, "in_reply_to_id"} to their own collection, so that $graphLookup
+    # only holds Tweet ids in memory, not the Tweet payloads
+    edge_collection = tweet_collection.database[tweet_collection.name + "_edges"]
+    tweet_collection.aggregate([{"$project": {"_id": "$tweet_id", "in_reply_to_id": 1}},
+                                {"$out": edge_collection.name}], allowDiskUse = True)
+    edge_collection.create_index([("in_reply_to_id", pymongo.ASCENDING)], unique = False)
+    return edge_collection
+
+def _assign_client_side(tweet_collection, batch_size = 1000, max_in_memory_value = 10000):
+    # walk down from the roots that don't have a conversation yet in Python, a batch of roots at a time
+    # (imported here, targeted_build uses build_conversations, which imports this module)
+    from targeted_build import walk_down
+    roots = [x["tweet_id"] for x in tweet_collection.find({"in_reply_to_id": {"$in": ROOT_IDS},
+        "conversation_id": {"$exists": False}}, {"tweet_id": 1})]
+    logging.debug('Assigning the conversations of {} roots client-side'.format(len(roots)))
+    multi_node_graphs = walk_down(tweet_collection, roots, batch_size, max_in_memory_value)
+    try:
+        updates = []
+        for graph in multi_node_graphs:
+            for node in graph:
+                updates.append(pymongo.UpdateOne({"tweet_id": node["tweet_id"]},
+                    {"$set": {"conversation_id": graph[0]["tweet_id"], "depth": node["depth"]}}))
+            if len(updates) >= batch_size:
+                tweet_collection.bulk_write(updates, ordered = False)
+                updates = []
+        if len(updates) > 0:
+            tweet_collection.bulk_write(updates, ordered = False)
+    finally:
+        multi_node_graphs.close()
+
+def _write_members(edge_collection, tweet_collection, pipeline, use_merge, metrics):
+    # write the {"tweet_id", "conversation_id", "depth"} output of pipeline (run on the edges) to the Tweet documents
+    if use_merge:
+        edge_collection.aggregate(pipeline + [{"$merge": {"into": tweet_collection.name, "on": "tweet_id",
+            "whenMatched": "merge", "whenNotMatched": "discard"}}], allowDiskUse = True)
+        return
+    updates = []
+    for member in edge_collection.aggregate(pipeline, allowDiskUse = True):
+        updates.append(pymongo.UpdateOne({"tweet_id": member["tweet_id"]},
+            {"$set": {"conversation_id": member["conversation_id"], "depth": member["depth"]}}))
+        metrics.add_items()
+        if len(updates) >= 1000:
+            tweet_collection.bulk_write(updates, ordered = False)
+            updates = []
+    if len(updates) > 0:
+        tweet_collection.bulk_write(updates, ordered = False)
+
+def assign_conversations(tweet_collection, use_merge = True):
+    '''
+    Write "conversation_id" (the root's Tweet id) and "depth" to every document reachable from a root
+    with $graphLookup over a copy of the reply edges (see the module docstring). If the $graphLookup fails
+    (a conversation too big for its memory limit), the conversations that weren't assigned are found client-side.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("assign_conversations")
+    edge_collection = _copy_edges(tweet_collection)
+    roots = {"$match": {"in_reply_to_id": {"$in": ROOT_IDS}}}
+    pipelines = [
+        # everything below the roots, $graphLookup's depth starts at 0 for the direct replies
+        [roots,
+         {"$graphLookup": {"from": edge_collection.name, "startWith": "$_id", "connectFromField": "_id",
+                           "connectToField": "in_reply_to_id", "as": "replies", "depthField": "depth"}},
+         {"$unwind": "$replies"},
+         {"$project": {"_id": 0, "tweet_id": "$replies._id", "conversation_id": "$_id", "depth": {"$add": ["$replies.depth", 1]}}}],
+        # the roots themselves, at depth 0 (after their replies, so that if the $graphLookup fails, no root has been
+        # marked as done)
+        [roots, {"$project": {"_id": 0, "tweet_id": "$_id", "conversation_id": "$_id", "depth": {"$literal": 0}}}]
+        ]
+    try:
+        for pipeline in pipelines:
+            _write_members(edge_collection, tweet_collection, pipeline, use_merge, metrics)
+    except pymongo.errors.OperationFailure as e:
+        logging.warn("WARNING: $graphLookup failed ({}), finding the remaining conversations client-side".format(e))
+        metrics.set_gauge("client_side_fallback", 1)
+        _assign_client_side(tweet_collection)
+    finally:
+        edge_collection.drop()
+    num_unassigned = tweet_collection.count({"conversation_id": {"$exists": False}})
+    if num_unassigned > 0:
+        logging.warn("WARNING: {} Tweets could not be reached from a root Tweet (reply loops?)".format(num_unassigned))
+    metrics.finish()
+
+def hydrate_sorted_conversations(tweet_collection, conversation_filter = None, projection = None):
+    '''
+    Iterator over conversation payloads, read from a collection that has been through assign_conversations
+    with one cursor sorted by conversation_id. The conversation graphs are never in Python, so conversations
+    are checked against conversation_filter.keep_payload (see conversation_filters.py) once they are read.
+    The Tweets are trimmed to the fields of projection (a field_projection.FieldProjection), if it is given.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("hydrate_conversations")
+    tweet_collection.create_index([("conversation_id", pymongo.ASCENDING)], unique = False)
+    cursor = tweet_collection.find({"conversation_id": {"$exists": True}},
+        {"tweet_id": 1, "conversation_id": 1, "depth": 1, "tweet_payload": 1, "screen_name": 1, "user_id": 1},
+        sort = [("conversation_id", pymongo.ASCENDING)])
+    conversation_id = None
+    hydrated_conversation = []
+    for document in cursor:
+        if (document["conversation_id"] != conversation_id) and (len(hydrated_conversation) > 0):
+            metrics.add_items()
+            conversation_payload = _conversation_payload(hydrated_conversation)
+            if (conversation_filter is None) or conversation_filter.keep_payload(conversation_payload):
+                yield(conversation_payload)
+            hydrated_conversation = []
+        conversation_id = document["conversation_id"]
+        if "tweet_payload" in document:
+            tweet = ujson.loads(document["tweet_payload"])
+            if projection is not None:
+                tweet = projection.project(tweet)
+        else:
+            tweet = {"missing_tweet_id": document["tweet_id"], "screen_name": document["screen_name"],
+                     "user_id": document["user_id"]}
+        hydrated_conversation.append({"depth": document["depth"], "tweet": tweet})
+    if len(hydrated_conversation) > 0:
+        metrics.add_items()
+        conversation_payload = _conversation_payload(hydrated_conversation)
+        if (conversation_filter is None) or conversation_filter.keep_payload(conversation_payload):
+            yield(conversation_payload)
+    metrics.finish()
+
+def _conversation_payload(hydrated_conversation):
+    # time-sort the conversation, same as build_conversations
+    hydrated_conversation_sorted = sorted(hydrated_conversation, key = lambda x: snowflake2utc(fg.tweet_id(x["tweet"])))
+    return {"depths": [x["depth"] for x in hydrated_conversation_sorted],
+            "tweets": [x["tweet"] for x in hydrated_conversation_sorted]}
+
+def build_conversations_server_side(database_filename = "-", db_name = "tweet_database", drop_if_nonempty = True,
+        input_workers = 1, dedup = "memory", conversation_filter = None, projection = None, project_store = False):
+    '''
+    Iterator over conversation payloads, the same as build_conversations.build_conversations,
+    but with the conversation trees found inside MongoDB (see the module docstring)
+    '''
+    # get the logger
+    logging.getLogger("root")
+    client, db_name, tweet_collection = create_database(database_filename, db_name, drop_if_nonempty, input_workers, dedup,
+        projection if project_store else None)
+    use_merge = _supports_merge(client)
+    logging.debug('Building conversations in MongoDB ({})'.format("with $merge" if use_merge else "with bulk updates"))
+    add_missing_parents(tweet_collection, use_merge)
+    assign_conversations(tweet_collection, use_merge)
+    for conversation_payload in hydrate_sorted_conversations(tweet_collection, conversation_filter,
+            None if project_store else projection):
+        yield(conversation_payload)
+    tweet_collection.drop()
+    client.drop_database(db_name)
+    client.close()
+    logging.debug('Cleaned up the database (deleted the database & collection, closed the client)')
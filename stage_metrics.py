@@ -0,0 +1,186 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import os
+import sys
+import time
+import atexit
+import resource
+import logging
+import ujson
+
+'''
+Stage-level metrics for the pipeline scripts.
+
+Each stage (e.g. "create_database", "hydrate_conversations") records its wall time, number of items processed,
+items per second, time spent waiting on the Twitter API and gauges like queue depths.
+The peak RSS of the process is reported with every snapshot.
+
+Stages are kept in a module-level registry, so instrumenting a function is just:
+
+    metrics = stage_metrics.stage("create_database")
+    for line in lines:
+        ...
+        metrics.add_items()
+    metrics.finish()
+
+Nothing is written unless configure() has been called with a stats file, in which case all stages are written
+(as JSON or as a Prometheus textfile) every "interval" seconds and when the process exits.
+Recording an item is an integer increment plus an occasional clock check, so it is safe to use in hot loops.
+'''
+
+# how many add_items calls between checks of the clock
+CHECK_EVERY = 1000
+
+_stages = {}
+_config = {"filename": None, "format": "json", "interval": None, "last_write": 0.0, "registered": False}
+
+def peak_rss_bytes():
+    '''Peak resident set size of this process so far, in bytes'''
+    # ru_maxrss is in kilobytes on Linux (bytes on MacOSX)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss
+    return rss * 1024
+
+class StageMetrics(object):
+    '''
+    Counters for one stage of the pipeline. Use stage(name) to get one.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.start_time = time.time()
+        self.end_time = None
+        self.items = 0
+        self.api_wait_seconds = 0.0
+        self.gauges = {}
+        self._until_check = CHECK_EVERY
+
+    def add_items(self, num_items = 1):
+        self.items += num_items
+        self._until_check -= 1
+        if self._until_check <= 0:
+            self._until_check = CHECK_EVERY
+            maybe_write()
+
+    def add_api_wait(self, seconds):
+        self.api_wait_seconds += seconds
+
+    def set_gauge(self, name, value):
+        '''Record the current value of a gauge (e.g. a queue depth), the maximum value is also kept'''
+        gauge = self.gauges.setdefault(name, {"current": value, "max": value})
+        gauge["current"] = value
+        if value > gauge["max"]:
+            gauge["max"] = value
+
+    def finish(self):
+        self.end_time = time.time()
+        maybe_write()
+
+    def snapshot(self):
+        wall_seconds = (self.end_time if self.end_time is not None else time.time()) - self.start_time
+        return {"wall_seconds": round(wall_seconds, 3),
+                "items": self.items,
+                "items_per_second": round(self.items / wall_seconds, 1) if wall_seconds > 0 else 0.0,
+                "api_wait_seconds": round(self.api_wait_seconds, 3),
+                "gauges": self.gauges,
+                "finished": self.end_time is not None}
+
+def stage(name):
+    '''
+    Get the metrics for a stage, starting its clock if this is the first time the stage has been seen
+    '''
+    if name not in _stages:
+        _stages[name] = StageMetrics(name)
+    return _stages[name]
+
+def snapshot():
+    '''All of the stage metrics as a dictionary'''
+    return {"time": round(time.time(), 3), "peak_rss_bytes": peak_rss_bytes(),
+            "stages": {name: s.snapshot() for name, s in _stages.items()}}
+
+def _prometheus_text(stats):
+    lines = []
+    def metric(name, help_text, metric_type, values):
+        lines.append("# HELP conversation_builder_{} {}".format(name, help_text))
+        lines.append("# TYPE conversation_builder_{} {}".format(name, metric_type))
+        for labels, value in values:
+            if len(labels) == 0:
+                lines.append("conversation_builder_{} {}".format(name, value))
+                continue
+            label_text = ",".join('{}="{}"'.format(k, v) for k,v in labels)
+            lines.append("conversation_builder_{}{{{}}} {}".format(name, label_text, value))
+    stages = stats["stages"]
+    metric("peak_rss_bytes", "Peak resident set size of the process", "gauge", [((), stats["peak_rss_bytes"])])
+    metric("stage_items_total", "Items processed by the stage", "counter",
+        [((("stage", k),), v["items"]) for k,v in stages.items()])
+    metric("stage_wall_seconds", "Wall time of the stage", "gauge",
+        [((("stage", k),), v["wall_seconds"]) for k,v in stages.items()])
+    metric("stage_items_per_second", "Items processed per second of wall time", "gauge",
+        [((("stage", k),), v["items_per_second"]) for k,v in stages.items()])
+    metric("stage_api_wait_seconds_total", "Time spent waiting on the Twitter API", "counter",
+        [((("stage", k),), v["api_wait_seconds"]) for k,v in stages.items()])
+    metric("stage_gauge", "Current value of a stage gauge (e.g. a queue depth)", "gauge",
+        [((("stage", k), ("gauge", g)), gv["current"]) for k,v in stages.items() for g,gv in v["gauges"].items()])
+    metric("stage_gauge_max", "Maximum value of a stage gauge", "gauge",
+        [((("stage", k), ("gauge", g)), gv["max"]) for k,v in stages.items() for g,gv in v["gauges"].items()])
+    return "\n".join(lines) + "\n"
+
+def write():
+    '''
+    Write the current metrics to the configured stats file (if there is one)
+    '''
+    if _config["filename"] is None:
+        return
+    stats = snapshot()
+    if _config["format"] == "prometheus":
+        text = _prometheus_text(stats)
+    else:
+        text = ujson.dumps(stats) + "\n"
+    # write to a temporary file and rename, so that readers never see a partial file
+    temporary_filename = _config["filename"] + ".tmp"
+    try:
+        with open(temporary_filename, "w") as f:
+            f.write(text)
+        os.replace(temporary_filename, _config["filename"])
+    except OSError as e:
+        logging.warn("WARNING: Could not write the stats file {}: {}".format(_config["filename"], e))
+    _config["last_write"] = time.time()
+
+def maybe_write():
+    '''
+    Write the metrics if the configured interval has passed since the last write
+    '''
+    if (_config["filename"] is None) or (_config["interval"] is None):
+        return
+    if time.time() - _config["last_write"] >= _config["interval"]:
+        write()
+
+def configure(filename = None, stats_format = "json", interval = 60):
+    '''
+    Write stage metrics to filename ("json" or "prometheus" format) every interval seconds and at exit.
+    interval = None only writes at exit.
+    '''
+    _config["filename"] = filename
+    _config["format"] = stats_format
+    _config["interval"] = interval
+    _config["last_write"] = time.time()
+    if (filename is not None) and (not _config["registered"]):
+        atexit.register(write)
+        _config["registered"] = True
+
+def add_metrics_arguments(parser):
+    '''
+    Add the shared stats command line arguments to an argparse parser
+    '''
+    parser.add_argument('--stats_file', default = None, help='write stage metrics (wall time, items/sec, peak memory...) to this file')
+    parser.add_argument('--stats_format', choices = ['json', 'prometheus'], default = 'json',
+        help='format of the --stats_file, JSON or a Prometheus textfile, default json')
+    parser.add_argument('--stats_interval', type = float, default = 60, help='seconds between writes of the --stats_file, default 60')
+
+def configure_from_args(args):
+    '''
+    configure() from the arguments added by add_metrics_arguments
+    '''
+    configure(args.stats_file, args.stats_format, args.stats_interval)
@@ -0,0 +1,274 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import time
+import argparse
+import logging
+import collections
+import ujson
+import field_getters as fg
+from snowflake2utc import snowflake2utc
+import add_enrichments
+from get_brand_info import get_brand_info
+from conversation_container import write_conversation
+import stream_io
+from partitioned_output import add_partition_arguments, partitioned_writer_from_args
+from field_projection import add_projection_arguments, projection_from_args
+import stage_metrics
+
+'''
+Streaming conversation builder, for a live stream of Tweets (e.g. a firehose connection piped to stdin).
+
+build_conversations.py has to read all of its input before it can output anything. This keeps the conversations
+that are still active in memory instead, keyed by their root Tweet, and adds each Tweet to a conversation as it
+arrives (using fg.reply_info to find its parent). A reply whose parent hasn't arrived (yet) starts a conversation
+with the parent as a "missing" root; if the parent arrives later, it takes the place of the missing Tweet
+(and the conversation is moved under the parent's own parent, if the parent is a reply too).
+
+A conversation is output (and dropped from memory) once no Tweets have been added to it for idle_timeout seconds.
+"Now" is either the time of the newest Tweet seen so far (clock = "event", from the Tweet ids, so replaying old
+data works the same way as a live stream) or the wall clock (clock = "wall"). Idle conversations are only checked
+for when a Tweet arrives, and everything still in memory is output at the end of the input.
+If more than max_tweets_in_memory Tweets are being held, the least recently active conversations are output early.
+idle_timeout decides when a conversation is finished, max_tweets_in_memory only bounds memory: the conversations
+are kept in order of last activity, so eviction takes the ones that are closest to timing out anyway, and a
+conversation is only evicted before it has gone idle when the active conversations don't fit in memory.
+A reply to an evicted conversation starts a new one, so count evictions (the "evicted_conversations" gauge)
+as conversations that may have been split.
+
+The output payloads are the same as build_conversations.py's. A reply that arrives after its conversation has been
+output starts a new conversation, with its parent as a missing root.
+'''
+
+class ConversationStream(object):
+    '''
+    In-memory state of the active conversations. Add Tweets with add_tweet, which returns the conversation payloads
+    that are ready to be output, and call flush() at the end of the stream.
+    '''
+    def __init__(self, idle_timeout = 300, clock = "event", max_tweets_in_memory = 1000000):
+        if clock not in ("event", "wall"):
+            raise ValueError('clock must be "event" or "wall"')
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.max_tweets_in_memory = max_tweets_in_memory
+        # root id -> conversation, least recently active first
+        self.conversations = collections.OrderedDict()
+        # Tweet id (including missing roots) -> the conversation it is in
+        self.tweet_to_conversation = {}
+        self.num_tweets = 0
+        self.now = 0
+        self.num_duplicates = 0
+        self.num_evicted = 0
+
+    def _new_conversation(self, root_id):
+        conversation = {"root": root_id, "tweets": {}, "parents": {}, "missing": {}, "last_active": self.now}
+        self.conversations[root_id] = conversation
+        self.tweet_to_conversation[root_id] = conversation
+        return conversation
+
+    def _attach(self, conversation, parent_id, reply_info):
+        # conversation's root (now a real Tweet) replies to parent_id: move the conversation under the parent's
+        del(self.conversations[conversation["root"]])
+        parent_conversation = self.tweet_to_conversation.get(parent_id)
+        if parent_conversation is conversation:
+            # a reply loop (bad data), leave the conversation where it was
+            logging.warn("WARNING: Tweet {} replies to a Tweet in its own conversation".format(conversation["root"]))
+            self.conversations[conversation["root"]] = conversation
+            return conversation
+        if parent_conversation is None:
+            # the parent is the new missing root of this conversation
+            conversation["missing"][parent_id] = {"screen_name": reply_info["reply_user"], "user_id": reply_info["reply_user_id"]}
+            conversation["root"] = parent_id
+            self.conversations[parent_id] = conversation
+            self.tweet_to_conversation[parent_id] = conversation
+            return conversation
+        # merge the smaller conversation into the larger one, keeping the parent's root
+        larger, smaller = parent_conversation, conversation
+        if len(smaller["tweets"]) + len(smaller["missing"]) > len(larger["tweets"]) + len(larger["missing"]):
+            larger, smaller = smaller, larger
+            del(self.conversations[parent_conversation["root"]])
+            larger["root"] = parent_conversation["root"]
+            self.conversations[larger["root"]] = larger
+        for key in ("tweets", "parents", "missing"):
+            larger[key].update(smaller[key])
+        for tweet_id in list(smaller["tweets"]) + list(smaller["missing"]):
+            self.tweet_to_conversation[tweet_id] = larger
+        return larger
+
+    def add_tweet(self, tweet):
+        '''
+        Add a Tweet (dictionary) to the conversations. Returns a list of the conversation payloads that are
+        ready to be output (idle, or evicted to keep memory bounded)
+        '''
+        tweet_id = fg.tweet_id(tweet)
+        reply_info = fg.reply_info(tweet)
+        if self.clock == "event":
+            self.now = max(self.now, snowflake2utc(tweet_id))
+        else:
+            self.now = time.time()
+        conversation = self.tweet_to_conversation.get(tweet_id)
+        if conversation is not None:
+            if tweet_id not in conversation["missing"]:
+                self.num_duplicates += 1
+                return self._ready_conversations()
+            # a Tweet that was missing has arrived, it must be this conversation's root
+            del(conversation["missing"][tweet_id])
+            conversation["tweets"][tweet_id] = tweet
+            self.num_tweets += 1
+            if reply_info["reply_id"] != "NOT_A_REPLY":
+                conversation["parents"][tweet_id] = reply_info["reply_id"]
+                conversation = self._attach(conversation, reply_info["reply_id"], reply_info)
+        elif reply_info["reply_id"] == "NOT_A_REPLY":
+            conversation = self._new_conversation(tweet_id)
+            conversation["tweets"][tweet_id] = tweet
+            self.num_tweets += 1
+        else:
+            conversation = self.tweet_to_conversation.get(reply_info["reply_id"])
+            if conversation is None:
+                conversation = self._new_conversation(reply_info["reply_id"])
+                conversation["missing"][reply_info["reply_id"]] = {"screen_name": reply_info["reply_user"],
+                                                                   "user_id": reply_info["reply_user_id"]}
+            conversation["tweets"][tweet_id] = tweet
+            conversation["parents"][tweet_id] = reply_info["reply_id"]
+            self.tweet_to_conversation[tweet_id] = conversation
+            self.num_tweets += 1
+        conversation["last_active"] = self.now
+        self.conversations.move_to_end(conversation["root"])
+        return self._ready_conversations()
+
+    def _ready_conversations(self):
+        ready = []
+        # the least recently active conversations are at the front
+        while len(self.conversations) > 0:
+            conversation = next(iter(self.conversations.values()))
+            if self.now - conversation["last_active"] >= self.idle_timeout:
+                ready.append(self._pop(conversation))
+            elif self.num_tweets > self.max_tweets_in_memory:
+                self.num_evicted += 1
+                ready.append(self._pop(conversation))
+            else:
+                break
+        return ready
+
+    def _pop(self, conversation):
+        del(self.conversations[conversation["root"]])
+        for tweet_id in list(conversation["tweets"]) + list(conversation["missing"]):
+            del(self.tweet_to_conversation[tweet_id])
+        self.num_tweets -= len(conversation["tweets"])
+        return conversation_to_payload(conversation)
+
+    def flush(self):
+        '''Output all of the conversations that are still in memory'''
+        ready = [self._pop(conversation) for conversation in list(self.conversations.values())]
+        logging.debug('{} duplicate Tweets were dropped, {} conversations were output early to limit memory'.format(
+            self.num_duplicates, self.num_evicted))
+        return ready
+
+def conversation_to_payload(conversation):
+    '''
+    The conversation payload (time-sorted "tweets" and their "depths", as in build_conversations.py) of a
+    conversation from ConversationStream
+    '''
+    children = {}
+    for tweet_id, parent_id in conversation["parents"].items():
+        children.setdefault(parent_id, []).append(tweet_id)
+    # breadth-first from the root to get the depths
+    depths = {conversation["root"]: 0}
+    to_visit = collections.deque([conversation["root"]])
+    while len(to_visit) > 0:
+        tweet_id = to_visit.popleft()
+        for child in children.get(tweet_id, []):
+            if child not in depths:
+                depths[child] = depths[tweet_id] + 1
+                to_visit.append(child)
+    tweets = list(conversation["tweets"].values())
+    tweets.extend([{"missing_tweet_id": k, "screen_name": v["screen_name"], "user_id": v["user_id"]}
+                   for k,v in conversation["missing"].items()])
+    tweets.sort(key = lambda x: snowflake2utc(fg.tweet_id(x)))
+    return {"depths": [depths[fg.tweet_id(x)] for x in tweets], "tweets": tweets}
+
+def stream_conversations(lines, idle_timeout = 300, clock = "event", max_tweets_in_memory = 1000000, projection = None):
+    '''
+    Iterator over conversation payloads from an iterable of Tweet JSON lines, output as they go idle
+    (see ConversationStream). Lines that aren't JSON, and Tweets without ids, are logged and skipped.
+    If projection (a field_projection.FieldProjection) is given, Tweets are trimmed as they arrive.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("stream_conversations")
+    stream = ConversationStream(idle_timeout, clock, max_tweets_in_memory)
+    for line in lines:
+        try:
+            tweet = ujson.loads(line)
+            fg.tweet_id(tweet)
+            fg.reply_info(tweet)
+            if projection is not None:
+                tweet = projection.project(tweet)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logging.warn("WARNING: Could not add a Tweet to a conversation: {}".format(line[:200]))
+            continue
+        ready = stream.add_tweet(tweet)
+        metrics.add_items()
+        for payload in ready:
+            yield(payload)
+        if len(ready) > 0:
+            metrics.set_gauge("conversations_in_memory", len(stream.conversations))
+            metrics.set_gauge("tweets_in_memory", stream.num_tweets)
+            metrics.set_gauge("evicted_conversations", stream.num_evicted)
+    for payload in stream.flush():
+        yield(payload)
+    metrics.finish()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', default = 'stream_conversations.log', help='name of log file')
+    parser.add_argument('--idle_timeout', type = float, default = 300,
+        help='output a conversation once no Tweets have been added to it for this many seconds, default 300')
+    parser.add_argument('--clock', choices = ['event', 'wall'], default = 'event',
+        help='measure idle time by Tweet time ("event", default) or by the wall clock ("wall")')
+    parser.add_argument('--max_tweets_in_memory', type = int, default = 1000000,
+        help='output the least recently active conversations early to hold at most this many Tweets, default 1M')
+    stream_io.add_input_arguments(parser)
+    stream_io.add_output_arguments(parser)
+    parser.add_argument('--brand_info', default = None)
+    parser.add_argument('--add_enrichments', action='store_true', help='add enrichment fields to the conversations')
+    parser.add_argument('--output_format', choices = ['json', 'binary'], default = 'json',
+        help='"json" (one conversation payload per line, default) or "binary" (see conversation_container.py)')
+    add_partition_arguments(parser)
+    add_projection_arguments(parser)
+    stage_metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
+    logging.debug('###################################################################### ' +
+        'streaming conversations')
+    stage_metrics.configure_from_args(args)
+
+    brands = get_brand_info(args.brand_info) if args.brand_info is not None else None
+
+    partitioned_output = partitioned_writer_from_args(args)
+    if (partitioned_output is not None) and (args.output != "-"):
+        parser.error("--partition_by writes to --partition_dir, it can't be used with --output")
+    output = stream_io.writer_from_args(args) if partitioned_output is None else None
+    enrich_metrics = stage_metrics.stage("add_enrichments") if args.add_enrichments else None
+    for conversation_payload in stream_conversations(stream_io.read_lines(args.input, args.input_workers),
+            args.idle_timeout, args.clock, args.max_tweets_in_memory, projection_from_args(args)):
+        if args.add_enrichments:
+            conversation_payload = add_enrichments.add_enrichments(conversation_payload)
+            if brands is not None:
+                conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
+            enrich_metrics.add_items()
+        if partitioned_output is not None:
+            partitioned_output.write(conversation_payload)
+            continue
+        write_conversation(conversation_payload, args.output_format, output)
+        # downstream readers of a live stream shouldn't have to wait for a buffer to fill
+        output.flush()
+    if enrich_metrics is not None:
+        enrich_metrics.finish()
+    if partitioned_output is not None:
+        partitioned_output.close()
+    else:
+        output.close()
@@ -0,0 +1,249 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import os
+import sys
+import glob
+import gzip
+import bz2
+import lzma
+import queue
+import pickle
+import fileinput
+import logging
+import multiprocessing
+import stage_metrics
+
+'''
+Input and output streams for the command line scripts.
+
+Inputs can be stdin ("-"), a file name, a glob ("tweets/2016-07-*.json.gz") or a list of any of those.
+Files ending in .gz, .bz2 or .xz are decompressed, and several files can be decompressed in parallel worker processes.
+Outputs can be stdout or a file, optionally compressed and rotated into numbered files once they reach a size limit.
+'''
+
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}
+
+def expand_inputs(inputs = "-"):
+    '''
+    Turn a file name, glob or list of file names/globs into a list of file names.
+    "-" (stdin) is passed through as-is. Globs that don't match anything are logged and dropped.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    filenames = []
+    for pattern in inputs:
+        if pattern == "-":
+            filenames.append(pattern)
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if len(matches) == 0:
+                logging.warn("WARNING: No input files match {}".format(pattern))
+            filenames.extend(matches)
+        else:
+            filenames.append(pattern)
+    return filenames
+
+def open_file(filename, mode = "rt"):
+    '''
+    Open a (possibly compressed, by file extension) file. Text modes use UTF-8.
+    '''
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(filename)[1], open)
+    if "b" in mode:
+        return opener(filename, mode)
+    return opener(filename, mode, encoding = "utf-8")
+
+def _decompression_worker(file_queue, line_queue, chunk_size):
+    # read whole files from the file queue, pass their lines back in chunks
+    # a None on the line queue means that this worker is finished, an exception means that a file couldn't be read
+    # (it is raised in the reading process, after the lines that were read before it)
+    while True:
+        filename = file_queue.get()
+        if filename is None:
+            break
+        chunk = []
+        try:
+            with open_file(filename) as f:
+                for line in f:
+                    chunk.append(line)
+                    if len(chunk) >= chunk_size:
+                        line_queue.put(chunk)
+                        chunk = []
+        except Exception as e:
+            logging.error("ERROR: Could not read {}: {}".format(filename, e))
+            if len(chunk) > 0:
+                line_queue.put(chunk)
+            try:
+                pickle.dumps(e)
+            except Exception:
+                # the queue would drop an exception it can't pickle
+                e = RuntimeError("Could not read {}: {}".format(filename, e))
+            line_queue.put(e)
+            return
+        if len(chunk) > 0:
+            line_queue.put(chunk)
+    line_queue.put(None)
+
+def read_lines(inputs = "-", workers = 1, chunk_size = 1000, max_queued_chunks = 100):
+    '''
+    Iterator over the lines of all of the inputs (see expand_inputs).
+    With workers > 1, files are decompressed in that many worker processes and lines from different files
+    are interleaved (lines from a single file stay in order). Stdin is always read in this process.
+    A file that can't be read (e.g. a truncated .gz) raises its error either way, and a worker that dies without
+    finishing raises a RuntimeError.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    filenames = expand_inputs(inputs)
+    if "-" in filenames:
+        filenames = [x for x in filenames if x != "-"]
+        for line in fileinput.input("-"):
+            yield(line)
+    if (workers <= 1) or (len(filenames) <= 1):
+        for filename in filenames:
+            with open_file(filename) as f:
+                for line in f:
+                    yield(line)
+        return
+    workers = min(workers, len(filenames))
+    logging.debug('Reading {} input files with {} worker processes'.format(len(filenames), workers))
+    file_queue = multiprocessing.Queue()
+    line_queue = multiprocessing.Queue(max_queued_chunks)
+    for filename in filenames:
+        file_queue.put(filename)
+    processes = []
+    for _ in range(workers):
+        file_queue.put(None)
+        process = multiprocessing.Process(target = _decompression_worker, args = (file_queue, line_queue, chunk_size))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    metrics = stage_metrics.stage("read_input")
+    try:
+        finished_workers = 0
+        # True once every worker has exited, so that one more empty wait means their lines are never coming
+        all_exited = False
+        while finished_workers < workers:
+            try:
+                chunk = line_queue.get(timeout = 10)
+            except queue.Empty:
+                # make sure that none of the workers died without finishing (e.g. killed for using too much memory)
+                if any([(p.exitcode is not None) and (p.exitcode != 0) for p in processes]):
+                    raise RuntimeError("A decompression worker exited with an error, see the log")
+                if all_exited:
+                    raise RuntimeError("The decompression workers exited without passing back all of the input, see the log")
+                all_exited = all([p.exitcode is not None for p in processes])
+                continue
+            if chunk is None:
+                finished_workers += 1
+                continue
+            if isinstance(chunk, Exception):
+                # fail the same way as reading the files in this process would
+                raise chunk
+            metrics.add_items(len(chunk))
+            try:
+                metrics.set_gauge("queued_chunks", line_queue.qsize())
+            except NotImplementedError:
+                # qsize isn't available on MacOSX
+                pass
+            for line in chunk:
+                yield(line)
+    finally:
+        metrics.finish()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+class RotatingWriter(object):
+    '''
+    Binary output stream that writes to stdout ("-") or a file, optionally compressed ("gzip", "bz2" or "xz").
+    If max_bytes is set, the output is split into numbered files (out.00000.json.gz, out.00001.json.gz, ...),
+    starting a new file once the current one has had max_bytes (uncompressed) written to it.
+    Records passed to a single write call are never split across files.
+    '''
+    def __init__(self, filename = "-", compression = None, max_bytes = None):
+        if (filename == "-") and (max_bytes is not None):
+            raise ValueError("Output can't be rotated when writing to stdout, provide an output file name")
+        if compression is None:
+            # infer the compression from the file name
+            compression = {v: k for k,v in COMPRESSION_SUFFIXES.items()}.get(os.path.splitext(filename)[1])
+        self.filename = filename
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.file_number = 0
+        self.bytes_written = 0
+        self.filenames = []
+        self.stream = self._open()
+
+    def _next_filename(self):
+        suffix = COMPRESSION_SUFFIXES.get(self.compression, "")
+        base = self.filename
+        if (suffix != "") and base.endswith(suffix):
+            base = base[:-len(suffix)]
+        if self.max_bytes is not None:
+            stem, extension = os.path.splitext(base)
+            base = "{}.{}{}".format(stem, str(self.file_number).zfill(5), extension)
+        return base + suffix
+
+    def _open(self):
+        if self.filename == "-":
+            if self.compression == "gzip":
+                return gzip.GzipFile(fileobj = sys.stdout.buffer, mode = "wb")
+            elif self.compression == "bz2":
+                return bz2.BZ2File(sys.stdout.buffer, mode = "wb")
+            elif self.compression == "xz":
+                return lzma.LZMAFile(sys.stdout.buffer, mode = "wb")
+            return sys.stdout.buffer
+        filename = self._next_filename()
+        self.filenames.append(filename)
+        return open_file(filename, "wb")
+
+    def write(self, data):
+        if (self.max_bytes is not None) and (self.bytes_written > 0) and (self.bytes_written + len(data) > self.max_bytes):
+            self.stream.close()
+            self.file_number += 1
+            self.bytes_written = 0
+            self.stream = self._open()
+        self.stream.write(data)
+        self.bytes_written += len(data)
+
+    def write_line(self, line):
+        self.write((line + "\n").encode("utf-8"))
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        if self.stream is sys.stdout.buffer:
+            self.stream.flush()
+        else:
+            self.stream.close()
+
+def add_input_arguments(parser, input_help = 'input file name(s) or glob(s), .gz/.bz2/.xz files are decompressed, default is stdin'):
+    '''
+    Add the shared input command line arguments (--input, --input_workers) to an argparse parser
+    '''
+    parser.add_argument('--input', nargs = '+', default = ['-'], help = input_help)
+    parser.add_argument('--input_workers', type = int, default = 1,
+        help='number of processes to use to read (decompress) input files, default 1')
+
+def add_output_arguments(parser):
+    '''
+    Add the shared output command line arguments (--output, --output_compression, --output_max_bytes) to an argparse parser
+    '''
+    parser.add_argument('--output', default = '-', help='name of output file, default is stdout')
+    parser.add_argument('--output_compression', choices = ['gzip', 'bz2', 'xz'], default = None,
+        help='compress the output, by default inferred from the --output file extension')
+    parser.add_argument('--output_max_bytes', type = int, default = None,
+        help='start a new numbered output file after this many (uncompressed) bytes, requires --output')
+
+def writer_from_args(args):
+    '''
+    Make a RotatingWriter from the arguments added by add_output_arguments
+    '''
+    return RotatingWriter(args.output, args.output_compression, args.output_max_bytes)
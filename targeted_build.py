@@ -0,0 +1,192 @@
+# Author: Fiona Pigott
+# Date: October 19, 2026
+# Free to use, no guarantees of anything
+
+import argparse
+import logging
+import pymongo
+import add_enrichments
+from get_brand_info import get_brand_info
+from create_database import create_database
+from build_conversations import hydrate_conversations
+from graph_store import ConversationGraphStore
+from conversation_container import write_conversation
+from field_projection import add_projection_arguments, projection_from_args
+import stream_io
+import stage_metrics
+
+'''
+Build only the conversations that contain some "seed" Tweets, from a persistent Tweet store.
+
+build_conversations.py builds every conversation in its input, and then throws the database away. This works
+against a MongoDB collection that is kept between runs (made by create_database, e.g. with --load here), and only
+touches the Tweets that are connected to the seeds:
+
+    1. Walk up: look up each seed, then its parent, and so on (by tweet_id) until reaching a Tweet that isn't a
+       reply, or a parent that isn't in the store (which becomes a "missing" root).
+    2. Walk down: from each root, find the replies to the current level of the tree (by in_reply_to_id), level by
+       level, to get every Tweet in the conversation and its depth.
+    3. Hydrate the conversations exactly like build_conversations.py does.
+
+Both walks use indexed $in queries of at most batch_size ids, so the run time depends on the size of the
+conversations that contain the seeds, not on the size of the store.
+'''
+
+REPLY_FIELDS = {"tweet_id": 1, "in_reply_to_id": 1, "in_reply_to_user": 1, "in_reply_to_user_id": 1}
+
+def _batches(items, batch_size):
+    items = list(items)
+    for i in range(0, len(items), batch_size):
+        yield(items[i:i + batch_size])
+
+def find_roots(tweet_collection, seed_ids, batch_size = 1000):
+    '''
+    Walk up the reply chains from the seed Tweet ids. Returns a set of the root Tweet ids
+    (including roots that are missing from the store)
+    '''
+    metrics = stage_metrics.stage("find_roots")
+    roots = set()
+    visited = set()
+    frontier = set(seed_ids)
+    while len(frontier) > 0:
+        visited |= frontier
+        found = set()
+        next_frontier = set()
+        for batch in _batches(frontier, batch_size):
+            for document in tweet_collection.find({"tweet_id": {"$in": batch}}, REPLY_FIELDS):
+                metrics.add_items()
+                found.add(document["tweet_id"])
+                if document["in_reply_to_id"] == "NOT_A_REPLY":
+                    roots.add(document["tweet_id"])
+                elif document["in_reply_to_id"] not in visited:
+                    next_frontier.add(document["in_reply_to_id"])
+        # Tweets that aren't in the store are the (missing) roots of their conversations
+        roots |= frontier - found
+        frontier = next_frontier
+    metrics.finish()
+    return roots
+
+def walk_down(tweet_collection, roots, batch_size = 1000, max_in_memory_value = 10000):
+    '''
+    Find every Tweet in the conversations starting at roots, level by level. Returns a ConversationGraphStore
+    of conversation graphs in the same format as build_conversations.find_conversation_graphs.
+    Missing roots that nothing in the store replies to are left out.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    metrics = stage_metrics.stage("walk_down")
+    multi_node_graphs = ConversationGraphStore(max_in_memory_value)
+    try:
+        for root_batch in _batches(roots, batch_size):
+            graphs = {root: [{"tweet_id": root, "depth": 0, "in_reply_to": None}] for root in root_batch}
+            tweet_to_root = {root: root for root in root_batch}
+            # in case of missing tweets, we want some info about the originating user
+            replied_to_users = {}
+            frontier = list(root_batch)
+            depth = 0
+            while len(frontier) > 0:
+                next_frontier = []
+                for batch in _batches(frontier, batch_size):
+                    for document in tweet_collection.find({"in_reply_to_id": {"$in": batch}}, REPLY_FIELDS):
+                        if document["tweet_id"] in tweet_to_root:
+                            # a reply loop (bad data)
+                            continue
+                        metrics.add_items()
+                        parent = document["in_reply_to_id"]
+                        tweet_to_root[document["tweet_id"]] = tweet_to_root[parent]
+                        graphs[tweet_to_root[parent]].append({"tweet_id": document["tweet_id"], "depth": depth + 1, "in_reply_to": parent})
+                        replied_to_users.setdefault(parent, {"screen_name": document["in_reply_to_user"],
+                                                             "user_id": document["in_reply_to_user_id"]})
+                        next_frontier.append(document["tweet_id"])
+                frontier = next_frontier
+                depth += 1
+            present = set([x["tweet_id"] for x in tweet_collection.find({"tweet_id": {"$in": list(root_batch)}}, {"tweet_id": 1})])
+            for root, graph in graphs.items():
+                if (root not in present) and (len(graph) == 1):
+                    logging.debug('Tweet {} is not in the store'.format(root))
+                    continue
+                for node in graph:
+                    if node["tweet_id"] in replied_to_users:
+                        node.update(replied_to_users[node["tweet_id"]])
+                multi_node_graphs.append(graph)
+    except BaseException:
+        # don't leave the spill file behind
+        multi_node_graphs.close()
+        raise
+    metrics.finish()
+    return multi_node_graphs
+
+def build_targeted_conversations(tweet_collection, seed_ids, max_in_memory_value = 10000, batch_size = 1000, projection = None):
+    '''
+    Iterator over the conversation payloads (in the build_conversations.py format) of the conversations that
+    contain any of seed_ids, from a collection made by create_database.
+    The Tweets are trimmed to the fields of projection (a field_projection.FieldProjection), if it is given.
+    '''
+    # get the logger
+    logging.getLogger("root")
+    # make sure the walks are indexed (this does nothing if the indexes are already there)
+    tweet_collection.create_index([('tweet_id', pymongo.ASCENDING)], unique = True)
+    tweet_collection.create_index([('in_reply_to_id', pymongo.ASCENDING)], unique = False)
+    roots = find_roots(tweet_collection, seed_ids, batch_size)
+    logging.debug('{} seed Tweets are in {} conversations'.format(len(seed_ids), len(roots)))
+    multi_node_graphs = walk_down(tweet_collection, roots, batch_size, max_in_memory_value)
+    logging.debug('Found {} Tweets in {} conversations'.format(multi_node_graphs.num_tweets, len(multi_node_graphs)))
+    # close the graph store (removing its spill file) even if the consumer stops early or there is an error
+    try:
+        for conversation_payload in hydrate_conversations(tweet_collection, multi_node_graphs, max_in_memory_value, projection = projection):
+            yield(conversation_payload)
+    finally:
+        multi_node_graphs.close()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', default = 'targeted_build.log', help='name of log file')
+    parser.add_argument('--db_name', default = 'tweet_database', help='MongoDB database of the Tweet store, default tweet_database')
+    parser.add_argument('--load', nargs = '+', default = None,
+        help='add these Tweet files (or globs) to the store before building (Tweets already in the store are skipped)')
+    parser.add_argument('--tweet_ids', nargs = '+', default = ['-'], help='file(s) of seed Tweet IDs, one per line, default is stdin')
+    parser.add_argument('--max_in_memory_value', type = int, default = 10000,
+        help='maximum number of Tweets to hold in memory at a single time, default 10k')
+    parser.add_argument('--batch_size', type = int, default = 1000, help='number of Tweet ids per database query, default 1000')
+    stream_io.add_output_arguments(parser)
+    parser.add_argument('--brand_info', default = None)
+    parser.add_argument('--add_enrichments', action='store_true', help='add enrichment fields to the conversations')
+    parser.add_argument('--output_format', choices = ['json', 'binary'], default = 'json',
+        help='"json" (one conversation payload per line, default) or "binary" (see conversation_container.py)')
+    add_projection_arguments(parser)
+    parser.add_argument('--project_store', action='store_true',
+        help='trim the Tweets added with --load to --fields before they are stored (a smaller store, but the other fields are gone for good)')
+    stage_metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,level=logging.DEBUG, format='%(asctime)s: In file: %(name)s, On line %(lineno)d: %(message)s')
+    logging.debug('###################################################################### ' +
+        'building targeted conversations')
+    stage_metrics.configure_from_args(args)
+
+    projection = projection_from_args(args)
+    if args.project_store and (projection is None):
+        parser.error("--project_store needs --fields")
+    if args.load is not None:
+        client, db_name, tweet_collection = create_database(args.load, args.db_name, drop_if_nonempty = False,
+            projection = projection if args.project_store else None)
+    else:
+        client = pymongo.MongoClient()
+        tweet_collection = client[args.db_name]["tweet_collection"]
+    brands = get_brand_info(args.brand_info) if args.brand_info is not None else None
+    seed_ids = list(dict.fromkeys([x.strip() for x in stream_io.read_lines(args.tweet_ids) if x.strip() != ""]))
+
+    output = stream_io.writer_from_args(args)
+    enrich_metrics = stage_metrics.stage("add_enrichments") if args.add_enrichments else None
+    for conversation_payload in build_targeted_conversations(tweet_collection, seed_ids, args.max_in_memory_value, args.batch_size, projection):
+        if args.add_enrichments:
+            conversation_payload = add_enrichments.add_enrichments(conversation_payload)
+            if brands is not None:
+                conversation_payload = add_enrichments.add_brand_enrichments(conversation_payload, brands)
+            enrich_metrics.add_items()
+        write_conversation(conversation_payload, args.output_format, output)
+    if enrich_metrics is not None:
+        enrich_metrics.finish()
+    output.close()
+    client.close()